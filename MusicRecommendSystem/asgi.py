@@ -3,5 +3,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MusicRecommendSystem.settings')
+# ASGI部署时使用异步视图，推荐计算在线程池中执行，不阻塞其他请求
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -23,11 +23,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'music'  # 音乐推荐系统
+    'music.apps.MusicConfig'  # 音乐推荐系统
 ]
 
 # 中间件
 MIDDLEWARE = [
+    'music.metrics.MetricsMiddleware',  # 记录页面响应时间和查询数，见 /metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -116,3 +117,51 @@ MESSAGE_TAGS = {
     messages.WARNING: 'warning',
     messages.ERROR: 'danger',
 }
+
+# 离线训练的推荐模型保存目录
+MODEL_ROOT = os.path.join(BASE_DIR, 'models')
+# 每种算法保留的模型版本数，训练出新版本后删除更早的版本目录
+MODEL_KEEP_VERSIONS = 3
+# 推荐使用的模型：'svd'（Surprise的SVD，评分预测）或 'als'（隐式反馈交替最小二乘，music.als）
+RECOMMEND_ENGINE = 'svd'
+# 每个用户最多推荐的歌曲数
+RECOMMEND_TOP_K = 200
+# 混合推荐的权重：模型预测评分、属于订阅的流派、属于订阅的语种、歌曲热度（0到1），见music.hybrid
+HYBRID_WEIGHTS = {'model': 1.0, 'genre': 0.3, 'language': 0.2, 'popularity': 0.1}
+# 混合推荐使用的歌曲流派、语种和热度的缓存时间，单位为秒，曲库变化时立即刷新
+HYBRID_FEATURES_TIMEOUT = 60 * 10
+# 用户评分少于该数量时，每次喜欢/不喜欢都用全部评分重新求解用户向量，否则只做增量SGD，见music.fold_in
+FOLD_IN_SGD_MIN_RATINGS = 50
+# 歌曲数达到ANN_MIN_ITEMS后使用近似最近邻索引检索候选歌曲
+ANN_MIN_ITEMS = 10000
+# 每次查询检索的簇数，越大召回率越高、速度越慢
+ANN_NPROBE = 8
+
+# 缓存配置：曲库版本号、流派统计、推荐结果和用户向量需要在所有worker进程和管理命令之间共享，
+# 使用数据库缓存（缓存表由迁移 0009_cache_table 创建），也可以换成Redis或Memcached等共享缓存；
+# 不能使用进程内的LocMemCache，否则一个进程中的失效对其他进程不可见
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'music_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+# 推荐结果使用的缓存
+RECOMMEND_CACHE_ALIAS = 'default'
+# 推荐结果缓存时间，单位为秒
+RECOMMEND_CACHE_TIMEOUT = 60 * 30
+
+# 是否使用异步的推荐、搜索和播放视图，ASGI部署时由asgi.py开启
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+# 异步视图中执行推荐计算和数据库查询的线程数，限制同时进行的计算量
+RECOMMEND_EXECUTOR_WORKERS = int(os.environ.get('RECOMMEND_EXECUTOR_WORKERS', 4))
+
+# 相似歌曲的计算方式：'colike'（共同喜欢）或 'factors'（推荐模型的歌曲隐向量），见music.similarity
+SIMILAR_METHOD = 'colike'
+# 每首歌保存的相似歌曲数
+SIMILAR_TOP_N = 10
+# 在线更新一首歌的相似歌曲时最多读取的用户数
+SIMILAR_MAX_LIKERS = 1000
@@ -3,23 +3,30 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
-from music import views
+from music import api, async_views, metrics, views
+
+# ASGI部署时推荐、搜索和播放使用异步视图
+list_views = async_views if settings.ASYNC_VIEWS else views
 
 # 主路由
 urlpatterns = [
     path('grappelli/', include('grappelli.urls')),  # 后台
     path('admin/', admin.site.urls),  # 后台
     path('', views.home),  # 首页
-    path('recommend', views.recommend),  # 推荐
+    path('recommend', list_views.recommend),  # 推荐
     path('sign_in', views.sign_in),  # 登录
     path('sign_up', views.sign_up),  # 注册
     path('logout', views.user_logout),  # 退出
     path('like/<int:pk>', views.like),  # 喜欢
     path('dislike/<int:pk>', views.dislike),  # 不喜欢
-    path('play', views.play),  # 播放
-    path('play/<int:pk>', views.play),  # 播放
+    path('play', list_views.play),  # 播放
+    path('play/<int:pk>', list_views.play),  # 播放
     path('user', views.user_center),  # 用户中心
-    path('search', views.search),  # 搜索
+    path('search', list_views.search),  # 搜索
+    path('api/musics', api.musics),  # 全部歌曲接口
+    path('api/recommend', api.recommend),  # 推荐接口
+    path('api/search', api.search),  # 搜索接口
+    path('metrics', metrics.metrics_view),  # Prometheus指标
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
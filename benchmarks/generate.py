@@ -0,0 +1,97 @@
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from music.catalog import catalog_changed, sync_music_labels
+from music.models import Music, UserProfile
+from music.search import index_musics
+from music.subscribe import genre_labels, language_labels
+
+'''
+合成数据生成器
+歌曲：每首歌1~3个流派、1~2个语种（用 '|' 连接，与真实数据相同），歌名和歌手由中英文字符随机组成；
+用户：每个用户喜欢 songs × density 首歌，不喜欢的歌曲数为喜欢的四分之一，
+歌曲被选中的概率服从长尾分布（少数热门歌曲被大量用户喜欢）。
+相同的参数和随机种子生成完全相同的数据，便于对比多次运行的结果。
+'''
+
+GENRES = sorted(set(genre_labels.values()))
+LANGUAGES = sorted(set(language_labels.values()))
+# 歌名和歌手使用的字符，包括中文和英文，覆盖搜索的n-gram索引
+CHARACTERS = list('我的你爱情歌夜雨风花月光心梦天海星时间回忆城市') + list('abcdefghijklmnopqrstuvwxyz')
+PASSWORD = 'benchmark'
+
+BATCH_SIZE = 2000
+
+
+def _random_text(rng, min_length, max_length):
+    return ''.join(rng.choice(CHARACTERS, rng.integers(min_length, max_length + 1)))
+
+
+def _random_labels(rng, labels, max_count):
+    return '|'.join(rng.choice(labels, rng.integers(1, max_count + 1), replace=False))
+
+
+# 生成歌曲，返回歌曲id数组
+def generate_musics(rng, songs):
+    musics = [Music(song_name=_random_text(rng, 2, 8), song_length=int(rng.integers(120000, 360000)),
+                    genre_ids=_random_labels(rng, GENRES, 3), artist_name=_random_text(rng, 2, 4),
+                    composer=_random_text(rng, 2, 4), lyricist=_random_text(rng, 2, 4),
+                    language=_random_labels(rng, LANGUAGES, 2))
+              for _ in range(songs)]
+    for start in range(0, songs, BATCH_SIZE):
+        Music.objects.bulk_create(musics[start:start + BATCH_SIZE])
+    # bulk_create不触发信号，手动同步流派语种和搜索索引
+    musics = list(Music.objects.order_by('pk'))
+    for start in range(0, len(musics), BATCH_SIZE):
+        sync_music_labels(musics[start:start + BATCH_SIZE])
+        index_musics(musics[start:start + BATCH_SIZE])
+    catalog_changed()
+    return np.array([music.pk for music in musics], dtype=np.int64)
+
+
+# 生成用户及其喜欢/不喜欢的歌曲
+def generate_users(rng, users, music_ids, density):
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([User(username=f'bench{i}', password=password) for i in range(users)],
+                             batch_size=BATCH_SIZE)
+    user_objs = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, first_run=False,
+                    genre_subscribe=','.join(rng.choice(GENRES, 2, replace=False)),
+                    language_subscribe=','.join(rng.choice(LANGUAGES, 1)))
+        for user in user_objs
+    ], batch_size=BATCH_SIZE)
+    profile_ids = list(UserProfile.objects.filter(user__in=user_objs).order_by('pk').values_list('pk', flat=True))
+
+    # 长尾分布：排名为r的歌曲被选中的概率正比于 1 / r^0.8
+    popularity = 1.0 / np.arange(1, len(music_ids) + 1) ** 0.8
+    popularity = popularity[rng.permutation(len(music_ids))]
+    popularity /= popularity.sum()
+    n_likes = max(1, int(len(music_ids) * density))
+    n_dislikes = max(1, n_likes // 4)
+    n_rated = min(n_likes + n_dislikes, len(music_ids))
+
+    likes_through = UserProfile.likes.through
+    dislikes_through = UserProfile.dislikes.through
+    likes, dislikes = [], []
+    for profile_id in profile_ids:
+        rated = rng.choice(music_ids, n_rated, replace=False, p=popularity)
+        likes.extend(likes_through(userprofile_id=profile_id, music_id=int(music_id)) for music_id in rated[:n_likes])
+        dislikes.extend(dislikes_through(userprofile_id=profile_id, music_id=int(music_id))
+                        for music_id in rated[n_likes:])
+        if len(likes) >= BATCH_SIZE:
+            likes_through.objects.bulk_create(likes)
+            dislikes_through.objects.bulk_create(dislikes)
+            likes, dislikes = [], []
+    likes_through.objects.bulk_create(likes)
+    dislikes_through.objects.bulk_create(dislikes)
+
+
+# 生成 users个用户 × songs首歌曲 的合成数据，density为每个用户喜欢的歌曲占比
+def generate(users, songs, density, seed=0):
+    rng = np.random.default_rng(seed)
+    with transaction.atomic():
+        music_ids = generate_musics(rng, songs)
+        generate_users(rng, users, music_ids, density)
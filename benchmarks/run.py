@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不记录内存峰值
+    resource = None
+
+'''
+基准测试：在SQLite上生成合成数据，测量推荐、订阅和各个页面的耗时、查询数和内存
+    python -m benchmarks.run --users 500 --songs 5000 --density 0.01 --output result.json
+对比两次运行，耗时超过基准的 threshold 倍或查询数增加时以非0状态退出：
+    python -m benchmarks.run --compare baseline.json --output result.json
+输出的JSON中每一项包括：
+    wall_time   多次运行耗时的中位数，单位为秒
+    min_time    最短耗时
+    queries     一次运行执行的SQL查询数
+内存峰值是整个进程累计的最大值，无法归到单独的项目，只在所有项目运行结束后记录一次（peak_rss_kb，单位为KB），
+没有 resource 模块的平台（Windows）上为 null。
+'''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='音乐推荐系统基准测试')
+    parser.add_argument('--users', type=int, default=200, help='用户数')
+    parser.add_argument('--songs', type=int, default=2000, help='歌曲数')
+    parser.add_argument('--density', type=float, default=0.02, help='每个用户喜欢的歌曲占比')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--factors', type=int, default=50, help='隐向量维度')
+    parser.add_argument('--epochs', type=int, default=10, help='训练轮数')
+    parser.add_argument('--repeat', type=int, default=5, help='每一项重复运行的次数')
+    parser.add_argument('--root', default=None, help='数据库和模型目录，默认使用临时目录；目录中已有数据时复用')
+    parser.add_argument('--output', default=None, help='结果保存的JSON文件，默认输出到标准输出')
+    parser.add_argument('--compare', default=None, help='作为基准的JSON文件')
+    parser.add_argument('--threshold', type=float, default=1.25, help='耗时超过基准的倍数时视为性能退化')
+    parser.add_argument('--only', default=None, help='只运行名称包含该字符串的项目')
+    return parser.parse_args()
+
+
+# 进程的内存峰值，单位为KB，无法获取时返回None
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+# 运行一项基准测试，setup在每次运行前调用，不计入耗时
+def measure(function, repeat, setup=None):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    times = []
+    queries = 0
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+        if i == 0:
+            queries = len(captured)
+    return {
+        'wall_time': statistics.median(times),
+        'min_time': min(times),
+        'queries': queries,
+    }
+
+
+def prepare(args):
+    from django.core.management import call_command
+
+    from django.contrib.auth.models import User
+
+    from benchmarks.generate import generate
+    from music.ann import build_index
+    from music.factor_model import latest_version, save_model, train_svd
+    from music.recommend import build_df
+
+    timings = {}
+    started = time.perf_counter()
+    call_command('migrate', verbosity=0)
+    # 指定的目录中已经生成过数据时直接复用
+    if User.objects.filter(username__startswith='bench').exists() and latest_version() is not None:
+        return timings
+    generate(args.users, args.songs, args.density, args.seed)
+    timings['generate'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    model = train_svd(build_df(), n_factors=args.factors, n_epochs=args.epochs)
+    save_model(model, build_index(model))
+    timings['train'] = time.perf_counter() - started
+    return timings
+
+
+def benchmarks():
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.cache import caches
+    from django.test import Client
+
+    from music import hybrid, recommend, subscribe
+    from music.catalog import invalidate_facets
+    from music.models import UserProfile
+
+    user = User.objects.filter(username__startswith='bench').order_by('pk').first()
+    profile = UserProfile.objects.get(user=user)
+    client = Client()
+    client.force_login(user)
+    keyword = profile.likes.first().song_name[:2]
+
+    def fresh_profile():
+        # 每次运行使用新的用户资料对象，避免缓存的喜欢列表影响结果
+        return UserProfile.objects.select_related('user').get(pk=profile.pk)
+
+    def clear_recommend_cache():
+        caches[settings.RECOMMEND_CACHE_ALIAS].clear()
+
+    def get(url):
+        def request():
+            response = client.get(url)
+            assert response.status_code == 200, f'{url} 返回 {response.status_code}'
+            # 流式响应在读取时才生成内容，必须在计时范围内读完
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return request
+
+    yield 'build_df', recommend.build_df, None
+    yield 'build_predictions', lambda: recommend.build_predictions(fresh_profile()), None
+    yield 'hybrid.load_features (cold)', hybrid.load_features, hybrid.clear_features
+    yield 'hybrid.rank_musics (cold start)', lambda: hybrid.rank_musics(fresh_profile(), settings.RECOMMEND_TOP_K), None
+    yield 'subscribe.build_genre_ids (cold)', subscribe.build_genre_ids, invalidate_facets
+    yield 'subscribe.build_genre_ids', subscribe.build_genre_ids, None
+    yield 'view /', get('/'), None
+    yield 'view /recommend (cold)', get('/recommend'), clear_recommend_cache
+    yield 'view /recommend', get('/recommend'), None
+    yield 'view /recommend?page=2', get('/recommend?page=2'), None
+    yield 'view /search', get(f'/search?keyword={keyword}&action=song_name'), None
+    yield 'view /user', get('/user'), None
+    yield 'view /play', get(f'/play/{profile.likes.first().pk}'), None
+    yield 'view /api/musics', get('/api/musics'), None
+    yield 'view /api/recommend', get('/api/recommend'), None
+    yield 'view /api/search', get(f'/api/search?keyword={keyword}'), None
+
+
+# 与基准结果对比，返回性能退化的项目
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['wall_time'] > base['wall_time'] * threshold:
+            regressions.append(f'{name}: 耗时 {base["wall_time"]:.4f}s -> {result["wall_time"]:.4f}s')
+        if result['queries'] > base['queries']:
+            regressions.append(f'{name}: 查询数 {base["queries"]} -> {result["queries"]}')
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.root:
+        os.makedirs(args.root, exist_ok=True)
+        os.environ['BENCHMARK_ROOT'] = args.root
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    django.setup()
+
+    prepare_timings = prepare(args)
+    results = {}
+    for name, function, setup in benchmarks():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(function, args.repeat, setup)
+        print(f'{name:<40} {results[name]["wall_time"] * 1000:10.2f} ms {results[name]["queries"]:5d} 次查询',
+              file=sys.stderr)
+
+    report = {
+        'params': {key: getattr(args, key) for key in ('users', 'songs', 'density', 'seed', 'factors', 'epochs',
+                                                      'repeat')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'django': django.get_version()},
+        'prepare': prepare_timings,
+        'results': results,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        for regression in regressions:
+            print(f'性能退化 {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+from MusicRecommendSystem.settings import *
+
+# 基准测试使用独立的SQLite数据库和模型目录，不影响开发数据库
+BENCHMARK_ROOT = os.environ.get('BENCHMARK_ROOT') or tempfile.mkdtemp(prefix='mrs-benchmark-')
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_ROOT, 'db.sqlite3'),
+    }
+}
+
+MODEL_ROOT = os.path.join(BENCHMARK_ROOT, 'models')
+
+# 生成大量用户时不需要安全的密码哈希
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+ASYNC_VIEWS = False
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Music, UserProfile
+from .models import Genre, Language, Music, UserProfile
+from .pagination import CachedCountPaginator
 
 admin.site.site_title = "音乐推荐系统后台管理系统"
 admin.site.site_header = "音乐推荐系统-后台管理系统"
@@ -18,8 +19,13 @@ class MusicAdmin(admin.ModelAdmin):
     list_filter = ['language']
     # 设置每页现实的数据量
     list_per_page = 12
+    # 总数从缓存读取，不在每次翻页时统计整张表
+    paginator = CachedCountPaginator
+    show_full_result_count = False
     # 设置排序
     ordering = ['id']
+    # 流派和语种关系由genre_ids、language字段自动同步，不在表单中编辑
+    exclude = ['genres', 'languages']
 
 
 @admin.register(UserProfile)
@@ -36,3 +42,10 @@ class UserProfileAdmin(admin.ModelAdmin):
 
     def user_id(self, obj: UserProfile):
         return obj.user.id
+
+
+@admin.register(Genre, Language)
+class LabelAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'name']
+    search_fields = ['name']
+    ordering = ['name']
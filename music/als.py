@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from music.factor_model import FactorModel, new_version
+from music.interactions import Interactions
+from music.metrics import timed
+
+'''
+隐式反馈的交替最小二乘（ALS，Hu, Koren & Volinsky 2008）
+用户的喜欢/不喜欢不是"评分"，而是偏好 p（喜欢为1，不喜欢为0）和置信度 c = 1 + alpha：
+没有评分的歌曲视为偏好0、置信度1，不喜欢的歌曲是置信度更高的0。
+最小化 sum c_ui (p_ui - x_u · y_i)^2 + reg (|x_u|^2 + |y_i|^2)，
+固定物品向量Y求解所有用户向量X，再固定X求解Y，交替进行。
+每个用户的方程为 (Y^T Y + Y^T (C_u - I) Y + reg I) x_u = Y^T C_u p_u，
+Y^T Y 对所有用户相同只算一次，其余部分只涉及该用户评分过的歌曲，
+用几步共轭梯度（CG）近似求解，所有用户的CG同时进行，每一步都是稀疏矩阵和NumPy的整块运算。
+训练得到的隐向量与SVD模型格式相同（偏差全为0），打分、近似最近邻索引和批量推荐直接复用。
+'''
+
+
+class _Block:
+    # 一批用户（或物品）的评分：confidence 为 c - 1，target 为 c * p，都是CSR稀疏矩阵
+    def __init__(self, confidence: sp.csr_matrix, target: sp.csr_matrix):
+        self.confidence = confidence
+        self.target = target
+        # 每个非零元素所在的行，用于按行计算 x_u · y_i
+        self.rows = np.repeat(np.arange(confidence.shape[0]), np.diff(confidence.indptr))
+
+
+# 计算 A x = x (Y^T Y + reg I) + sum_i (c_ui - 1)(x_u · y_i) y_i，对块内所有行同时计算
+def _apply(block: _Block, x, factors, gramian):
+    dots = np.einsum('ij,ij->i', x[block.rows], factors[block.confidence.indices])
+    weighted = sp.csr_matrix((block.confidence.data * dots, block.confidence.indices, block.confidence.indptr),
+                             shape=block.confidence.shape)
+    return x @ gramian + weighted @ factors
+
+
+# 以x为初值，用cg_steps步共轭梯度求解块内所有行的隐向量
+def _solve_block(block: _Block, x, factors, gramian, cg_steps):
+    x = x.copy()
+    r = block.target @ factors - _apply(block, x, factors, gramian)
+    p = r.copy()
+    rs = np.einsum('ij,ij->i', r, r)
+    for _ in range(cg_steps):
+        if not rs.any():
+            break
+        ap = _apply(block, p, factors, gramian)
+        denominator = np.einsum('ij,ij->i', p, ap)
+        alpha = np.divide(rs, denominator, out=np.zeros_like(rs), where=denominator > 0)
+        x += alpha[:, None] * p
+        r -= alpha[:, None] * ap
+        rs_new = np.einsum('ij,ij->i', r, r)
+        beta = np.divide(rs_new, rs, out=np.zeros_like(rs), where=rs > 0)
+        p = r + beta[:, None] * p
+        rs = rs_new
+    return x
+
+
+# 把稀疏矩阵按行切分为多块，每块交给一个线程
+def _split(confidence: sp.csr_matrix, target: sp.csr_matrix, n_blocks):
+    bounds = np.linspace(0, confidence.shape[0], n_blocks + 1).astype(int)
+    return [(start, _Block(confidence[start:end], target[start:end]))
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+# 固定另一侧的隐向量，更新所有行的隐向量
+def _update(blocks, x, factors, reg, cg_steps, executor):
+    gramian = factors.T @ factors + reg * np.eye(factors.shape[1])
+
+    def solve(item):
+        start, block = item
+        x[start:start + block.confidence.shape[0]] = _solve_block(
+            block, x[start:start + block.confidence.shape[0]], factors, gramian, cg_steps)
+
+    list(executor.map(solve, blocks))
+
+
+# 评分数据转换为置信度矩阵和目标矩阵（用户×歌曲），返回（置信度-1, c*p, 用户id, 歌曲id）
+def build_matrices(interactions: Interactions, alpha):
+    user_ids, user_rows = np.unique(interactions.user_ids, return_inverse=True)
+    item_ids, item_cols = np.unique(interactions.item_ids, return_inverse=True)
+    shape = (len(user_ids), len(item_ids))
+    confidence = sp.csr_matrix((np.full(len(user_rows), alpha, dtype=np.float64), (user_rows, item_cols)),
+                               shape=shape)
+    target = sp.csr_matrix(((1 + alpha) * interactions.ratings.astype(np.float64), (user_rows, item_cols)),
+                           shape=shape)
+    # 重复的评分（例如读取期间改为不喜欢）只保留一份
+    confidence.data = np.minimum(confidence.data, alpha)
+    target.data = np.minimum(target.data, 1 + alpha)
+    return confidence, target, user_ids.astype(np.int64), item_ids.astype(np.int64)
+
+
+# 训练隐式反馈ALS模型，threads为并行求解的线程数，默认为CPU核数
+@timed('train')
+def train_als(interactions: Interactions, n_factors=64, n_iterations=15, reg=0.01, alpha=40.0, cg_steps=3,
+              threads=None, seed=0):
+    confidence, target, user_ids, item_ids = build_matrices(interactions, alpha)
+    threads = threads or os.cpu_count() or 1
+    user_blocks = _split(confidence, target, threads)
+    item_blocks = _split(confidence.T.tocsr(), target.T.tocsr(), threads)
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.01, (len(user_ids), n_factors))
+    item_factors = rng.normal(0, 0.01, (len(item_ids), n_factors))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in range(n_iterations):
+            _update(user_blocks, user_factors, item_factors, reg, cg_steps, executor)
+            _update(item_blocks, item_factors, user_factors, reg, cg_steps, executor)
+
+    return FactorModel(version=new_version(),
+                       global_mean=0.0,
+                       user_bias=np.zeros(len(user_ids)),
+                       item_bias=np.zeros(len(item_ids)),
+                       user_factors=user_factors,
+                       item_factors=item_factors,
+                       user_ids=user_ids,
+                       item_ids=item_ids,
+                       reg=reg,
+                       engine='als',
+                       alpha=alpha)
+
+
+# 固定物品向量，根据一个用户的评分精确求解用户向量（新用户或在线更新），偏差为0
+def fold_in_als(model: FactorModel, inner_ids, ratings):
+    factors = model.item_factors[inner_ids]
+    confidence = 1 + model.alpha
+    a = model.item_gramian + model.alpha * factors.T @ factors + model.reg * np.eye(model.n_factors)
+    b = factors.T @ (confidence * ratings)
+    return np.linalg.solve(a, b), 0.0
@@ -0,0 +1,130 @@
+import os
+import threading
+
+import numpy as np
+
+from music.factor_model import INDEX_DIR, FactorModel, model_path
+from music.scoring import score_items, top_k
+
+'''
+歌曲隐向量的近似最近邻索引（倒排聚类索引，IVF）
+预测评分去掉与歌曲无关的 mu + b_u 后为 b_i + q_i·p_u，
+把歌曲表示为 [q_i, b_i]、用户表示为 [p_u, 1]，问题就变成了最大内积检索。
+1. 建索引：用k-means把歌曲向量分成若干簇，每个簇保存属于它的歌曲（倒排列表）
+2. 查询：按用户向量与簇中心的内积选出nprobe个簇，只对这些簇中的歌曲精确打分
+nprobe越大召回率越高、速度越慢，nprobe等于簇数时与全量打分结果一致。
+'''
+
+
+# 索引目录中的数组文件，与IVFIndex的构造参数顺序一致
+ARRAYS = ('centroids', 'list_offsets', 'list_items')
+
+
+class IVFIndex:
+    def __init__(self, centroids, list_offsets, list_items):
+        self.centroids = centroids  # 簇中心，簇数×(隐向量维度+1)
+        self.list_offsets = list_offsets  # 第i个簇的歌曲为 list_items[list_offsets[i]:list_offsets[i + 1]]
+        self.list_items = list_items  # 按簇排列的歌曲内部id
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    # 返回与用户向量最相关的nprobe个簇中的歌曲内部id
+    def candidates(self, user_factor, nprobe):
+        query = np.append(user_factor, 1.0)
+        nprobe = min(max(nprobe, 1), self.n_lists)
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_items[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+
+    # 每个数组保存为path目录中的一个 .npy 文件
+    def save(self, path):
+        os.makedirs(path)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+
+    # 以只读的内存映射打开，多个worker进程共用页缓存中的一份
+    @classmethod
+    def load(cls, path):
+        return cls(*[np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS])
+
+
+# 计算每个向量最近的簇中心，分块计算避免占用过多内存
+def _assign(vectors, centroids, chunk_size=65536):
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        # |x - c|² = |x|² - 2x·c + |c|²，|x|²对同一个x都一样，可以省略
+        assignments[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignments
+
+
+# k-means聚类，样本太多时只用随机抽取的部分样本训练簇中心
+def _kmeans(vectors, n_lists, n_iter=20, max_samples=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    if len(vectors) > max_samples:
+        vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # 空簇保持原来的中心不变
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+
+# 为模型的歌曲隐向量建立索引，n_lists默认为歌曲数的平方根
+def build_index(model: FactorModel, n_lists=None, n_iter=20, seed=0):
+    vectors = np.hstack([model.item_factors, model.item_bias[:, None]])
+    n_lists = n_lists or int(np.sqrt(len(vectors)))
+    n_lists = min(max(n_lists, 1), len(vectors))
+    centroids = _kmeans(vectors, n_lists, n_iter=n_iter, seed=seed)
+    assignments = _assign(vectors, centroids)
+    list_items = np.argsort(assignments, kind='stable')
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+    return IVFIndex(centroids, list_offsets, list_items)
+
+
+# 用训练集中的用户估计索引的召回率：近似检索的前k个结果中，有多少在精确打分的前k个结果中
+def evaluate_recall(model: FactorModel, index: IVFIndex, k, nprobe, n_queries=200, seed=0):
+    rng = np.random.default_rng(seed)
+    n_queries = min(n_queries, len(model.user_ids))
+    recalls = []
+    for inner_uid in rng.choice(len(model.user_ids), n_queries, replace=False):
+        user_factor, user_bias = model.user_factors[inner_uid], model.user_bias[inner_uid]
+        scores = score_items(model, user_factor, user_bias)
+        exact = top_k(scores, k)
+        candidates = index.candidates(user_factor, nprobe)
+        approx = candidates[top_k(scores[candidates], k)]
+        recalls.append(len(np.intersect1d(exact, approx)) / max(len(exact), 1))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+# 索引与模型一起由 save_model(model, index) 写入模型目录的 ivf/ 子目录，随模型版本一起发布
+def _index_path(model: FactorModel):
+    return os.path.join(model_path(model.engine, model.version), INDEX_DIR)
+
+
+# 已加载的索引，模型版本不变时不再重复读取文件
+_loaded_indexes = {}
+# 多线程处理请求时，新版本的索引只由一个线程读取
+_loaded_indexes_lock = threading.Lock()
+
+
+# 加载模型对应的索引，没有建立索引时返回None
+def load_index(model: FactorModel):
+    global _loaded_indexes
+    key = (model.engine, model.version)
+    loaded = _loaded_indexes
+    if key in loaded:
+        return loaded[key]
+    with _loaded_indexes_lock:
+        if key not in _loaded_indexes:
+            path = _index_path(model)
+            # 整体替换字典而不是先清空再写入，其他线程不会读到空的缓存
+            _loaded_indexes = {key: IVFIndex.load(path) if os.path.isdir(path) else None}
+        return _loaded_indexes[key]
@@ -0,0 +1,131 @@
+import hashlib
+import json
+
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+
+from .catalog import catalog_version
+from .cursors import decode_cursor, encode_cursor
+from .factor_model import latest_version
+from .models import Music
+from .pagination import KeysetPaginator
+from .profiles import get_profile
+from .recommend import build_recommend_ids
+from .search import search_musics
+
+'''
+JSON接口，供移动端和边缘缓存使用
+GET /api/musics              全部歌曲，按id排序
+GET /api/recommend           当前用户的推荐歌曲（需要登录）
+GET /api/search?keyword=...  搜索歌曲，action=song_name/artist_name
+通用参数：
+    limit   每页数量，默认20，最多100
+    fields  返回的字段，逗号分隔，默认 id,song_name,artist_name
+    cursor  上一页返回的next，取下一页
+响应：{"items": [...], "next": "下一页游标，没有下一页时为null"}
+响应带ETag，内容没有变化时返回304。
+'''
+
+# 允许返回的字段
+MUSIC_FIELDS = ['id', 'song_name', 'song_length', 'genre_ids', 'artist_name', 'composer', 'lyricist', 'language',
+                'url']
+DEFAULT_FIELDS = ['id', 'song_name', 'artist_name']
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+# 解析通用参数，参数错误时抛出ValueError
+def _parse_params(request):
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else DEFAULT_FIELDS
+    if any(field not in MUSIC_FIELDS for field in fields):
+        raise ValueError(f'fields只能是 {",".join(MUSIC_FIELDS)}')
+    if 'id' not in fields:
+        fields = ['id'] + fields
+    limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f'limit需要在1到{MAX_LIMIT}之间')
+    return fields, limit, request.GET.get('cursor')
+
+
+# 按id列表的顺序逐条输出歌曲，只查询需要的字段
+def _iter_items(music_ids, fields):
+    rows = {row['id']: row for row in Music.objects.filter(pk__in=music_ids).values(*fields).iterator()}
+    for music_id in music_ids:
+        if music_id in rows:
+            yield rows[music_id]
+
+
+# 流式输出JSON，内容没有变化（ETag相同）时返回304
+def _respond(request, etag_parts, music_ids, fields, next_cursor):
+    etag = '"%s"' % hashlib.md5(json.dumps([etag_parts, music_ids, fields]).encode()).hexdigest()
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    def stream():
+        yield '{"items":['
+        for index, item in enumerate(_iter_items(music_ids, fields)):
+            yield (',' if index else '') + json.dumps(item, ensure_ascii=False)
+        yield '],"next":%s}' % json.dumps(next_cursor)
+
+    response = StreamingHttpResponse(stream(), content_type='application/json; charset=utf-8')
+    response['ETag'] = etag
+    return response
+
+
+# 全部歌曲，按id键集分页
+def musics(request):
+    try:
+        fields, limit, cursor = _parse_params(request)
+        page = KeysetPaginator(Music.objects.values('id'), limit, keys=('id',)).page(after=cursor)
+    except ValueError as e:
+        return _error(str(e))
+    music_ids = [row['id'] for row in page]
+    return _respond(request, ['musics', catalog_version()], music_ids, fields, page.next_cursor)
+
+
+# 当前用户的推荐歌曲，从缓存的推荐结果中截取，游标记录偏移量和模型版本
+def recommend(request):
+    profile = get_profile(request)
+    if profile is None:
+        return _error('请先登录', status=401)
+    try:
+        fields, limit, cursor = _parse_params(request)
+    except ValueError as e:
+        return _error(str(e))
+    version = latest_version()
+    position = decode_cursor(cursor) if cursor else {}
+    if position is None:
+        return _error('cursor无效')
+    if position and position.get('version') != version:
+        return _error('推荐模型已更新，请从第一页重新获取', status=409)
+    offset = position.get('offset', 0)
+    # bool是int的子类，需要单独排除
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        return _error('cursor无效')
+    recommend_ids = build_recommend_ids(request, profile)
+    music_ids = recommend_ids[offset:offset + limit]
+    next_cursor = None
+    if offset + limit < len(recommend_ids):
+        next_cursor = encode_cursor({'offset': offset + limit, 'version': version})
+    return _respond(request, ['recommend', request.user.pk, version, catalog_version()], music_ids, fields,
+                    next_cursor)
+
+
+# 搜索歌曲，按（得分，id）键集分页
+def search(request):
+    keyword = request.GET.get('keyword', '')
+    action = request.GET.get('action')
+    try:
+        fields, limit, cursor = _parse_params(request)
+        paginator = KeysetPaginator(search_musics(keyword, action), limit, keys=('-score', 'music_pk'))
+        page = paginator.page(after=cursor)
+    except ValueError as e:
+        return _error(str(e))
+    music_ids = [row['music_pk'] for row in page]
+    return _respond(request, ['search', keyword, action, catalog_version()], music_ids, fields, page.next_cursor)
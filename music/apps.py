@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MusicConfig(AppConfig):
     name = 'music'
     verbose_name = "音乐推荐系统"
+
+    def ready(self):
+        from . import signals  # noqa: F401 注册信号
@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db import close_old_connections
+from django.http import HttpResponseRedirect
+from django.shortcuts import render
+from django.utils.http import urlencode
+
+from .decorators import cold_boot
+from .metrics import span
+from .profiles import get_profile
+from .recommend import build_recommend_ids
+from .similarity import related_musics
+from .views import play_music, recommend_page, search_page
+
+'''
+异步视图，ASGI部署时（asgi.py）代替同步的推荐、搜索和播放视图
+推荐打分（NumPy矩阵运算）和数据库查询在有界线程池中执行，不阻塞事件循环，
+一个用户的推荐计算较慢时，同一个进程中的其他请求照常处理；
+线程池大小限制了同时进行的计算量（settings.RECOMMEND_EXECUTOR_WORKERS）。
+同一个用户同时发起多个推荐请求（例如连续刷新）时，只计算一次，其他请求等待同一个结果。
+'''
+
+_executor = ThreadPoolExecutor(max_workers=settings.RECOMMEND_EXECUTOR_WORKERS, thread_name_prefix='recommend')
+# 每个事件循环中正在进行的计算：键 -> Future
+_inflight = weakref.WeakKeyDictionary()
+
+
+def _call(function):
+    # 线程池中的线程不经过请求的开始和结束信号，需要自己关闭过期的数据库连接
+    close_old_connections()
+    try:
+        return function()
+    finally:
+        close_old_connections()
+
+
+# 在线程池中执行同步函数，复制当前请求的上下文，线程中执行的查询计入该请求的指标（music.metrics）
+async def run_in_executor(function, *args, **kwargs):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, context.run, _call, functools.partial(function, *args, **kwargs))
+
+
+# 键相同的计算同时只执行一次，后来的请求等待正在进行的计算结果
+async def coalesce(key, function, *args):
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(run_in_executor(function, *args))
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+    # 某个请求断开时不取消其他请求共享的计算
+    return await asyncio.shield(future)
+
+
+# 复用同步视图的登录和冷启动检查，检查通过时返回None，否则返回跳转响应
+_require_login = login_required(cold_boot(lambda request: None), login_url='/sign_in')
+
+
+def _render(request, template_name, context):
+    with span('render'):
+        return render(request, template_name, context)
+
+
+def _list_context(request, musics, **extra):
+    context = {
+        'musics': musics,
+        'user_likes': [],
+        'user_dislikes': [],
+        **extra
+    }
+    user_profile = get_profile(request)
+    if user_profile is not None:
+        context['user_likes'] = user_profile.like_ids
+        context['user_dislikes'] = user_profile.dislike_ids
+    return context
+
+
+async def recommend(request):
+    response = await sync_to_async(_require_login)(request)
+    if response is not None:
+        return response
+    user_profile = await sync_to_async(get_profile)(request)
+    # 获取推荐的歌曲id，同一个用户的并发请求共用一次计算
+    recommend_ids = await coalesce(('recommend', user_profile.user_id), build_recommend_ids, request, user_profile)
+    musics = await run_in_executor(recommend_page, recommend_ids, request.GET.get('page', 1))
+    context = await run_in_executor(_list_context, request, musics)
+    return await sync_to_async(_render)(request, 'list.html', context)
+
+
+async def search(request):
+    if 'keyword' not in request.GET:
+        await sync_to_async(messages.error)(request, '请输入搜索关键词')
+        return HttpResponseRedirect('/')
+    keyword = request.GET.get('keyword')
+    action = request.GET.get('action')
+    count, musics = await run_in_executor(search_page, keyword, action, request.GET.get('after'),
+                                          request.GET.get('before'))
+    await sync_to_async(messages.info)(request, f'搜索关键词：{keyword}，找到 {count} 首音乐')
+    context = await run_in_executor(
+        _list_context, request, musics,
+        page_params=urlencode({'keyword': keyword, 'action': action or ''}) + '&')  # 翻页时保留搜索条件
+    return await sync_to_async(_render)(request, 'list.html', context)
+
+
+async def play(request, pk: int = 0):
+    music_obj = await run_in_executor(play_music, request, pk)
+    if music_obj is None:
+        await sync_to_async(messages.error)(request, '当前没有正在播放的音乐')
+        return HttpResponseRedirect('/')
+    related = await run_in_executor(related_musics, music_obj.pk)
+    return await sync_to_async(_render)(request, 'play.html', {'music': music_obj, 'related_musics': related})
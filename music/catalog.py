@@ -0,0 +1,97 @@
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from music.models import Genre, Language, Music
+
+'''
+歌曲流派和语种的倒排索引
+Music.genre_ids 和 Music.language 是用 '|' 连接的多个值，例如 '流行|摇滚'，
+按字符串精确匹配会漏掉多流派的歌曲，也无法使用索引。
+这里把它们拆分后保存到 Genre / Language 的多对多关系中，
+每个流派（语种）对应的歌曲就是一个倒排列表，混合排序时读取为 歌曲×流派 的稀疏矩阵（见 hybrid.py）。
+'''
+
+
+# 拆分 '|' 连接的多个值，去除空白字符和空值
+def split_labels(value):
+    labels = []
+    for label in (value or '').split('|'):
+        label = label.strip()
+        if label and label not in labels:
+            labels.append(label)
+    return labels
+
+
+# 按名称获取流派/语种，不存在的自动创建，返回 名称 -> id
+def _label_ids(model, names):
+    names = set(names)
+    if not names:
+        return {}
+    model.objects.bulk_create([model(name=name) for name in names], ignore_conflicts=True)
+    return dict(model.objects.filter(name__in=names).values_list('name', 'pk'))
+
+
+# 替换一批歌曲的多对多关系
+def _replace_relations(through, field, musics, labels_of, label_ids):
+    music_ids = [music.pk for music in musics]
+    through.objects.filter(music_id__in=music_ids).delete()
+    through.objects.bulk_create([through(**{'music_id': music.pk, field: label_ids[label]})
+                                 for music in musics for label in labels_of[music.pk]])
+
+
+# 根据genre_ids和language字段同步一批歌曲的流派和语种
+# 歌曲保存时由信号自动调用，bulk_create/update等绕过信号的批量操作需要手动调用
+def sync_music_labels(musics):
+    musics = [music for music in musics if music.pk is not None]
+    if not musics:
+        return
+    genres_of = {music.pk: split_labels(music.genre_ids) for music in musics}
+    languages_of = {music.pk: split_labels(music.language) for music in musics}
+    genre_ids = _label_ids(Genre, [label for labels in genres_of.values() for label in labels])
+    language_ids = _label_ids(Language, [label for labels in languages_of.values() for label in labels])
+    _replace_relations(Music.genres.through, 'genre_id', musics, genres_of, genre_ids)
+    _replace_relations(Music.languages.through, 'language_id', musics, languages_of, language_ids)
+
+
+FACETS_CACHE_KEY = 'catalog-facets'
+CATALOG_VERSION_KEY = 'catalog-version'
+# 流派统计的缓存时间，单位为秒；歌曲变化时立即清除，超时只是兜底
+FACETS_CACHE_TIMEOUT = 60 * 60
+
+
+# 所有流派和语种及其歌曲数，按首次出现的顺序排列，只统计至少有一首歌曲的
+# 结果保存在共享缓存中，歌曲变化时由信号或批量导入命令清除，所有进程都能看到
+def build_facets():
+    facets = cache.get(FACETS_CACHE_KEY)
+    if facets is None:
+        facets = {
+            'genres': list(Genre.objects.annotate(count=Count('musics')).filter(count__gt=0)
+                           .order_by('pk').values_list('name', 'count')),
+            'languages': list(Language.objects.annotate(count=Count('musics')).filter(count__gt=0)
+                              .order_by('pk').values_list('name', 'count')),
+        }
+        cache.set(FACETS_CACHE_KEY, facets, FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+# 歌曲新增、修改、删除后清除缓存的流派和语种列表
+def invalidate_facets():
+    cache.delete(FACETS_CACHE_KEY)
+
+
+# 曲库版本号，歌曲有任何变化时更新，用于生成API响应的ETag
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # 多个请求同时生成版本号时以先写入的为准
+        cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+# 歌曲新增、修改、删除或批量导入后调用，清除流派统计并更新曲库版本号
+def catalog_changed():
+    invalidate_facets()
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,23 @@
+import base64
+import json
+
+'''
+分页游标：把翻页所需的位置信息（例如上一页最后一条记录的id）编码为不透明的字符串，
+客户端原样传回即可，翻页时不需要重新计算或统计总数。
+'''
+
+
+# 位置信息编码为游标
+def encode_cursor(position: dict):
+    data = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+# 游标解码为位置信息，游标无效时返回None
+def decode_cursor(cursor: str):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(data)
+    except (ValueError, TypeError):
+        return None
+    return position if isinstance(position, dict) else None
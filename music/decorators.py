@@ -2,16 +2,15 @@ from django.contrib import messages
 from django.contrib.auth import logout
 from django.http import HttpRequest
 from django.http import HttpResponseRedirect
-from music.models import UserProfile
+from music.profiles import get_profile
 
 
 # 冷启动检测，引导用户选择流派和语言
 def cold_boot(function):
     def wrapper(request: HttpRequest, *args, **kwargs):
         if request.user.is_authenticated:
-            profile = UserProfile.objects.filter(user=request.user)
-            if profile.exists():
-                profile_obj: UserProfile = profile.first()
+            profile_obj = get_profile(request)
+            if profile_obj is not None:
                 if profile_obj.first_run:
                     messages.warning(request, '首次登录，请先订阅喜欢的音乐流派和语言')
                     return HttpResponseRedirect('/user')
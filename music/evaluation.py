@@ -0,0 +1,109 @@
+import time
+
+import numpy as np
+
+from music.als import train_als
+from music.factor_model import FactorModel, train_svd
+from music.interactions import Interactions, to_dataframe
+from music.scoring import score_items, top_k
+
+'''
+离线评估推荐模型
+从评分快照中为每个用户留出一部分喜欢的歌曲作为测试集，用其余评分训练模型，
+再为每个用户推荐前k首（排除训练集中已评分的歌曲），与留出的歌曲对比：
+precision@k  推荐的k首中被用户喜欢的比例
+recall@k     留出的歌曲中被推荐到的比例
+ndcg@k       考虑推荐位置的命中率，命中越靠前越高，1为最好
+coverage     所有用户的推荐结果覆盖了模型中多少比例的歌曲
+同时记录训练用时和单个用户打分排序的耗时（与在线推荐相同的计算）。
+'''
+
+
+# 按用户留出测试集：喜欢数不少于min_likes的用户，随机留出test_fraction比例（至少1首）的喜欢
+# 返回（训练集评分，{用户id: 留出的歌曲id数组}）
+def holdout_split(interactions: Interactions, test_fraction=0.2, min_likes=2, seed=0):
+    rng = np.random.default_rng(seed)
+    test_mask = np.zeros(len(interactions.ratings), dtype=bool)
+    liked = np.flatnonzero(interactions.ratings == 1)
+    order = liked[np.argsort(interactions.user_ids[liked], kind='stable')]
+    user_ids, starts, counts = np.unique(interactions.user_ids[order], return_index=True, return_counts=True)
+    test = {}
+    for user_id, start, count in zip(user_ids.tolist(), starts, counts):
+        if count < min_likes:
+            continue
+        # 至少留1首在训练集中，保证用户在模型中
+        n_test = min(max(1, int(round(count * test_fraction))), count - 1)
+        held = rng.choice(order[start:start + count], n_test, replace=False)
+        test_mask[held] = True
+        test[user_id] = interactions.item_ids[held].astype(np.int64)
+    train = Interactions(interactions.user_ids[~test_mask], interactions.item_ids[~test_mask],
+                         interactions.ratings[~test_mask])
+    return train, test
+
+
+# 按参数训练模型，params包含engine和对应算法的参数
+def fit(train: Interactions, params):
+    params = dict(params)
+    if params.pop('engine') == 'als':
+        return train_als(train, threads=1, **params)
+    return train_svd(to_dataframe(train), **params)
+
+
+# 评估模型，返回各项指标的平均值和单个用户打分排序耗时（毫秒）的平均值和p95
+def evaluate(model: FactorModel, train: Interactions, test, k=10):
+    # 训练集中每个用户已评分的歌曲（内部id），推荐时排除
+    rated = {}
+    for user_id, item_id in zip(train.user_ids.tolist(), train.item_ids.tolist()):
+        rated.setdefault(user_id, []).append(model.item_index[item_id])
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+
+    precisions, recalls, ndcgs, latencies = [], [], [], []
+    recommended = np.zeros(len(model.item_ids), dtype=bool)
+    for user_id, held in test.items():
+        inner_uid = model.user_index.get(user_id)
+        if inner_uid is None:
+            continue
+        started = time.perf_counter()
+        exclude = np.zeros(len(model.item_ids), dtype=bool)
+        exclude[rated.get(user_id, [])] = True
+        ranked = top_k(score_items(model, model.user_factors[inner_uid], model.user_bias[inner_uid]), k, exclude)
+        latencies.append(time.perf_counter() - started)
+
+        recommended[ranked] = True
+        hits = np.isin(model.item_ids[ranked], held)
+        precisions.append(hits.sum() / k)
+        recalls.append(hits.sum() / len(held))
+        ideal = discounts[:min(len(held), k)].sum()
+        ndcgs.append((discounts[:len(hits)] * hits).sum() / ideal)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'users': len(precisions),
+        f'precision@{k}': float(np.mean(precisions)) if precisions else 0.0,
+        f'recall@{k}': float(np.mean(recalls)) if recalls else 0.0,
+        f'ndcg@{k}': float(np.mean(ndcgs)) if ndcgs else 0.0,
+        'coverage': float(recommended.mean()) if len(recommended) else 0.0,
+        'latency_ms': float(latencies.mean()) if len(latencies) else 0.0,
+        'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+    }
+
+
+# 训练并评估一组参数，返回（参数，指标），指标中包含训练用时fit_seconds
+def run_trial(train: Interactions, test, params, k=10):
+    started = time.perf_counter()
+    model = fit(train, params)
+    fit_seconds = time.perf_counter() - started
+    return params, {'fit_seconds': fit_seconds, **evaluate(model, train, test, k)}
+
+
+# 质量和延迟的帕累托前沿：没有其他结果的quality更高且latency更低（或相等）的结果，返回下标列表
+def pareto_front(results, quality, latency='latency_ms'):
+    front = []
+    for i, (_, metrics) in enumerate(results):
+        dominated = any(
+            other[quality] >= metrics[quality] and other[latency] <= metrics[latency]
+            and (other[quality] > metrics[quality] or other[latency] < metrics[latency])
+            for j, (_, other) in enumerate(results) if j != i)
+        if not dominated:
+            front.append(i)
+    return front
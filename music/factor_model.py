@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils.functional import cached_property
+from surprise import Dataset, Reader
+from surprise import SVD
+
+from music.metrics import timed
+
+'''
+离线训练得到的矩阵分解模型
+训练命令：python manage.py train_model
+模型保存在 settings.MODEL_ROOT 目录下的 <算法>-<版本号>/ 目录中，每个数组一个 .npy 文件，标量参数在 meta.json 中，
+<算法>-latest 文件记录当前使用的版本号，算法为 svd 或 als（music.als），由 settings.RECOMMEND_ENGINE 选择。
+预测评分：est = mu + b_u + b_i + q_i · p_u（ALS模型的 mu、b_u、b_i 都为0）
+加载时用 numpy 的内存映射（mmap_mode='r'）打开 .npy 文件，不把隐向量复制到进程内存中，
+同一台机器上的多个worker进程通过操作系统的页缓存共用一份数据，进程启动时也不需要读取整个文件；
+用户id/歌曲id到内部id的对应关系（IdIndex）保存为排好序的id数组，用二分查找代替每个进程各自建立的字典。
+近似最近邻索引（music.ann）以同样的方式保存在模型目录的 ivf/ 子目录中。
+新版本先写入临时目录，再整体重命名为正式目录，最后替换 <算法>-latest，读取方不会看到写了一半的模型。
+版本号为训练时间加随机后缀，同一秒内训练的两个模型不会冲突；保存新版本后只保留最近 settings.MODEL_KEEP_VERSIONS 个版本目录。
+'''
+
+# 模型目录中近似最近邻索引的子目录
+INDEX_DIR = 'ivf'
+# 模型目录中的数组文件
+ARRAYS = ('user_bias', 'item_bias', 'user_factors', 'item_factors', 'user_ids', 'item_ids',
+          'user_sorted_ids', 'user_order', 'item_sorted_ids', 'item_order')
+
+# 评分范围，与训练时Reader的rating_scale保持一致
+RATING_SCALE = (0, 1)
+
+
+class FactorModel:
+    def __init__(self, version, global_mean, user_bias, item_bias, user_factors, item_factors, user_ids, item_ids,
+                 reg=0.02, engine='svd', alpha=0.0, user_index=None, item_index=None):
+        self.version = version  # 模型版本号
+        self.engine = engine  # 训练算法
+        self.global_mean = float(global_mean)  # 全局平均分 mu
+        self.user_bias = user_bias  # 用户偏差 b_u
+        self.item_bias = item_bias  # 物品偏差 b_i
+        self.user_factors = user_factors  # 用户隐向量 p_u
+        self.item_factors = item_factors  # 物品隐向量 q_i
+        self.user_ids = user_ids  # 内部id -> 用户id
+        self.item_ids = item_ids  # 内部id -> 歌曲id
+        self.reg = float(reg)  # 训练时的正则化系数
+        self.alpha = float(alpha)  # ALS的置信度系数，SVD模型为0
+        # 用户id/歌曲id -> 内部id
+        self.user_index = user_index if user_index is not None else IdIndex.build(user_ids)
+        self.item_index = item_index if item_index is not None else IdIndex.build(item_ids)
+
+    @property
+    def n_factors(self):
+        return self.item_factors.shape[1]
+
+    # 物品隐向量的Gram矩阵 Q^T Q，ALS求解用户向量时使用
+    @cached_property
+    def item_gramian(self):
+        return self.item_factors.T @ self.item_factors
+
+    # 保存到path目录，目录不能已经存在
+    def save(self, path):
+        os.makedirs(path)
+        arrays = {
+            'user_bias': self.user_bias,
+            'item_bias': self.item_bias,
+            'user_factors': self.user_factors,
+            'item_factors': self.item_factors,
+            'user_ids': self.user_ids,
+            'item_ids': self.item_ids,
+            'user_sorted_ids': self.user_index.sorted_ids,
+            'user_order': self.user_index.order,
+            'item_sorted_ids': self.item_index.sorted_ids,
+            'item_order': self.item_index.order,
+        }
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(arrays[name]))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'version': self.version, 'engine': self.engine, 'global_mean': self.global_mean,
+                       'reg': self.reg, 'alpha': self.alpha}, f)
+
+    # 以只读的内存映射打开path目录中的模型
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(user_bias=arrays['user_bias'],
+                   item_bias=arrays['item_bias'],
+                   user_factors=arrays['user_factors'],
+                   item_factors=arrays['item_factors'],
+                   user_ids=arrays['user_ids'],
+                   item_ids=arrays['item_ids'],
+                   user_index=IdIndex(arrays['user_sorted_ids'], arrays['user_order']),
+                   item_index=IdIndex(arrays['item_sorted_ids'], arrays['item_order']),
+                   **meta)
+
+
+class IdIndex:
+    # 原始id -> 内部id 的只读映射，sorted_ids为从小到大排列的原始id，order为对应的内部id
+    def __init__(self, sorted_ids, order):
+        self.sorted_ids = sorted_ids
+        self.order = order
+
+    @classmethod
+    def build(cls, raw_ids):
+        raw_ids = np.asarray(raw_ids, dtype=np.int64)
+        order = np.argsort(raw_ids, kind='stable')
+        return cls(raw_ids[order], order.astype(np.int64))
+
+    # 批量查找，返回内部id数组，不存在的id为-1
+    def lookup(self, raw_ids):
+        raw_ids = np.asarray(raw_ids, dtype=np.int64)
+        if len(self.sorted_ids) == 0:
+            return np.full(raw_ids.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, raw_ids), len(self.sorted_ids) - 1)
+        return np.where(self.sorted_ids[positions] == raw_ids, self.order[positions], -1)
+
+    def get(self, raw_id, default=None):
+        position = int(np.searchsorted(self.sorted_ids, raw_id))
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == raw_id:
+            return int(self.order[position])
+        return default
+
+    def __getitem__(self, raw_id):
+        inner_id = self.get(raw_id)
+        if inner_id is None:
+            raise KeyError(raw_id)
+        return inner_id
+
+    def __contains__(self, raw_id):
+        return self.get(raw_id) is not None
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+
+# 新模型的版本号：训练时间加随机后缀，按字符串排序即按训练时间排序，长度为20（Recommendation.model_version）
+def new_version():
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:5]}"
+
+
+# 使用Surprise的SVD算法训练模型
+@timed('train')
+def train_svd(df: pd.DataFrame, n_factors=100, n_epochs=20, lr_all=0.005, reg_all=0.02):
+    reader = Reader(rating_scale=RATING_SCALE)
+    data = Dataset.load_from_df(df[['userID', 'itemID', 'rating']], reader)
+    trainset = data.build_full_trainset()
+    algo = SVD(n_factors=n_factors, n_epochs=n_epochs, lr_all=lr_all, reg_all=reg_all)
+    algo.fit(trainset)
+    # 内部id与原始id的对应关系
+    user_ids = np.array([trainset.to_raw_uid(inner_id) for inner_id in trainset.all_users()], dtype=np.int64)
+    item_ids = np.array([trainset.to_raw_iid(inner_id) for inner_id in trainset.all_items()], dtype=np.int64)
+    return FactorModel(version=new_version(),
+                       global_mean=trainset.global_mean,
+                       user_bias=algo.bu,
+                       item_bias=algo.bi,
+                       user_factors=algo.pu,
+                       item_factors=algo.qi,
+                       user_ids=user_ids,
+                       item_ids=item_ids,
+                       reg=reg_all)
+
+
+def _latest_path(engine):
+    return os.path.join(settings.MODEL_ROOT, f'{engine}-latest')
+
+
+def model_path(engine, version):
+    return os.path.join(settings.MODEL_ROOT, f'{engine}-{version}')
+
+
+# 保存模型并将其设为当前版本，index为近似最近邻索引（music.ann），保存在模型目录的 ivf/ 子目录中
+def save_model(model: FactorModel, index=None):
+    os.makedirs(settings.MODEL_ROOT, exist_ok=True)
+    path = model_path(model.engine, model.version)
+    # 先写入临时目录，模型和索引全部写完后再重命名，正式目录中的文件一旦出现就是完整的
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{model.engine}-{model.version}.', dir=settings.MODEL_ROOT)
+    try:
+        model.save(os.path.join(tmp_dir, 'model'))
+        if index is not None:
+            index.save(os.path.join(tmp_dir, 'model', INDEX_DIR))
+        os.rename(os.path.join(tmp_dir, 'model'), path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    # 先写临时文件再替换，保证读取方不会读到写了一半的版本号
+    tmp_path = _latest_path(model.engine) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(model.version)
+    os.replace(tmp_path, _latest_path(model.engine))
+    prune_versions(model.engine)
+
+
+# 删除旧的模型版本目录，只保留最近keep个版本（默认settings.MODEL_KEEP_VERSIONS），当前版本不会被删除
+# 仍在使用旧版本的进程通过内存映射打开的文件在删除后依然可以读取，下次检查版本号时会加载新版本
+def prune_versions(engine, keep=None):
+    keep = max(keep if keep is not None else settings.MODEL_KEEP_VERSIONS, 1)
+    current = latest_version(engine)
+    prefix = f'{engine}-'
+    versions = [name[len(prefix):] for name in os.listdir(settings.MODEL_ROOT)
+                if name.startswith(prefix) and os.path.isdir(os.path.join(settings.MODEL_ROOT, name))]
+    # 按目录的修改时间排序，同一秒内保存的版本也能分出先后
+    versions.sort(key=lambda version: (os.stat(model_path(engine, version)).st_mtime_ns, version))
+    for version in versions[:-keep]:
+        if version != current:
+            shutil.rmtree(model_path(engine, version), ignore_errors=True)
+
+
+# 当前使用的模型版本号，没有训练过模型时返回None；engine为空时使用settings.RECOMMEND_ENGINE
+def latest_version(engine=None):
+    engine = engine or settings.RECOMMEND_ENGINE
+    try:
+        with open(_latest_path(engine)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# 已加载的模型，版本号不变时不再重复读取文件
+_loaded_models = {}
+# 多线程处理请求时，新版本只由一个线程读取，其他线程等待后直接使用
+_loaded_models_lock = threading.Lock()
+
+
+# 加载当前版本的模型，没有训练过模型时返回None；engine为空时使用settings.RECOMMEND_ENGINE
+# 加载后的模型只读，多个线程可以同时使用
+def load_model(engine=None):
+    engine = engine or settings.RECOMMEND_ENGINE
+    version = latest_version(engine)
+    if version is None:
+        return None
+    model = _loaded_models.get(engine)
+    if model is None or model.version != version:
+        with _loaded_models_lock:
+            model = _loaded_models.get(engine)
+            if model is None or model.version != version:
+                model = FactorModel.load(model_path(engine, version))
+                _loaded_models[engine] = model
+    return model
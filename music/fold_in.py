@@ -0,0 +1,113 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from music.als import fold_in_als
+from music.factor_model import FactorModel, load_model
+from music.metrics import increment
+from music.models import UserProfile
+
+'''
+在线更新用户隐向量（fold-in），不需要重新训练整个模型
+1. 重新求解：固定物品隐向量 q_i 和偏差 b_i，用用户当前的全部评分求解带正则的最小二乘，
+   得到用户隐向量 p_u 和偏差 b_u：min Σ(r_ui - mu - b_i - b_u - q_i·p_u)² + λ(|p_u|² + b_u²)
+2. 增量SGD：只用新评分的歌曲对 p_u 和 b_u 做几轮随机梯度下降
+更新后的用户向量按模型版本保存在缓存中，模型重新训练后自动失效。
+'''
+
+
+def _cache_key(model: FactorModel, user_id):
+    return f'user-factors:{model.engine}:{model.version}:{user_id}'
+
+
+# 获取用户的全部评分（歌曲id，评分），喜欢为1，不喜欢为0
+# 使用 profile.like_ids / dislike_ids，同一个请求中已经读取过时不再查询；修改喜欢后需要使用新的用户资料对象
+def user_ratings(profile: UserProfile):
+    like_ids = sorted(profile.like_ids)
+    dislike_ids = sorted(profile.dislike_ids)
+    item_ids = np.array(like_ids + dislike_ids, dtype=np.int64)
+    ratings = np.array([1] * len(like_ids) + [0] * len(dislike_ids), dtype=np.float64)
+    return item_ids, ratings
+
+
+# 歌曲id转换为模型内部id，去掉模型中不存在的歌曲
+def _known_items(model: FactorModel, item_ids, ratings):
+    inner_ids = model.item_index.lookup(np.asarray(item_ids, dtype=np.int64))
+    known = inner_ids >= 0
+    return inner_ids[known], np.asarray(ratings, dtype=np.float64)[known]
+
+
+# 固定物品参数，求解用户隐向量和偏差
+def fold_in(model: FactorModel, item_ids, ratings):
+    inner_ids, ratings = _known_items(model, item_ids, ratings)
+    n_factors = model.n_factors
+    if len(inner_ids) == 0:
+        return np.zeros(n_factors), 0.0
+    if model.engine == 'als':
+        return fold_in_als(model, inner_ids, ratings)
+    # 在物品隐向量后面拼接一列1，同时求解 p_u 和 b_u
+    x = np.hstack([model.item_factors[inner_ids], np.ones((len(inner_ids), 1))])
+    y = ratings - model.global_mean - model.item_bias[inner_ids]
+    # SGD训练时每条评分都会施加一次正则，闭式解中对应的正则系数为 reg * 评分数
+    lam = model.reg * len(inner_ids)
+    solution = np.linalg.solve(x.T @ x + lam * np.eye(n_factors + 1), x.T @ y)
+    return solution[:n_factors], float(solution[n_factors])
+
+
+# 以当前用户向量为起点，只对新评分的歌曲做几轮SGD
+def sgd_update(model: FactorModel, user_factor, user_bias, item_ids, ratings, lr=0.005, reg=None, n_epochs=10):
+    inner_ids, ratings = _known_items(model, item_ids, ratings)
+    reg = model.reg if reg is None else reg
+    user_factor = np.array(user_factor, dtype=np.float64)
+    for _ in range(n_epochs):
+        for inner_id, rating in zip(inner_ids, ratings):
+            item_factor = model.item_factors[inner_id]
+            err = rating - (model.global_mean + user_bias + model.item_bias[inner_id] + item_factor @ user_factor)
+            user_bias += lr * (err - reg * user_bias)
+            user_factor += lr * (err * item_factor - reg * user_factor)
+    return user_factor, float(user_bias)
+
+
+# 获取用户当前的隐向量和偏差
+# 优先使用在线更新过的向量，其次是训练集中的向量，都没有时根据用户当前评分求解
+def user_vector(model: FactorModel, profile: UserProfile):
+    user_id = profile.user_id
+    vector = cache.get(_cache_key(model, user_id))
+    increment('mrs_cache_total', cache='user_vector', result='miss' if vector is None else 'hit')
+    if vector is not None:
+        return vector
+    inner_uid = model.user_index.get(user_id)
+    if inner_uid is not None:
+        return model.user_factors[inner_uid], float(model.user_bias[inner_uid])
+    return refresh_user(profile, model)
+
+
+# 用用户当前的全部评分重新求解用户向量，用于新注册用户或评分大量变化的用户
+# 没有模型中歌曲的评分时返回零向量，但不缓存，下一次评分时重新求解
+def refresh_user(profile: UserProfile, model: FactorModel = None):
+    model = model or load_model()
+    if model is None:
+        return None
+    item_ids, ratings = user_ratings(profile)
+    vector = fold_in(model, item_ids, ratings)
+    if len(_known_items(model, item_ids, ratings)[0]):
+        cache.set(_cache_key(model, profile.user_id), vector, None)
+    else:
+        cache.delete(_cache_key(model, profile.user_id))
+    return vector
+
+
+# 用户喜欢/不喜欢一首歌后，更新用户向量
+# 评分少于 FOLD_IN_SGD_MIN_RATINGS 条时每次都重新求解：从零向量开始的几步SGD远达不到最优解，
+# 而评分少时求解的代价很小；评分较多时只对新评分做增量SGD
+def update_user(profile: UserProfile, item_id, rating):
+    model = load_model()
+    if model is None:
+        return None
+    vector = cache.get(_cache_key(model, profile.user_id))
+    if vector is None or model.engine == 'als' or len(profile.rated_ids) < settings.FOLD_IN_SGD_MIN_RATINGS:
+        # ALS的用户向量有闭式解，总是重新求解
+        return refresh_user(profile, model)
+    vector = sgd_update(model, vector[0], vector[1], [item_id], [rating])
+    cache.set(_cache_key(model, profile.user_id), vector, None)
+    return vector
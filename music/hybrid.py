@@ -0,0 +1,274 @@
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+
+from music.catalog import catalog_version
+from music.factor_model import FactorModel
+from music.models import Genre, Language, Music, UserProfile
+from music.scoring import score_candidates, score_items, top_k
+
+'''
+混合排序：一次向量化计算为每首歌打一个总分，再取前k首
+score = w_model * 模型预测评分 + w_genre * [歌曲属于订阅的流派] + w_language * [歌曲属于订阅的语种]
+        + w_popularity * 热度
+权重为 settings.HYBRID_WEIGHTS。每首歌只出现一次，不需要再去重；
+无论用户订阅了多少流派，返回的歌曲数都不超过k。
+模型没有训练或无法为用户预测时，模型分为0，只按订阅和热度排序（冷启动）。
+使用近似最近邻索引或冷启动时，只对候选歌曲打分，计算量与曲库大小无关：
+ANN检索到的歌曲、订阅的流派和语种的倒排列表中的歌曲，以及热度最高的 k + 已评分数 首歌曲
+（其余歌曲的订阅分为0、模型分相同，总分最高的就是热度最高的）。
+歌曲的流派、语种和热度保存为数组（CatalogFeatures），曲库变化或超过 HYBRID_FEATURES_TIMEOUT 秒后
+在后台线程中重新读取，读取完成前继续使用旧的数据，请求不需要等待。
+'''
+
+
+class CatalogFeatures:
+    def __init__(self, version, music_ids, genres, genre_index, languages, language_index, popularity):
+        self.version = version  # 读取时的曲库版本号
+        self.created = time.time()
+        self.music_ids = music_ids  # 所有歌曲id，从小到大排列，下标即行号
+        self.genres = genres  # 歌曲×流派 的0/1稀疏矩阵
+        self.genre_index = genre_index  # 流派名称 -> 列号
+        self.languages = languages  # 歌曲×语种 的0/1稀疏矩阵
+        self.language_index = language_index  # 语种名称 -> 列号
+        self.popularity = popularity  # 热度，log(1 + 喜欢人数) 归一化到 [0, 1]
+        self.genre_postings = genres.T.tocsr()  # 流派×歌曲，每一行是该流派的歌曲行号（倒排列表）
+        self.language_postings = languages.T.tocsr()
+        self.popular_rows = np.argsort(-popularity, kind='stable')  # 按热度从高到低排列的行号
+        self._model_lookups = {}
+
+    # 歌曲id转换为行号，不存在的歌曲返回-1
+    def rows_of(self, music_ids):
+        return _rows_of(self.music_ids, music_ids)
+
+    # 歌曲属于订阅的任一流派（语种）时为1，否则为0；subscribe为逗号分隔的名称
+    def matches(self, matrix, index, subscribe):
+        columns = [index[name.strip()] for name in (subscribe or '').split(',') if name.strip() in index]
+        if not columns:
+            return np.zeros(len(self.music_ids))
+        selected = np.zeros(matrix.shape[1])
+        selected[columns] = 1
+        return (matrix @ selected > 0).astype(np.float64)
+
+    # 属于订阅的任一流派（语种）的歌曲行号，从倒排列表中读取
+    def subscribed_rows(self, postings, index, subscribe):
+        columns = [index[name.strip()] for name in (subscribe or '').split(',') if name.strip() in index]
+        if not columns:
+            return np.empty(0, dtype=np.int64)
+        return _sorted_unique(np.concatenate([postings.indices[postings.indptr[column]:postings.indptr[column + 1]]
+                                              for column in columns]).astype(np.int64))
+
+    # 返回（每首歌在模型中的内部id，不在模型中的为-1；在模型中的歌曲按热度排列的行号；不在模型中的歌曲按热度排列的行号）
+    # 每个模型版本只计算一次
+    def _model_lookup(self, model: FactorModel):
+        key = (model.engine, model.version)
+        lookup = self._model_lookups.get(key)
+        if lookup is None:
+            rows = model.item_index.lookup(self.music_ids)
+            known = rows[self.popular_rows] >= 0
+            lookup = (rows, self.popular_rows[known], self.popular_rows[~known])
+            self._model_lookups = {key: lookup}
+        return lookup
+
+    # 每首歌在模型中的内部id，不在模型中的为-1
+    def model_rows(self, model: FactorModel):
+        return self._model_lookup(model)[0]
+
+
+# 排序并去重，比 np.unique 少一次哈希，候选歌曲较多时更快
+def _sorted_unique(values):
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+# values中的每个值是否在sorted_values（从小到大、不重复）中
+def _member(sorted_values, values):
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+def _rows_of(sorted_ids, music_ids):
+    music_ids = np.asarray(list(music_ids), dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(len(music_ids), -1, dtype=np.int64)
+    rows = np.minimum(np.searchsorted(sorted_ids, music_ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[rows] == music_ids, rows, -1)
+
+
+# 歌曲与流派（语种）的多对多关系转换为 歌曲×流派 的稀疏矩阵，返回（矩阵，名称 -> 列号）
+def _membership(pairs, music_ids, labels):
+    label_index = {name: column for column, (_, name) in enumerate(labels)}
+    column_of = {pk: column for column, (pk, _) in enumerate(labels)}
+    pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    rows = _rows_of(music_ids, pairs[:, 0])
+    columns = np.array([column_of[label_id] for label_id in pairs[:, 1]], dtype=np.int64)
+    # 读取期间新增的歌曲不在music_ids中，下次刷新时再加入
+    known = rows >= 0
+    matrix = sp.csr_matrix((np.ones(int(known.sum())), (rows[known], columns[known])),
+                           shape=(len(music_ids), len(labels)))
+    return matrix, label_index
+
+
+# 读取所有歌曲的流派、语种和热度
+def build_features():
+    version = catalog_version()
+    music_ids = np.array(Music.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    genres, genre_index = _membership(Music.genres.through.objects.values_list('music_id', 'genre_id'), music_ids,
+                                      list(Genre.objects.order_by('pk').values_list('pk', 'name')))
+    languages, language_index = _membership(Music.languages.through.objects.values_list('music_id', 'language_id'),
+                                            music_ids, list(Language.objects.order_by('pk').values_list('pk', 'name')))
+    counts = np.array(list(UserProfile.likes.through.objects.values('music_id').annotate(count=Count('pk'))
+                           .values_list('music_id', 'count')), dtype=np.int64).reshape(-1, 2)
+    rows = _rows_of(music_ids, counts[:, 0])
+    popularity = np.zeros(len(music_ids))
+    popularity[rows[rows >= 0]] = np.log1p(counts[rows >= 0, 1])
+    if popularity.max(initial=0) > 0:
+        popularity /= popularity.max()
+    return CatalogFeatures(version, music_ids, genres, genre_index, languages, language_index, popularity)
+
+
+_features = None
+_features_lock = threading.Lock()
+# 是否有后台线程正在重新读取歌曲特征
+_refreshing = False
+
+
+# 获取缓存的歌曲特征；进程中第一次调用时直接读取，之后曲库版本变化或过期时在后台线程中重新读取，
+# 读取完成前返回旧的数据，请求不需要等待读取整个曲库
+def load_features():
+    global _features
+    features = _features
+    if features is None:
+        with _features_lock:
+            if _features is None:
+                _features = build_features()
+            return _features
+    if features.version != catalog_version() or time.time() - features.created >= settings.HYBRID_FEATURES_TIMEOUT:
+        _refresh_in_background()
+    return features
+
+
+# 立即重新读取歌曲特征，用于管理命令和测试
+def refresh_features():
+    global _features
+    features = build_features()
+    with _features_lock:
+        _features = features
+    return features
+
+
+# 启动后台线程重新读取歌曲特征，同时只有一个线程读取
+def _refresh_in_background():
+    global _refreshing
+    with _features_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=_refresh, daemon=True).start()
+
+
+def _refresh():
+    global _refreshing
+    try:
+        refresh_features()
+    finally:
+        _refreshing = False
+        # 后台线程的数据库连接不会被请求结束的信号关闭
+        connection.close()
+
+
+# 清除缓存的歌曲特征，下次推荐时重新读取
+def clear_features():
+    global _features
+    with _features_lock:
+        _features = None
+
+
+# 订阅和热度部分的分数：w_genre * [属于订阅的流派] + w_language * [属于订阅的语种] + w_popularity * 热度
+def label_scores(features: CatalogFeatures, genre_subscribe, language_subscribe, weights=None):
+    weights = {**settings.HYBRID_WEIGHTS, **(weights or {})}
+    scores = weights['popularity'] * features.popularity
+    if weights['genre']:
+        scores = scores + weights['genre'] * features.matches(features.genres, features.genre_index, genre_subscribe)
+    if weights['language']:
+        scores = scores + weights['language'] * features.matches(features.languages, features.language_index,
+                                                                 language_subscribe)
+    return scores
+
+
+# 模型对所有歌曲的预测评分（按模型内部id排列）转换为曲库顺序，不在模型中的歌曲为0
+def model_scores(features: CatalogFeatures, model: FactorModel, item_scores):
+    rows = features.model_rows(model)
+    known = rows >= 0
+    scores = np.zeros(len(features.music_ids))
+    scores[known] = item_scores[rows[known]]
+    return scores
+
+
+# 排除已评分的歌曲后取总分最高的前k首，返回（歌曲id数组，总分数组）
+def top_musics(features: CatalogFeatures, scores, rated_ids, k):
+    exclude = np.zeros(len(features.music_ids), dtype=bool)
+    rows = features.rows_of(rated_ids)
+    exclude[rows[rows >= 0]] = True
+    ranked = top_k(scores, k, exclude)
+    return features.music_ids[ranked], scores[ranked]
+
+
+# 为用户混合排序，返回（歌曲id数组，总分数组），按总分从高到低
+# vector为用户的（隐向量，偏差），为None时不使用模型分
+# candidates为近似最近邻检索到的候选歌曲（模型内部id），只对候选歌曲和订阅的歌曲精确打分，其他歌曲取候选歌曲中的最低分
+def rank_musics(profile: UserProfile, k, model: FactorModel = None, vector=None, candidates=None, weights=None):
+    weights = {**settings.HYBRID_WEIGHTS, **(weights or {})}
+    features = load_features()
+    if model is None or vector is None or not weights['model']:
+        return _rank_pool(features, profile, k, weights)
+    if candidates is not None:
+        return _rank_pool(features, profile, k, weights, model, vector, candidates)
+    # 没有索引时为所有歌曲打分
+    scores = label_scores(features, profile.genre_subscribe, profile.language_subscribe, weights)
+    scores = scores + weights['model'] * model_scores(features, model, score_items(model, *vector))
+    return top_musics(features, scores, profile.rated_ids, k)
+
+
+# 只在候选歌曲中排序：ANN候选、订阅的流派和语种的歌曲，以及其余歌曲中热度最高的 k + 已评分数 首
+def _rank_pool(features: CatalogFeatures, profile: UserProfile, k, weights, model: FactorModel = None, vector=None,
+               candidates=None):
+    empty = np.empty(0, dtype=np.int64)
+    rated_rows = features.rows_of(profile.rated_ids)
+    rated_rows = rated_rows[rated_rows >= 0]
+    genre_rows = features.subscribed_rows(features.genre_postings, features.genre_index,
+                                          profile.genre_subscribe) if weights['genre'] else empty
+    language_rows = features.subscribed_rows(features.language_postings, features.language_index,
+                                             profile.language_subscribe) if weights['language'] else empty
+    n_popular = k + len(rated_rows)
+    if model is None:
+        parts = [features.popular_rows[:n_popular]]
+    else:
+        inner_ids, popular_known, popular_unknown = features._model_lookup(model)
+        candidate_rows = features.rows_of(model.item_ids[candidates])
+        # 模型分不同的两组歌曲（在模型中取最低分，不在模型中为0）分别取热度最高的
+        parts = [candidate_rows[candidate_rows >= 0], popular_known[:n_popular], popular_unknown[:n_popular]]
+    pool = _sorted_unique(np.concatenate(parts + [genre_rows, language_rows]).astype(np.int64))
+    pool = pool[~_member(_sorted_unique(rated_rows), pool)]
+
+    in_genre = _member(genre_rows, pool)
+    in_language = _member(language_rows, pool)
+    scores = weights['popularity'] * features.popularity[pool] + weights['genre'] * in_genre \
+        + weights['language'] * in_language
+    if model is not None:
+        pool_inner_ids = inner_ids[pool]
+        known = pool_inner_ids >= 0
+        exact = known & (_member(_sorted_unique(candidates), pool_inner_ids) | in_genre | in_language)
+        item_scores = np.zeros(len(pool))
+        item_scores[known] = score_candidates(model, *vector, candidates).min() if len(candidates) else 0.0
+        item_scores[exact] = score_candidates(model, *vector, pool_inner_ids[exact])
+        scores = scores + weights['model'] * item_scores
+    ranked = top_k(scores, k)
+    return features.music_ids[pool[ranked]], scores[ranked]
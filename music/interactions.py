@@ -0,0 +1,57 @@
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from music.models import UserProfile
+
+'''
+批量读取用户喜欢/不喜欢数据
+直接读取两张多对多中间表，分块迭代数据库游标，写入预先分配好的NumPy数组，
+不再为每个用户分别查询喜欢、不喜欢和用户信息（3N+1次查询）。
+'''
+
+# 用户评分快照：用户id、歌曲id、评分（喜欢为1，不喜欢为0），三个数组一一对应
+Interactions = namedtuple('Interactions', ['user_ids', 'item_ids', 'ratings'])
+
+
+# 分块读取 (用户id, 歌曲id)，写入数组从offset开始的位置，最多写到limit，返回写入后的位置
+def _fill(queryset, user_ids, item_ids, offset, limit, chunk_size):
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while offset < limit:
+        chunk = list(islice(rows, min(chunk_size, limit - offset)))
+        if not chunk:
+            break
+        block = np.array(chunk, dtype=np.int32)
+        user_ids[offset:offset + len(block)] = block[:, 0]
+        item_ids[offset:offset + len(block)] = block[:, 1]
+        offset += len(block)
+    return offset
+
+
+# 读取所有用户的评分数据
+def load_interactions(chunk_size=10000):
+    likes = UserProfile.likes.through.objects.values_list('userprofile__user_id', 'music_id')
+    dislikes = UserProfile.dislikes.through.objects.values_list('userprofile__user_id', 'music_id')
+    like_total = likes.count()
+    total = like_total + dislikes.count()
+
+    user_ids = np.empty(total, dtype=np.int32)
+    item_ids = np.empty(total, dtype=np.int32)
+    ratings = np.zeros(total, dtype=np.int8)
+    # 统计数量和读取数据之间可能有新的评分写入，超出部分留到下一次读取
+    like_end = _fill(likes, user_ids, item_ids, 0, like_total, chunk_size)
+    ratings[:like_end] = 1
+    end = _fill(dislikes, user_ids, item_ids, like_end, total, chunk_size)
+    # 读取期间有评分被删除时，去掉末尾未写入的部分
+    return Interactions(user_ids[:end], item_ids[:end], ratings[:end])
+
+
+# 评分快照转换为DataFrame，列名与训练时使用的一致
+def to_dataframe(interactions: Interactions):
+    return pd.DataFrame({
+        'userID': interactions.user_ids,
+        'itemID': interactions.item_ids,
+        'rating': interactions.ratings,
+    })
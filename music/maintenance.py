@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music.catalog import catalog_changed
+
+'''
+批量维护数据的通用工具
+需要修改的记录按主键分批取出（只取主键，不加载整张表），每批在一个事务中修改；
+每批完成后把最后一个主键写入检查点文件，中断后重新运行同一命令会从检查点继续。
+'''
+
+
+# 读取检查点，返回上次完成的最后一个主键，没有检查点时返回0
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('last_pk', 0)
+
+
+# 保存检查点，先写临时文件再替换，避免中断时留下不完整的文件
+def save_checkpoint(path, last_pk):
+    if not path:
+        return
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'last_pk': last_pk, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+    os.replace(temp_path, path)
+
+
+# 全部完成后删除检查点
+def clear_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+# 按主键从小到大分批返回queryset中记录的主键列表，每批最多batch_size个，从start_pk之后开始
+def pk_batches(queryset, batch_size, start_pk=0):
+    last_pk = start_pk
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+# 分批维护命令的基类，子类实现 queryset()（需要修改的记录）和 process(pks)（修改一批记录，返回修改的行数）
+class BatchCommand(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='每个事务修改的记录数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要修改的记录数，不修改数据')
+        parser.add_argument('--checkpoint', default=None,
+                            help='检查点文件，中断后重新运行时从检查点继续，全部完成后删除')
+        parser.add_argument('--start-pk', type=int, default=None, help='从该主键之后开始，优先于检查点')
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def process(self, pks):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        queryset = self.queryset()
+        start_pk = options['start_pk']
+        if start_pk is None:
+            start_pk = load_checkpoint(options['checkpoint'])
+        total = queryset.filter(pk__gt=start_pk).count()
+        if options['dry_run']:
+            self.stdout.write(f'需要修改 {total} 条记录（主键大于 {start_pk}）')
+            return
+
+        started = time.time()
+        done = changed = 0
+        for pks in pk_batches(queryset, options['batch_size'], start_pk):
+            with transaction.atomic():
+                changed += self.process(pks)
+            save_checkpoint(options['checkpoint'], pks[-1])
+            done += len(pks)
+            elapsed = time.time() - started
+            self.stdout.write(f'{done}/{total}，已完成至主键 {pks[-1]}，{done / max(elapsed, 1e-9):.0f} 条/秒')
+        clear_checkpoint(options['checkpoint'])
+        if changed:
+            catalog_changed()  # 流派统计等缓存需要重新计算
+        self.stdout.write(self.style.SUCCESS(f'完成：修改 {changed} 条记录，用时 {time.time() - started:.1f} 秒'))
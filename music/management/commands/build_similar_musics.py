@@ -0,0 +1,97 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from music.factor_model import load_model
+from music.interactions import load_interactions
+from music.models import PendingSimilar, SimilarMusic
+from music.similarity import (colike_neighbours, factor_neighbours, like_matrix, normalize_factors, refresh_pending,
+                              save_neighbours)
+
+# 子进程中使用的数据，每个子进程只接收一次
+_worker_state = None
+
+
+def _init_worker(method, state):
+    global _worker_state
+    django.setup()
+    if method == 'colike':
+        user_items = state
+        counts = user_items.sum(axis=0).A1
+        _worker_state = (method, (user_items.T.tocsr(), user_items, counts))
+    else:
+        _worker_state = (method, (state,))
+
+
+# 计算一块歌曲（下标start到end）的相似歌曲
+def _neighbours_chunk(args):
+    start, end, top_n = args
+    method, state = _worker_state
+    if method == 'colike':
+        return start, end, colike_neighbours(*state, start, end, top_n)
+    return start, end, factor_neighbours(*state, start, end, top_n)
+
+
+# 全量计算相似歌曲：python manage.py build_similar_musics
+# 只更新喜欢关系变化过的歌曲（共同喜欢）：python manage.py build_similar_musics --pending，可以每隔几分钟运行一次；
+# 共同喜欢的相似歌曲定期全量计算一次即可，隐向量的相似歌曲在训练新模型后计算
+class Command(BaseCommand):
+    help = '多进程计算每首歌的相似歌曲并写入相似歌曲表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=['colike', 'factors'], default=settings.SIMILAR_METHOD,
+                            help='计算方式，默认为settings.SIMILAR_METHOD')
+        parser.add_argument('--top-n', type=int, default=settings.SIMILAR_TOP_N, help='每首歌保存的相似歌曲数')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='进程数')
+        parser.add_argument('--chunk-size', type=int, default=500, help='每个任务计算的歌曲数')
+        parser.add_argument('--pending', action='store_true',
+                            help='只重新计算用户喜欢或取消喜欢过的歌曲（共同喜欢），不做全量计算')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            started = time.time()
+            done = refresh_pending()
+            self.stdout.write(self.style.SUCCESS(f'完成：更新 {done} 首歌曲，用时 {time.time() - started:.1f} 秒'))
+            return
+        # 全量计算前已经在队列中的歌曲会在这次计算中更新
+        pending_max = PendingSimilar.objects.aggregate(pk=Max('pk'))['pk']
+        if options['method'] == 'colike':
+            state, item_ids = like_matrix(load_interactions())
+        else:
+            model = load_model()
+            if model is None:
+                raise CommandError('推荐模型尚未训练，请先运行 python manage.py train_model')
+            state, item_ids = normalize_factors(model), model.item_ids
+        if len(item_ids) == 0:
+            self.stdout.write(self.style.WARNING('没有可以计算的歌曲'))
+            return
+
+        chunks = [(start, min(start + options['chunk_size'], len(item_ids)), options['top_n'])
+                  for start in range(0, len(item_ids), options['chunk_size'])]
+        started = time.time()
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker,
+                                 initargs=(options['method'], state)) as executor:
+            for start, end, results in executor.map(_neighbours_chunk, chunks):
+                # 下标转换为歌曲id，每块在一个事务中替换
+                save_neighbours([(int(item_ids[index]), [(int(item_ids[j]), score) for j, score in similar])
+                                 for index, similar in results])
+                done += end - start
+                elapsed = time.time() - started
+                self.stdout.write(f'{done}/{len(item_ids)} 首歌曲，{done / elapsed:.1f} 首/秒')
+
+        # 删除这次没有计算到的歌曲（例如已经没有人喜欢）留下的旧数据
+        stale = list(set(SimilarMusic.objects.values_list('music_id', flat=True).distinct()) - set(item_ids.tolist()))
+        for start in range(0, len(stale), 1000):
+            SimilarMusic.objects.filter(music_id__in=stale[start:start + 1000]).delete()
+
+        if options['method'] == 'colike' and pending_max is not None:
+            PendingSimilar.objects.filter(pk__lte=pending_max).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'完成：{options["method"]}，{done} 首歌曲，用时 {time.time() - started:.1f} 秒'))
@@ -0,0 +1,22 @@
+from django.db.models import Value
+from django.db.models.functions import Replace
+
+from music.catalog import sync_music_labels
+from music.maintenance import BatchCommand
+from music.models import Music
+
+
+# 去除歌曲语种中多余的换行符：python manage.py clean_music_languages
+# 每批执行一条 UPDATE ... SET language = REPLACE(language, '\n', '')，再重新同步这批歌曲的语种
+class Command(BatchCommand):
+    help = '去除歌曲语种中的换行符'
+
+    def queryset(self):
+        return Music.objects.filter(language__contains='\n')
+
+    def process(self, pks):
+        musics = Music.objects.filter(pk__in=pks)
+        changed = musics.update(language=Replace('language', Value('\n'), Value('')))
+        # update不触发信号，语种的多对多关系中还是原来的 '国\n语'，重新同步这批歌曲
+        sync_music_labels(list(musics.only('genre_ids', 'language')))
+        return changed
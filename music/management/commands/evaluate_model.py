@@ -0,0 +1,99 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from music.evaluation import holdout_split, pareto_front, run_trial
+from music.interactions import load_interactions
+
+# 子进程中使用的训练集和测试集，每个子进程只接收一次
+_worker_data = None
+
+
+def _init_worker(train, test, k):
+    global _worker_data
+    django.setup()
+    _worker_data = (train, test, k)
+
+
+def _trial(params):
+    train, test, k = _worker_data
+    return run_trial(train, test, params, k)
+
+
+# 参数网格：每个算法的参数取值的所有组合
+def build_grid(options):
+    grid = []
+    for engine in options['engine']:
+        if engine == 'als':
+            names = ('n_factors', 'n_iterations', 'reg', 'alpha')
+            values = (options['factors'], options['epochs'], options['reg'] or [0.01], options['alpha'])
+        else:
+            names = ('n_factors', 'n_epochs', 'reg_all', 'lr_all')
+            values = (options['factors'], options['epochs'], options['reg'] or [0.02], options['lr'])
+        grid.extend({'engine': engine, **dict(zip(names, combination))} for combination in itertools.product(*values))
+    return grid
+
+
+# 离线评估和参数搜索：python manage.py evaluate_model --factors 16 32 64 --epochs 10 20
+# 每组参数在一个子进程中训练和评估，多进程同时运行时延迟会偏高，需要准确的延迟时使用 --workers 1
+class Command(BaseCommand):
+    help = '按用户留出测试集，多进程搜索推荐模型的参数，输出准确率、召回率、NDCG、覆盖率、训练用时和打分延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', nargs='+', choices=['svd', 'als'], default=['svd'], help='训练算法')
+        parser.add_argument('--factors', nargs='+', type=int, default=[100], help='隐向量维度')
+        parser.add_argument('--epochs', nargs='+', type=int, default=[20], help='训练轮数（ALS为交替迭代次数）')
+        parser.add_argument('--reg', nargs='+', type=float, default=None, help='正则化系数，默认SVD为0.02，ALS为0.01')
+        parser.add_argument('--lr', nargs='+', type=float, default=[0.005], help='学习率，只用于SVD')
+        parser.add_argument('--alpha', nargs='+', type=float, default=[40.0], help='ALS的置信度系数')
+        parser.add_argument('--k', type=int, default=10, help='每个用户推荐的歌曲数')
+        parser.add_argument('--test-fraction', type=float, default=0.2, help='每个用户留作测试的喜欢比例')
+        parser.add_argument('--min-likes', type=int, default=2, help='参与评估的用户至少喜欢的歌曲数')
+        parser.add_argument('--seed', type=int, default=0, help='划分测试集的随机种子')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='进程数')
+        parser.add_argument('--output', default=None, help='结果保存为JSON文件')
+
+    def handle(self, *args, **options):
+        # 所有参数使用同一份评分快照和同一个测试集
+        train, test = holdout_split(load_interactions(), options['test_fraction'], options['min_likes'],
+                                    options['seed'])
+        if not test:
+            raise CommandError('没有可以评估的用户，请减小 --min-likes 或等待更多评分数据')
+        grid = build_grid(options)
+        self.stdout.write(f'训练集评分 {len(train.ratings)}，测试用户 {len(test)}，参数组合 {len(grid)}')
+
+        started = time.time()
+        results = []
+        with ProcessPoolExecutor(max_workers=min(options['workers'], len(grid)), initializer=_init_worker,
+                                 initargs=(train, test, options['k'])) as executor:
+            for params, metrics in executor.map(_trial, grid):
+                results.append((params, metrics))
+                self.stdout.write(f'[{len(results)}/{len(grid)}] {self.format_params(params)}  '
+                                  f'{self.format_metrics(metrics)}')
+
+        # 以NDCG和单用户打分延迟的帕累托前沿作为候选配置，按NDCG从高到低输出
+        quality = f'ndcg@{options["k"]}'
+        front = pareto_front(results, quality)
+        self.stdout.write(self.style.SUCCESS(f'帕累托前沿（{quality} / latency_ms），用时 {time.time() - started:.1f} 秒：'))
+        for index in sorted(front, key=lambda i: -results[i][1][quality]):
+            params, metrics = results[index]
+            self.stdout.write(f'  {self.format_params(params)}  {self.format_metrics(metrics)}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump([{'params': params, 'metrics': metrics, 'pareto': index in front}
+                           for index, (params, metrics) in enumerate(results)], f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def format_params(params):
+        return ' '.join(f'{name}={value}' for name, value in params.items())
+
+    @staticmethod
+    def format_metrics(metrics):
+        return ' '.join(f'{name}={value:.4f}' if isinstance(value, float) else f'{name}={value}'
+                        for name, value in metrics.items())
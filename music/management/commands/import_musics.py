@@ -0,0 +1,126 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from music.catalog import catalog_changed, sync_music_labels
+from music.models import Music
+from music.search import index_musics
+from music.subscribe import translate_genres, translate_language
+
+# 歌曲字段 -> CSV中可能的列名，按顺序取第一个存在的列
+COLUMNS = {
+    'song_id': ('song_id',),
+    'song_name': ('song_name', 'name'),
+    'song_length': ('song_length',),
+    'genre_ids': ('genre_ids',),
+    'artist_name': ('artist_name',),
+    'composer': ('composer',),
+    'lyricist': ('lyricist',),
+    'language': ('language',),
+    'url': ('url',),
+}
+UPDATE_FIELDS = ['song_name', 'song_length', 'genre_ids', 'artist_name', 'composer', 'lyricist', 'language']
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+# CSV的一行转换为歌曲字段，流派和语言编号转换为中文
+def _parse_row(row, columns):
+    values = {field: (row[index] if index < len(row) else '') for field, index in columns.items()}
+    fields = {
+        'song_id': values['song_id'].strip(),
+        'song_name': values.get('song_name', '').strip(),
+        'song_length': _int(values.get('song_length')),
+        'genre_ids': translate_genres(values.get('genre_ids')),
+        'artist_name': values.get('artist_name', '').strip(),
+        'composer': values.get('composer', '').strip(),
+        'lyricist': values.get('lyricist', '').strip(),
+        'language': translate_language(values.get('language')),
+    }
+    if values.get('url'):
+        fields['url'] = values['url'].strip()
+    return fields
+
+
+# 批量导入歌曲：python manage.py import_musics songs.csv
+# 逐行读取文件，内存占用与文件大小无关；已存在的歌曲（按song_id）更新，不存在的新建
+class Command(BaseCommand):
+    help = '从CSV文件批量导入歌曲，流派和语言编号自动转换为中文'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV文件路径，第一行为列名，必须包含song_id列')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每个事务写入的歌曲数')
+        parser.add_argument('--encoding', default='utf-8', help='文件编码')
+        parser.add_argument('--limit', type=int, default=None, help='最多导入的行数')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        done = created = updated = 0
+        with open(options['path'], encoding=options['encoding'], newline='') as f:
+            reader = csv.reader(f)
+            header = [name.strip() for name in next(reader, [])]
+            columns = {}
+            for field, names in COLUMNS.items():
+                for name in names:
+                    if name in header:
+                        columns[field] = header.index(name)
+                        break
+            if 'song_id' not in columns:
+                raise CommandError('CSV文件缺少song_id列')
+            # 文件中没有url列时保留已有歌曲的链接
+            update_fields = UPDATE_FIELDS + (['url'] if 'url' in columns else [])
+
+            batch = {}
+            for row in reader:
+                if options['limit'] is not None and done + len(batch) >= options['limit']:
+                    break
+                fields = _parse_row(row, columns)
+                if not fields['song_id']:
+                    continue
+                # 同一批中重复的歌曲以最后一行为准
+                batch[fields['song_id']] = fields
+                if len(batch) >= options['batch_size']:
+                    batch_created, batch_updated = self.write_batch(batch, update_fields)
+                    created += batch_created
+                    updated += batch_updated
+                    done += len(batch)
+                    batch = {}
+                    elapsed = time.time() - started
+                    self.stdout.write(f'{done} 行，新建 {created}，更新 {updated}，{done / elapsed:.0f} 行/秒')
+            if batch:
+                batch_created, batch_updated = self.write_batch(batch, update_fields)
+                created += batch_created
+                updated += batch_updated
+                done += len(batch)
+
+        # 流派统计、搜索结果总数等缓存需要重新计算
+        catalog_changed()
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'导入完成：{done} 行，新建 {created}，更新 {updated}，用时 {elapsed:.1f} 秒，'
+            f'{done / max(elapsed, 1e-9):.0f} 行/秒'))
+
+    # 写入一批歌曲，返回（新建数，更新数）
+    # bulk_create不触发信号，写入后同步这批歌曲的流派、语种和搜索索引
+    @transaction.atomic
+    def write_batch(self, batch, update_fields):
+        existing = Music.objects.in_bulk(list(batch), field_name='song_id')
+        to_update = []
+        for song_id, music in existing.items():
+            for field, value in batch[song_id].items():
+                setattr(music, field, value)
+            to_update.append(music)
+        Music.objects.bulk_update(to_update, update_fields)
+        Music.objects.bulk_create([Music(**fields) for song_id, fields in batch.items() if song_id not in existing])
+        # 部分数据库（例如MySQL）bulk_create后不会设置主键，重新查询这批歌曲
+        musics = list(Music.objects.filter(song_id__in=list(batch)))
+        sync_music_labels(musics)
+        index_musics(musics)
+        return len(batch) - len(existing), len(existing)
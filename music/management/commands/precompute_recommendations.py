@@ -0,0 +1,141 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from music.factor_model import FactorModel, latest_version, model_path
+from music.fold_in import fold_in
+from music.hybrid import build_features, label_scores, model_scores, top_musics
+from music.interactions import load_interactions
+from music.models import Recommendation, UserProfile
+from music.scoring import score_items_batch
+
+# 子进程中加载的模型和歌曲特征，每个子进程只加载一次
+_worker_model = None
+_worker_features = None
+
+
+# 歌曲特征在主进程中读取后传给子进程，子进程不查询数据库
+def _init_worker(engine, version, features):
+    global _worker_model, _worker_features
+    django.setup()
+    _worker_model = FactorModel.load(model_path(engine, version))
+    _worker_features = features
+
+
+# 计算一批用户的混合推荐结果（music.hybrid），rated为每个用户已评分的（歌曲id数组，评分数组），
+# subscribes为每个用户订阅的（流派，语种）
+# 返回（这批用户id, [(用户id, 歌曲id列表, 分数列表)]），没有任何评分数据的新用户跳过
+def _recommend_shard(args):
+    user_ids, rated, subscribes, top_n, sub_batch = args
+    model = _worker_model
+    features = _worker_features
+    weight = settings.HYBRID_WEIGHTS['model']
+    results = []
+    for start in range(0, len(user_ids), sub_batch):
+        batch_users, factors, biases = [], [], []
+        for user_id in user_ids[start:start + sub_batch]:
+            item_ids, ratings = rated.get(user_id, (np.empty(0, dtype=np.int64), np.empty(0)))
+            inner_uid = model.user_index.get(user_id)
+            if inner_uid is not None:
+                factors.append(model.user_factors[inner_uid])
+                biases.append(model.user_bias[inner_uid])
+            elif len(item_ids) > 0:
+                # 不在训练集中的用户，根据评分即时求解用户向量
+                factor, bias = fold_in(model, item_ids, ratings)
+                factors.append(factor)
+                biases.append(bias)
+            else:
+                continue
+            batch_users.append(user_id)
+        if not batch_users:
+            continue
+        # 一次矩阵乘法为这批用户的所有歌曲打分，再逐个用户加上订阅和热度的分数
+        item_scores = score_items_batch(model, np.array(factors), biases)
+        for user_id, user_scores in zip(batch_users, item_scores):
+            scores = label_scores(features, *subscribes[user_id]) + weight * model_scores(features, model, user_scores)
+            music_ids, scores = top_musics(features, scores, rated.get(user_id, ((), ()))[0], top_n)
+            results.append((user_id, music_ids.tolist(), scores.tolist()))
+    return user_ids, results
+
+
+# 离线批量计算所有用户的推荐结果：python manage.py precompute_recommendations
+class Command(BaseCommand):
+    help = '多进程批量计算所有用户的推荐结果并写入推荐结果表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='进程数')
+        parser.add_argument('--top-n', type=int, default=settings.RECOMMEND_TOP_K, help='每个用户推荐的歌曲数')
+        parser.add_argument('--shard-size', type=int, default=500, help='每个任务处理的用户数')
+        parser.add_argument('--sub-batch', type=int, default=64, help='一次矩阵乘法同时打分的用户数')
+        parser.add_argument('--start-user', type=int, default=None, help='从该用户id开始（包含），用于中断后继续')
+        parser.add_argument('--end-user', type=int, default=None, help='到该用户id结束（包含）')
+
+    def handle(self, *args, **options):
+        version = latest_version()
+        if version is None:
+            raise CommandError('推荐模型尚未训练，请先运行 python manage.py train_model')
+
+        profiles = UserProfile.objects.order_by('user_id')
+        if options['start_user'] is not None:
+            profiles = profiles.filter(user_id__gte=options['start_user'])
+        if options['end_user'] is not None:
+            profiles = profiles.filter(user_id__lte=options['end_user'])
+        subscribes = {user_id: (genres, languages) for user_id, genres, languages
+                      in profiles.values_list('user_id', 'genre_subscribe', 'language_subscribe')}
+        user_ids = list(subscribes)
+        if not user_ids:
+            self.stdout.write(self.style.WARNING('没有需要计算的用户'))
+            return
+
+        # 读取一次评分快照，按用户分组，用于排除已评分的歌曲和求解新用户的向量
+        interactions = load_interactions()
+        order = np.argsort(interactions.user_ids, kind='stable')
+        sorted_users = interactions.user_ids[order]
+        sorted_items = interactions.item_ids[order].astype(np.int64)
+        sorted_ratings = interactions.ratings[order].astype(np.float64)
+        unique_users, starts = np.unique(sorted_users, return_index=True)
+        ends = np.append(starts[1:], len(sorted_users))
+        groups = {int(u): (s, e) for u, s, e in zip(unique_users, starts, ends)}
+
+        def shards():
+            for start in range(0, len(user_ids), options['shard_size']):
+                shard_users = user_ids[start:start + options['shard_size']]
+                rated = {}
+                for user_id in shard_users:
+                    if user_id in groups:
+                        s, e = groups[user_id]
+                        rated[user_id] = (sorted_items[s:e], sorted_ratings[s:e])
+                yield (shard_users, rated, {user_id: subscribes[user_id] for user_id in shard_users},
+                       options['top_n'], options['sub_batch'])
+
+        features = build_features()
+        # 子进程会继承主进程已经打开的数据库连接，多个进程共用一个连接会互相干扰，创建进程池前先关闭
+        connections.close_all()
+
+        started = time.time()
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker,
+                                 initargs=(settings.RECOMMEND_ENGINE, version, features)) as executor:
+            # map按提交顺序返回结果，按用户id从小到大依次写入，中断后可以从最后完成的用户继续
+            for shard_users, results in executor.map(_recommend_shard, shards()):
+                rows = [Recommendation(user_id=user_id, music_id=music_id, rank=rank, score=score,
+                                       model_version=version)
+                        for user_id, music_ids, scores in results
+                        for rank, (music_id, score) in enumerate(zip(music_ids, scores))]
+                with transaction.atomic():
+                    Recommendation.objects.filter(user_id__in=shard_users).delete()
+                    Recommendation.objects.bulk_create(rows, batch_size=1000)
+                done += len(shard_users)
+                elapsed = time.time() - started
+                self.stdout.write(f'{done}/{len(user_ids)} 用户，已完成至用户id {shard_users[-1]}，'
+                                  f'{done / elapsed:.1f} 用户/秒')
+
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'完成：模型版本 {version}，{done} 个用户，用时 {elapsed:.1f} 秒，{done / elapsed:.1f} 用户/秒'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music.models import Music, SearchGram
+from music.search import index_musics
+
+
+# 重建搜索索引：python manage.py rebuild_search_index
+# 歌曲保存时会自动更新索引，只在首次部署或批量修改数据后需要运行
+class Command(BaseCommand):
+    help = '重建歌曲搜索的n-gram索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的歌曲数')
+
+    def handle(self, *args, **options):
+        total = Music.objects.count()
+        done = 0
+        last_pk = 0
+        SearchGram.objects.all().delete()
+        while True:
+            # 按主键分批读取，不一次性加载全部歌曲
+            musics = list(Music.objects.filter(pk__gt=last_pk).order_by('pk')
+                          .only('song_name', 'artist_name', 'composer', 'lyricist')[:options['batch_size']])
+            if not musics:
+                break
+            with transaction.atomic():
+                index_musics(musics)
+            last_pk = musics[-1].pk
+            done += len(musics)
+            self.stdout.write(f'{done}/{total}')
+        self.stdout.write(self.style.SUCCESS(f'索引重建完成，共 {SearchGram.objects.count()} 条'))
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from music.als import train_als
+from music.ann import build_index, evaluate_recall
+from music.factor_model import save_model, train_svd
+from music.interactions import load_interactions, to_dataframe
+
+
+# 离线训练推荐模型：python manage.py train_model
+class Command(BaseCommand):
+    help = '离线训练推荐模型（SVD或隐式反馈ALS）并保存为新版本'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=['svd', 'als'], default=settings.RECOMMEND_ENGINE,
+                            help='训练算法，默认为settings.RECOMMEND_ENGINE')
+        parser.add_argument('--factors', type=int, default=100, help='隐向量维度')
+        parser.add_argument('--epochs', type=int, default=20, help='训练轮数（ALS为交替迭代次数）')
+        parser.add_argument('--lr', type=float, default=0.005, help='学习率，只用于SVD')
+        parser.add_argument('--reg', type=float, default=None, help='正则化系数，默认SVD为0.02，ALS为0.01')
+        parser.add_argument('--alpha', type=float, default=40.0, help='ALS的置信度系数')
+        parser.add_argument('--cg-steps', type=int, default=3, help='ALS每次迭代的共轭梯度步数')
+        parser.add_argument('--threads', type=int, default=None, help='ALS并行求解的线程数，默认为CPU核数')
+        parser.add_argument('--lists', type=int, default=None, help='近似最近邻索引的簇数，默认为歌曲数的平方根')
+        parser.add_argument('--recall-k', type=int, default=10, help='检查索引召回率时使用的k')
+
+    def handle(self, *args, **options):
+        interactions = load_interactions()
+        if len(interactions.ratings) == 0:
+            self.stdout.write(self.style.WARNING('没有任何用户评分数据，跳过训练'))
+            return
+        if options['engine'] == 'als':
+            reg = 0.01 if options['reg'] is None else options['reg']
+            model = train_als(interactions, n_factors=options['factors'], n_iterations=options['epochs'], reg=reg,
+                              alpha=options['alpha'], cg_steps=options['cg_steps'], threads=options['threads'])
+        else:
+            reg = 0.02 if options['reg'] is None else options['reg']
+            model = train_svd(to_dataframe(interactions), n_factors=options['factors'], n_epochs=options['epochs'],
+                              lr_all=options['lr'], reg_all=reg)
+
+        # 建立近似最近邻索引，并与精确打分对比召回率
+        index = build_index(model, n_lists=options['lists'])
+        k = options['recall_k']
+        nprobes = {min(2 ** i, index.n_lists) for i in range(index.n_lists.bit_length() + 1)}
+        nprobes.add(min(settings.ANN_NPROBE, index.n_lists))
+        for nprobe in sorted(nprobes):
+            recall = evaluate_recall(model, index, k, nprobe)
+            marker = ' <- ANN_NPROBE' if nprobe == min(settings.ANN_NPROBE, index.n_lists) else ''
+            self.stdout.write(f'nprobe={nprobe}/{index.n_lists} recall@{k}={recall:.3f}{marker}')
+
+        # 索引和模型一起写入新版本目录后再发布，新版本发布时索引已经存在
+        save_model(model, index)
+        self.stdout.write(self.style.SUCCESS(
+            f'模型训练完成：{model.engine} 版本 {model.version}，用户 {len(model.user_ids)}，歌曲 {len(model.item_ids)}，'
+            f'评分 {len(interactions.ratings)}'))
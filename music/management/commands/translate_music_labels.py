@@ -0,0 +1,44 @@
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Replace, Trim
+
+from music.catalog import sync_music_labels
+from music.maintenance import BatchCommand
+from music.models import Music
+from music.subscribe import genre_labels, language_labels, translate_genres
+
+
+# 与导入时的 translate_language 一致：去掉换行符和首尾空白后再匹配语种编号，'52.0\n' 也能转换
+def _language_code():
+    return Trim(Replace(F('language'), Value('\n'), Value('')))
+
+
+# 流派和语种编号转换为中文：python manage.py translate_music_labels
+# 语种和单个流派编号用 UPDATE ... SET x = CASE ... END 在数据库中直接转换，
+# 'a|b' 形式的多个流派编号逐个转换后用 bulk_update 写回
+class Command(BatchCommand):
+    help = '把歌曲的流派和语种编号转换为中文'
+
+    def queryset(self):
+        return Music.objects.annotate(language_code=_language_code()).filter(
+            Q(language_code__in=list(language_labels)) | Q(genre_ids__in=list(genre_labels)) |
+            Q(genre_ids__contains='|', genre_ids__regex=r'[0-9]'))
+
+    def process(self, pks):
+        musics = Music.objects.filter(pk__in=pks)
+        # 先去掉语种编号中的换行符和空白，再按编号精确匹配
+        language_pks = list(musics.annotate(language_code=_language_code())
+                            .filter(language_code__in=list(language_labels)).values_list('pk', flat=True))
+        Music.objects.filter(pk__in=language_pks).update(language=_language_code())
+        Music.objects.filter(pk__in=language_pks).update(language=Case(
+            *[When(language=code, then=Value(name)) for code, name in language_labels.items()],
+            default=F('language')))
+        musics.filter(genre_ids__in=list(genre_labels)).update(genre_ids=Case(
+            *[When(genre_ids=code, then=Value(name)) for code, name in genre_labels.items()],
+            default=F('genre_ids')))
+        multi_genres = list(musics.filter(genre_ids__contains='|', genre_ids__regex=r'[0-9]').only('genre_ids'))
+        for music in multi_genres:
+            music.genre_ids = translate_genres(music.genre_ids)
+        Music.objects.bulk_update(multi_genres, ['genre_ids'])
+        # update和bulk_update不触发信号，重新同步这批歌曲的流派和语种
+        sync_music_labels(list(musics.only('genre_ids', 'language')))
+        return len(pks)
@@ -0,0 +1,254 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+'''
+推荐流程的性能指标
+span('阶段名') 统计一段代码的耗时和执行的SQL查询数，记录到直方图中；
+increment() 记录缓存命中、未命中等计数；
+/metrics 以Prometheus文本格式输出所有指标，供Prometheus抓取。
+add_hook() 注册自定义的处理函数，每个阶段结束时调用，可以把数据发送到日志、StatsD等其他系统。
+指标保存在进程内存中，多进程部署时每个进程分别统计，由Prometheus按实例汇总。
+SQL查询数按请求（协程）统计：每个数据库连接建立时安装同一个计数函数，计入当前上下文（contextvars）中正在统计的阶段，
+异步视图交给线程池执行的查询复制了请求的上下文，同样计入该请求，不会计入同时处理的其他请求。
+'''
+
+# 直方图的分桶上限，单位为秒
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# (指标名, 标签) -> 计数
+_counters = {}
+# (指标名, 标签) -> [各分桶计数, 总和, 次数]
+_histograms = {}
+_hooks = []
+_HELP = {
+    'mrs_stage_seconds': '推荐流程各阶段的耗时',
+    'mrs_stage_queries_total': '推荐流程各阶段执行的SQL查询数',
+    'mrs_request_seconds': '页面和接口的响应时间',
+    'mrs_request_queries_total': '页面和接口执行的SQL查询数',
+    'mrs_cache_total': '缓存命中和未命中次数',
+    'mrs_model_info': '当前使用的推荐模型版本',
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+# 计数器加amount
+def increment(name, amount=1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# 记录一次观测值到直方图
+def observe(name, value, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+# 注册自定义处理函数 hook(阶段名, 耗时秒数, 查询数, 标签字典)
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+
+# 当前上下文中正在统计的计数器，嵌套的阶段都会计数
+_active_counters = contextvars.ContextVar('mrs_query_counters', default=())
+
+
+def _count_query(execute, sql, params, many, context):
+    for counter in _active_counters.get():
+        counter.add()
+    return execute(sql, params, many, context)
+
+
+# 每个线程的数据库连接建立时安装计数函数
+def _install_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_counter)
+
+
+# 统计with块内当前上下文执行的查询数
+@contextmanager
+def _counting():
+    # 本模块导入前已经建立的连接没有收到信号，在这里补装
+    for connection in connections.all():
+        _install_counter(None, connection)
+    counter = _QueryCounter()
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+
+
+@contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        with _counting() as counter:
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('mrs_stage_seconds', elapsed, stage=name, **labels)
+        increment('mrs_stage_queries_total', counter.count, stage=name, **labels)
+        for hook in list(_hooks):
+            hook(name, elapsed, counter.count, labels)
+
+
+# 函数装饰器形式的span
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _observe_request(request, response, elapsed, queries):
+    match = getattr(request, 'resolver_match', None)
+    labels = {'route': match.route if match else 'unmatched', 'method': request.method,
+              'status': response.status_code}
+    observe('mrs_request_seconds', elapsed, **labels)
+    increment('mrs_request_queries_total', queries, **labels)
+
+
+# 流式响应（StreamingHttpResponse）的内容在视图返回后才生成，其中的查询和耗时也计入这个请求，
+# 内容输出完（或客户端断开）时才记录，耗时包括输出响应内容的时间
+# 每生成一块内容单独统计一次：ASGI下每块可能在不同的线程和上下文中生成
+def _observe_streaming(request, response, content, started, queries):
+    iterator = iter(content)
+    try:
+        while True:
+            with _counting() as counter:
+                chunk = next(iterator, None)
+            queries += counter.count
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        _observe_request(request, response, time.perf_counter() - started, queries)
+
+
+def _finish(request, response, started, queries):
+    # 异步迭代的流式响应无法在同步生成器中读取，只统计视图本身
+    if response.streaming and not getattr(response, 'is_async', False):
+        response.streaming_content = _observe_streaming(request, response, response.streaming_content, started, queries)
+    else:
+        _observe_request(request, response, time.perf_counter() - started, queries)
+    return response
+
+
+# 记录每个页面和接口的响应时间和查询数，按路由分别统计
+# 同时支持同步（WSGI）和异步（ASGI）处理，异步请求不需要转到同步线程中执行
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            with _counting() as counter:
+                response = await get_response(request)
+            return _finish(request, response, started, counter.count)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            with _counting() as counter:
+                response = get_response(request)
+            return _finish(request, response, started, counter.count)
+    return middleware
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# 以Prometheus文本格式输出所有指标
+def render_metrics():
+    from music.factor_model import latest_version
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    version = latest_version()
+    if version is not None:
+        lines.append(f'# HELP mrs_model_info {_HELP["mrs_model_info"]}')
+        lines.append('# TYPE mrs_model_info gauge')
+        labels = [('engine', settings.RECOMMEND_ENGINE), ('version', version)]
+        lines.append(f'mrs_model_info{_format_labels(labels)} 1')
+    return '\n'.join(lines) + '\n'
+
+
+# 指标接口：GET /metrics
+def metrics_view(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.5 on 2026-10-19 01:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_music_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='music',
+            options={'verbose_name': '音乐信息', 'verbose_name_plural': '音乐信息'},
+        ),
+        migrations.AlterModelOptions(
+            name='userprofile',
+            options={'verbose_name': '用户信息', 'verbose_name_plural': '用户信息'},
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='first_run',
+            field=models.BooleanField(default=True, verbose_name='是否第一次运行,执行冷启动策略'),
+        ),
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(verbose_name='排名')),
+                ('score', models.FloatField(verbose_name='预测评分')),
+                ('model_version', models.CharField(max_length=20, verbose_name='模型版本')),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.Music')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '推荐结果',
+                'verbose_name_plural': '推荐结果',
+                'indexes': [models.Index(fields=['user', 'model_version', 'rank'], name='music_recom_user_id_e4f819_idx')],
+            },
+        ),
+    ]
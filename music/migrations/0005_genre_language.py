@@ -0,0 +1,79 @@
+# Generated by Django 3.0.5 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+def split_labels(value):
+    labels = []
+    for label in (value or '').split('|'):
+        label = label.strip()
+        if label and label not in labels:
+            labels.append(label)
+    return labels
+
+
+# 根据已有歌曲的genre_ids和language生成流派、语种及多对多关系
+def populate_labels(apps, schema_editor):
+    Music = apps.get_model('music', 'Music')
+    Genre = apps.get_model('music', 'Genre')
+    Language = apps.get_model('music', 'Language')
+    genre_ids, language_ids = {}, {}
+    genre_rows, language_rows = [], []
+    for music_id, genre_text, language_text in Music.objects.values_list('pk', 'genre_ids', 'language').iterator():
+        for name in split_labels(genre_text):
+            if name not in genre_ids:
+                genre_ids[name] = Genre.objects.create(name=name).pk
+            genre_rows.append(Music.genres.through(music_id=music_id, genre_id=genre_ids[name]))
+        for name in split_labels(language_text):
+            if name not in language_ids:
+                language_ids[name] = Language.objects.create(name=name).pk
+            language_rows.append(Music.languages.through(music_id=music_id, language_id=language_ids[name]))
+        if len(genre_rows) + len(language_rows) >= 5000:
+            Music.genres.through.objects.bulk_create(genre_rows)
+            Music.languages.through.objects.bulk_create(language_rows)
+            genre_rows, language_rows = [], []
+    Music.genres.through.objects.bulk_create(genre_rows)
+    Music.languages.through.objects.bulk_create(language_rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='流派')),
+            ],
+            options={
+                'verbose_name': '流派',
+                'verbose_name_plural': '流派',
+            },
+        ),
+        migrations.CreateModel(
+            name='Language',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True, verbose_name='语种')),
+            ],
+            options={
+                'verbose_name': '语种',
+                'verbose_name_plural': '语种',
+            },
+        ),
+        migrations.AddField(
+            model_name='music',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='musics', to='music.Genre'),
+        ),
+        migrations.AddField(
+            model_name='music',
+            name='languages',
+            field=models.ManyToManyField(blank=True, related_name='musics', to='music.Language'),
+        ),
+        migrations.RunPython(populate_labels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.0.5 on 2026-10-19 01:38
+
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 与 music.search 中的字段编号和切分方式一致，迁移中保留一份，不随之后的代码修改而变化
+SEARCH_FIELDS = [(1, 'song_name'), (2, 'artist_name'), (3, 'composer'), (4, 'lyricist')]
+
+
+def ngrams(text):
+    grams = set()
+    for token in unicodedata.normalize('NFKC', text or '').lower().split():
+        grams.update(token)
+        grams.update(token[i:i + 2] for i in range(len(token) - 1))
+    return grams
+
+
+# 为已有歌曲建立搜索索引，部署后不需要再手动运行 rebuild_search_index
+def populate_search_index(apps, schema_editor):
+    Music = apps.get_model('music', 'Music')
+    SearchGram = apps.get_model('music', 'SearchGram')
+    rows = []
+    for music in Music.objects.only('pk', *[name for _, name in SEARCH_FIELDS]).iterator(chunk_size=2000):
+        rows.extend(SearchGram(gram=gram, music_id=music.pk, field=field)
+                    for field, name in SEARCH_FIELDS for gram in ngrams(getattr(music, name)))
+        if len(rows) >= 5000:
+            SearchGram.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    SearchGram.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_genre_language'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2, verbose_name='字符片段')),
+                ('field', models.PositiveSmallIntegerField(verbose_name='字段')),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.Music')),
+            ],
+            options={
+                'verbose_name': '搜索索引',
+                'verbose_name_plural': '搜索索引',
+                'unique_together': {('gram', 'field', 'music')},
+            },
+        ),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_searchgram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='music',
+            name='song_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='歌曲编号'),
+        ),
+    ]
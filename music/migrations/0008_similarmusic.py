@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-19 02:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_music_song_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarMusic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(verbose_name='排名')),
+                ('score', models.FloatField(verbose_name='相似度')),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_musics', to='music.Music')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.Music')),
+            ],
+            options={
+                'verbose_name': '相似歌曲',
+                'verbose_name_plural': '相似歌曲',
+                'indexes': [models.Index(fields=['music', 'rank'], name='music_simil_music_i_48f308_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-19 03:10
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+# 创建settings.CACHES中数据库缓存使用的缓存表，表已经存在时跳过
+def create_cache_table(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_similarmusic'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
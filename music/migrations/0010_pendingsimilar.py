@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-19 03:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0009_cache_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSimilar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('music', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.Music')),
+            ],
+            options={
+                'verbose_name': '待更新的相似歌曲',
+                'verbose_name_plural': '待更新的相似歌曲',
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils.functional import cached_property
 
 
 # 用户信息
@@ -14,6 +15,22 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+    # 用户喜欢的歌曲id，同一个对象只查询一次
+    @cached_property
+    def like_ids(self):
+        return set(UserProfile.likes.through.objects.filter(userprofile_id=self.pk).values_list('music_id', flat=True))
+
+    # 用户不喜欢的歌曲id，同一个对象只查询一次
+    @cached_property
+    def dislike_ids(self):
+        return set(UserProfile.dislikes.through.objects.filter(userprofile_id=self.pk)
+                   .values_list('music_id', flat=True))
+
+    # 用户已经喜欢或不喜欢的歌曲id，推荐时需要排除
+    @property
+    def rated_ids(self):
+        return self.like_ids | self.dislike_ids
+
     class Meta:
         verbose_name = '用户信息'
         verbose_name_plural = verbose_name
@@ -21,6 +38,8 @@ class UserProfile(models.Model):
 
 # 音乐
 class Music(models.Model):
+    # 数据集中的歌曲编号，批量导入时按编号更新已有歌曲，手动添加的歌曲为空
+    song_id = models.CharField('歌曲编号', max_length=100, unique=True, null=True, blank=True)
     song_name = models.CharField('歌曲名称', max_length=1000)
     song_length = models.IntegerField('歌曲长度 单位为ms')
     genre_ids = models.CharField('歌曲流派', max_length=100)
@@ -29,6 +48,9 @@ class Music(models.Model):
     lyricist = models.CharField('作词', max_length=1000)
     language = models.CharField('语种', max_length=20)
     url = models.CharField('歌曲链接', max_length=1000, default="https://m701.music.126.net/20240301234259/3c4c6553837086cd21eb6013475d9d05/jdymusic/obj/wo3DlMOGwrbDjj7DisKw/27978919250/663c/4088/7b7a/0c48207cb013f953f46fe2da7dd7f803.mp3")
+    # 流派和语种拆分后的多对多关系，歌曲保存时根据genre_ids和language自动同步
+    genres = models.ManyToManyField('Genre', blank=True, related_name='musics')
+    languages = models.ManyToManyField('Language', blank=True, related_name='musics')
 
     def __str__(self):
         return self.song_name
@@ -36,3 +58,87 @@ class Music(models.Model):
     class Meta:
         verbose_name = '音乐信息'
         verbose_name_plural = verbose_name
+
+
+# 流派
+class Genre(models.Model):
+    name = models.CharField('流派', max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = '流派'
+        verbose_name_plural = verbose_name
+
+
+# 语种
+class Language(models.Model):
+    name = models.CharField('语种', max_length=20, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = '语种'
+        verbose_name_plural = verbose_name
+
+
+# 搜索索引：歌曲名、歌手、作曲、作词中的单字和相邻两个字（bigram）
+class SearchGram(models.Model):
+    gram = models.CharField('字符片段', max_length=2)
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='+')
+    field = models.PositiveSmallIntegerField('字段')
+
+    def __str__(self):
+        return f'{self.gram}: {self.music_id}'
+
+    class Meta:
+        verbose_name = '搜索索引'
+        verbose_name_plural = verbose_name
+        unique_together = [('gram', 'field', 'music')]
+
+
+# 离线批量计算的推荐结果（python manage.py precompute_recommendations）
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveIntegerField('排名')
+    score = models.FloatField('预测评分')
+    model_version = models.CharField('模型版本', max_length=20)
+
+    def __str__(self):
+        return f'{self.user_id}-{self.rank}: {self.music_id}'
+
+    class Meta:
+        verbose_name = '推荐结果'
+        verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['user', 'model_version', 'rank'])]
+
+
+# 相似歌曲表，每首歌保存最相似的前N首（python manage.py build_similar_musics）
+class SimilarMusic(models.Model):
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='similar_musics')
+    similar = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveIntegerField('排名')
+    score = models.FloatField('相似度')
+
+    def __str__(self):
+        return f'{self.music_id}-{self.rank}: {self.similar_id}'
+
+    class Meta:
+        verbose_name = '相似歌曲'
+        verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['music', 'rank'])]
+
+
+# 喜欢关系变化后需要重新计算相似歌曲的歌曲，由 build_similar_musics --pending 批量处理
+class PendingSimilar(models.Model):
+    music = models.OneToOneField(Music, on_delete=models.CASCADE, related_name='+')
+
+    def __str__(self):
+        return str(self.music_id)
+
+    class Meta:
+        verbose_name = '待更新的相似歌曲'
+        verbose_name_plural = verbose_name
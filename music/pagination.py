@@ -0,0 +1,128 @@
+import hashlib
+import operator
+from functools import reduce
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .catalog import catalog_version
+from .cursors import decode_cursor, encode_cursor
+
+'''
+键集分页（seek分页）
+按排序字段的值定位，例如 WHERE id > 上一页最后一条的id ORDER BY id LIMIT 10，
+不使用 OFFSET，也不需要 COUNT(*)，翻到第几页耗时都和第一页一样。
+上一页/下一页通过游标（before/after）定位；总数可选，从缓存读取。
+'''
+
+# 总数缓存时间，单位为秒；曲库变化后版本号改变，缓存自然失效
+COUNT_CACHE_TIMEOUT = 60 * 10
+
+
+# 查询总数，count_key不为空时按曲库版本缓存结果
+def cached_count(queryset, count_key=None):
+    if count_key is None:
+        return queryset.count()
+    # count_key可能包含搜索关键词等任意字符，转换为摘要作为缓存键
+    key = f'count:{hashlib.md5(count_key.encode()).hexdigest()}:{catalog_version()}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor  # 下一页游标，没有下一页时为None
+        self.previous_cursor = previous_cursor  # 上一页游标，没有上一页时为None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    # keys为排序字段，需要能唯一确定顺序，'-score' 表示按score降序
+    # 记录可以是模型对象，也可以是 values() 返回的字典
+    def __init__(self, queryset, per_page, keys=('pk',), count_key=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = [(key.lstrip('-'), key.startswith('-')) for key in keys]
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        return cached_count(self.queryset, self.count_key)
+
+    def _key_of(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name, _ in self.keys]
+        return [getattr(row, name) for name, _ in self.keys]
+
+    # 排在values之后（forward=True）或之前的记录，按字段依次比较
+    def _seek(self, values, forward):
+        conditions = []
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = 'lt' if descending == forward else 'gt'
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': value}))
+            equal[name] = value
+        return reduce(operator.or_, conditions)
+
+    def _ordering(self, forward):
+        return [name if descending != forward else f'-{name}' for name, descending in self.keys]
+
+    # 获取after游标之后或before游标之前的一页，都为空时返回第一页；游标无效时抛出ValueError
+    def page(self, after=None, before=None):
+        cursor = after or before
+        forward = not before
+        queryset = self.queryset
+        if cursor:
+            position = decode_cursor(cursor)
+            values = position.get('k') if position is not None else None
+            # 游标由客户端传回，可能被篡改：每个值必须是标量，并且能转换为对应排序字段的类型
+            if not isinstance(values, list) or len(values) != len(self.keys) \
+                    or not all(isinstance(value, (str, int, float)) and not isinstance(value, bool)
+                               for value in values):
+                raise ValueError('invalid cursor')
+            try:
+                queryset = queryset.filter(self._seek(values, forward))
+            except (TypeError, ValidationError):
+                raise ValueError('invalid cursor')
+        # 多取一条用于判断是否还有更多
+        rows = list(queryset.order_by(*self._ordering(forward))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or not forward:
+                next_cursor = encode_cursor({'k': self._key_of(rows[-1])})
+            if cursor and (has_more or forward):
+                previous_cursor = encode_cursor({'k': self._key_of(rows[0])})
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+
+# 总数从缓存读取的分页器，用于后台管理等仍需要页码的场景
+# 不同的筛选、搜索条件对应不同的SQL，按SQL分别缓存
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list, str(self.object_list.query))
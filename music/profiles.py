@@ -0,0 +1,14 @@
+from django.http import HttpRequest
+
+from music.models import UserProfile
+
+
+# 获取当前登录用户的资料，同一个请求只查询一次，装饰器、视图和推荐共用
+# 未登录或找不到用户资料时返回None
+def get_profile(request: HttpRequest):
+    if not hasattr(request, '_cached_profile'):
+        profile = None
+        if request.user.is_authenticated:
+            profile = UserProfile.objects.select_related('user').filter(user=request.user).first()
+        request._cached_profile = profile
+    return request._cached_profile
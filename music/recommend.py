@@ -1,19 +1,22 @@
 import os
 
 import django
-import pandas as pd
+from django.conf import settings
 from django.contrib import messages
+from django.core.cache import caches
 from django.http import HttpRequest
-from surprise import Dataset, Reader, Prediction
-from surprise import SVD
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MusicRecommendSystem.settings")
 django.setup()
 
 from django.contrib.auth.models import User
-from music.models import UserProfile, Music
-
-current_request = None
+from music.ann import load_index
+from music.factor_model import latest_version, load_model
+from music.fold_in import user_vector
+from music.hybrid import rank_musics
+from music.interactions import load_interactions, to_dataframe
+from music.metrics import increment, span, timed
+from music.models import Music, Recommendation, UserProfile
 
 '''
 SVD（Singular Value Decomposition）是一种基于矩阵分解的算法，通常用于推荐系统中的评分预测。
@@ -34,15 +37,10 @@ SVD算法的原理步骤：
 
 
 # 获取数据库中所有用户数据
+@timed('build_df')
 def build_df():
-    data = []
-    for user_profile in UserProfile.objects.all():  # 获取所有的用户信息
-        for like_music in user_profile.likes.all():  # 循环获取所有用户喜欢的歌曲
-            data.append([user_profile.user.id, like_music.pk, 1])  # 保存数据data = [[1,1,1],]
-        for dislike_music in user_profile.dislikes.all():  # 循环获取所有用户不喜欢的歌曲
-            data.append([user_profile.user.id, dislike_music.pk, 0])  # 保存数据data = [[1,2,0]]
-
-    return pd.DataFrame(data, columns=['userID', 'itemID', 'rating'])  # 存储格式
+    # 批量读取多对多中间表，避免逐个用户查询
+    return to_dataframe(load_interactions())  # 存储格式
 
 
 '''
@@ -56,144 +54,80 @@ userID  itemID  rating
 '''
 
 
-# 根据用户的评分数据来构建预测模型，并返回一组推荐的音乐列表
-def build_predictions(df: pd.DataFrame, user: User):
-    userId = user.id  # 获取用户的ID
-    profile = UserProfile.objects.filter(user=user)  # 查找用户的个人资料信息
-    if profile.exists():
-        profile_obj: UserProfile = profile.first()
-    else:
-        return []
-    # print("profile", profile)  # <QuerySet [<UserProfile: wyucnk>]>
-    # 使用Surprise库中的Reader和Dataset类来构建评分数据集
-    # 指定评分范围为0到1之间的连续值
-    reader = Reader(rating_scale=(0, 1))
-    # 将数据加载到评分数据集中
-    data = Dataset.load_from_df(df[['userID', 'itemID', 'rating']], reader)
-    # 使用评分数据集构建训练集
-    trainset = data.build_full_trainset()
-    # 创建一个SVD算法对象
-    algo = SVD()
-    # 通过algo.fit(trainset)方法训练算法，将训练集数据拟合到算法中
-    # 训练完毕
-    algo.fit(trainset)
-
-    # 取出当前所有有人评分过的歌曲，并去重
-    subsets = df[['itemID']].drop_duplicates()
-    # print('subsets', subsets)
-    '''
-    itemID
-       1
-       4
-       9
-       2
-       3
-       ...
-    '''
-    # 测试集
-    testset = []
-    # 从评分数据中提取出所有被评分过的音乐，并将其作为测试集
-    for row in subsets.iterrows():
-        # 测试集中的评分值被设置为0，因为我们只是想预测用户是否会喜欢这些音乐，而不关心具体的评分值。
-        testset.append([userId, row[1].values[0], 0])
-    # print('testset', testset)
-    '''
-     [[4, 1, 0], [4, 4, 0], [4, 9, 0], [4, 2, 0], [4, 3, 0], [4, 5, 0], [4, 19, 0], [4, 21, 0], [4, 63, 0], 
-    '''
-    # 用训练好的算法对测试集进行预测，返回一个包含预测结果的列表
-    predictions = algo.test(testset, verbose=True)
-    # print('predictions', predictions)
-    '''
-    预测结果：用户id为4的用户对物品id为1的物品的评分预测为0.8837081860340208
-    r_ui表示实际评分为0，est表示预测评分为0.8837081860340208。
-    details中的was_impossible为False表示该预测能够完成，不是不可能的预测。
-    [Prediction(uid=4, iid=1, r_ui=0, est=0.8837081860340208, details={'was_impossible': False}), 
-    '''
-    result_set = []
-    user_like = profile_obj.likes.all()  # 当前用户喜欢的
-    user_dislike = profile_obj.dislikes.all()  # 当前用户不喜欢的
-    # 遍历所有预测结果
-    for item in predictions:
-        prediction: Prediction = item
-        # 对于预测评分高于0.99的音乐，它从数据库中获取相应的音乐对象
-        if prediction.est > 0.99:
-            music = Music.objects.get(pk=prediction.iid)
-            # 检查是否用户已经喜欢或不喜欢该音乐，如果是，则跳过该音乐。
-            if music in user_like:
-                continue
-            if music in user_dislike:
-                continue
-            result_set.append(music)
-    if len(result_set) == 0:
-        messages.error(current_request, '你听的歌太少了，多听点歌再来吧~')
-    # print('result_set', result_set)
-    '''
-     [<Music: 愛我的資格>, <Music: 裂縫中的陽光 (Before Sunrise)>, <Music: PLAYING WITH FIRE>, 
-    '''
-    return result_set
-
-
-# 获取用户流派推荐
-def build_genre_predictions(user: User):
-    predictions = []
-    profile = UserProfile.objects.filter(user=user)  # 用户信息
-    if profile.exists():
-        profile_obj: UserProfile = profile.first()
-    else:
-        return predictions
-
-    genre_subscribe = profile_obj.genre_subscribe.split(',')  # 获取用户订阅的流派
-    user_like = profile_obj.likes.all()  # 获取用户喜欢的音乐
-    user_dislike = profile_obj.dislikes.all()  # 获取用户不喜欢的音乐
-
-    # 查找遍历用户喜欢流派的所有音乐
-    for music in Music.objects.filter(genre_ids__in=genre_subscribe):
-        if music in user_like:
-            continue
-        if music in user_dislike:
-            continue
-        predictions.append(music)
-
-    return predictions
-
-
-# 构建语言推荐
-def build_language_predictions(user: User):
-    predictions = []
-    profile = UserProfile.objects.filter(user=user)
-    if profile.exists():
-        profile_obj: UserProfile = profile.first()
-    else:
-        return predictions
-
-    language_subscribe = profile_obj.language_subscribe.split(',')  # 获取用户喜欢的语言
-    user_like = profile_obj.likes.all()
-    user_dislike = profile_obj.dislikes.all()
-
-    for music in Music.objects.filter(language__in=language_subscribe):
-        if music in user_like:
-            continue
-        if music in user_dislike:
-            continue
-        predictions.append(music)
-
-    return predictions
-
-
-# 构建推荐
-def build_recommend(request: HttpRequest, user: User):
-    global current_request
-    current_request = request
-    predictions = []
-    predictions.extend(build_predictions(build_df(), user))  # 算法预测
-    if not predictions:
-        predictions.extend(build_genre_predictions(user))  # 流派推荐
-        predictions.extend(build_language_predictions(user))  # 语言推荐
-    return predictions
+# 提示信息发给传入的请求，不保存在全局变量中；离线调用时request为None，不提示
+def _notify(request: HttpRequest, message):
+    if request is not None:
+        messages.error(request, message)
+
+
+# 混合推荐：模型预测评分与订阅的流派、语种和歌曲热度加权求和，一次排序取前RECOMMEND_TOP_K首（music.hybrid）
+# 返回按推荐顺序排列的歌曲id列表；模型没有训练或无法为用户预测时，只按订阅和热度推荐
+@timed('predict')
+def build_predictions(profile: UserProfile, request: HttpRequest = None):
+    # 加载离线训练的模型（python manage.py train_model），不再在每次请求时重新训练
+    with span('load_model'):
+        model = load_model()
+    if model is None:
+        _notify(request, '推荐模型尚未训练，先为你推荐订阅的流派和语种中的热门歌曲~')
+
+    vector = candidates = None
+    # 用户在训练集中，或评分过模型中的歌曲时才能预测
+    if model is not None and (profile.user_id in model.user_index
+                              or any(music_id in model.item_index for music_id in profile.rated_ids)):
+        # 用户隐向量：在线更新过的向量、训练集中的向量，或根据当前评分即时求解
+        with span('user_vector'):
+            vector = user_vector(model, profile)
+        # 歌曲较多时先用近似最近邻索引取出候选歌曲，只对候选歌曲精确打分
+        index = load_index(model)
+        if index is not None and len(model.item_ids) >= settings.ANN_MIN_ITEMS:
+            candidates = index.candidates(vector[0], settings.ANN_NPROBE)
+
+    with span('score'):
+        music_ids, _ = rank_musics(profile, settings.RECOMMEND_TOP_K, model=model, vector=vector,
+                                   candidates=candidates)
+    if len(music_ids) == 0:
+        _notify(request, '你听的歌太少了，多听点歌再来吧~')
+    return music_ids.tolist()
+
+
+def _recommend_cache_key(user_id):
+    # 模型重新训练后版本号变化，旧的推荐结果自然失效
+    return f'recommend:{user_id}:{latest_version() or "none"}'
+
+
+# 获取推荐歌曲的id列表，结果按用户和模型版本保存在共享缓存中，翻页时直接从缓存中取
+def build_recommend_ids(request: HttpRequest, profile: UserProfile):
+    recommend_cache = caches[settings.RECOMMEND_CACHE_ALIAS]
+    key = _recommend_cache_key(profile.user_id)
+    music_ids = recommend_cache.get(key)
+    increment('mrs_cache_total', cache='recommend', result='miss' if music_ids is None else 'hit')
+    if music_ids is None:
+        # 优先读取离线批量计算好的推荐结果（python manage.py precompute_recommendations）
+        with span('precomputed'):
+            music_ids = list(Recommendation.objects.filter(user_id=profile.user_id, model_version=latest_version())
+                             .order_by('rank').values_list('music_id', flat=True))
+        increment('mrs_cache_total', cache='precomputed', result='hit' if music_ids else 'miss')
+        if not music_ids:
+            music_ids = build_predictions(profile, request)
+        recommend_cache.set(key, music_ids, settings.RECOMMEND_CACHE_TIMEOUT)
+    # 缓存写入和用户评分之间可能有先后（例如其他进程正在计算时用户刚评分），取出时再排除一次已评分的歌曲
+    rated_ids = profile.rated_ids
+    return [music_id for music_id in music_ids if music_id not in rated_ids]
+
+
+# 用户的喜欢、不喜欢或订阅发生变化后，清除缓存和离线计算的推荐结果
+def invalidate_recommend(user: User):
+    caches[settings.RECOMMEND_CACHE_ALIAS].delete(_recommend_cache_key(user.id))
+    Recommendation.objects.filter(user=user).delete()
+
+
+# 按id列表的顺序查询歌曲，已被删除的歌曲跳过
+@timed('load_musics')
+def load_musics(music_ids):
+    musics = Music.objects.in_bulk(music_ids)
+    return [musics[music_id] for music_id in music_ids if music_id in musics]
 
 
 if __name__ == '__main__':
     # print(build_df())  # 获取用户数据
-    print(build_predictions(build_df(), User.objects.get(pk=4)))  # 算法推荐
-    print(build_genre_predictions(User.objects.get(pk=4)))  # 流派推荐
-    print(build_language_predictions(User.objects.get(pk=4)))  # 语言推荐
+    print(load_musics(build_predictions(UserProfile.objects.get(user_id=4))))  # 混合推荐
@@ -0,0 +1,42 @@
+import numpy as np
+
+from music.factor_model import FactorModel
+
+'''
+向量化打分：一次矩阵乘法算出用户对所有歌曲的预测评分
+score = mu + b_u + b_i + Q · p_u
+再用 argpartition 选出前k个，只对这k个分数排序。
+'''
+
+
+# 计算用户对模型中所有歌曲的预测评分，返回长度为歌曲数的数组（下标为内部id）
+def score_items(model: FactorModel, user_factor, user_bias):
+    return model.global_mean + user_bias + model.item_bias + model.item_factors @ user_factor
+
+
+# 从分数中选出前k个，返回按分数从高到低排列的下标
+# exclude_mask为True的位置不参与排序
+def top_k(scores, k, exclude_mask=None):
+    if exclude_mask is not None:
+        scores = np.where(exclude_mask, -np.inf, scores)
+        k = min(k, len(scores) - int(np.count_nonzero(exclude_mask)))
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+# 只计算候选歌曲（内部id数组）的预测评分，例如近似最近邻索引的检索结果
+def score_candidates(model: FactorModel, user_factor, user_bias, candidates):
+    return model.global_mean + user_bias + model.item_bias[candidates] + model.item_factors[candidates] @ user_factor
+
+
+# 一次矩阵乘法计算多个用户对所有歌曲的预测评分，返回 用户数×歌曲数 的矩阵
+# user_factors为 用户数×隐向量维度 的矩阵
+def score_items_batch(model: FactorModel, user_factors, user_biases):
+    scores = model.global_mean + np.asarray(user_biases)[:, None] + model.item_bias[None, :]
+    return scores + user_factors @ model.item_factors.T
@@ -0,0 +1,93 @@
+import operator
+import unicodedata
+from functools import reduce
+
+from django.db.models import Case, Count, Exists, IntegerField, Max, OuterRef, Q, Sum, When
+
+from music.models import Music, SearchGram
+
+'''
+歌曲搜索的n-gram倒排索引，适用于没有空格分词的中文、日文、韩文
+1. 建索引：把歌曲名、歌手、作曲、作词统一转为小写半角，按空白切分后，
+   保存每个单字和相邻两个字（bigram），例如 '晴天' -> '晴', '天', '晴天'
+2. 查询：关键词按同样的方式切分，关键词长度大于1时只使用bigram，
+   包含关键词全部片段的歌曲是候选，再按主键检查搜索字段确实包含关键词，
+   按命中字段的权重排序（歌曲名 > 歌手 > 作曲、作词）
+查询只读取关键词片段的倒排列表，不再对整张歌曲表做 LIKE '%关键词%' 扫描。
+'''
+
+# 字段编号、字段名、排序权重
+SEARCH_FIELDS = [
+    (1, 'song_name', 8),
+    (2, 'artist_name', 4),
+    (3, 'composer', 1),
+    (4, 'lyricist', 1),
+]
+
+# 搜索方式对应的字段
+SEARCH_ACTIONS = {
+    'song_name': [1],
+    'artist_name': [2],
+}
+
+
+# 统一为小写半角，便于匹配
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+# 切分文本，返回单字和bigram
+def ngrams(text):
+    grams = set()
+    for token in normalize(text).split():
+        grams.update(token)
+        grams.update(token[i:i + 2] for i in range(len(token) - 1))
+    return grams
+
+
+# 关键词切分后用于查询的片段，关键词长度大于1时只用bigram，倒排列表更短
+def query_grams(keyword):
+    grams = set()
+    for token in normalize(keyword).split():
+        if len(token) == 1:
+            grams.add(token)
+        else:
+            grams.update(token[i:i + 2] for i in range(len(token) - 1))
+    return grams
+
+
+# 重建一批歌曲的索引，歌曲保存时由信号自动调用，批量导入需要手动调用
+def index_musics(musics):
+    musics = [music for music in musics if music.pk is not None]
+    if not musics:
+        return
+    SearchGram.objects.filter(music_id__in=[music.pk for music in musics]).delete()
+    SearchGram.objects.bulk_create([
+        SearchGram(gram=gram, music_id=music.pk, field=field)
+        for music in musics
+        for field, name, _ in SEARCH_FIELDS
+        for gram in ngrams(getattr(music, name))
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+# 搜索歌曲，返回按相关度排序的 {'music_id'/'music_pk': 歌曲id, 'score': 得分} 查询集，可以直接分页
+# 包含全部片段只是候选条件：片段可能不相邻（'爱情歌' 与 '爱情与情歌'），也可能来自不同字段（歌名 '晴天' 和歌手 '天娃'），
+# 所以候选歌曲还要按主键回表，检查关键词的每个词是否真的出现在某个搜索字段中
+def search_musics(keyword, action=None):
+    grams = query_grams(keyword)
+    if not grams:
+        return SearchGram.objects.none().values('music_id').annotate(music_pk=Max('music_id'), score=Sum('field'))
+    fields = SEARCH_ACTIONS.get(action, [field for field, _, _ in SEARCH_FIELDS])
+    weight = Case(*[When(field=field, then=weight) for field, _, weight in SEARCH_FIELDS if field in fields],
+                  default=0, output_field=IntegerField())
+    names = [name for field, name, _ in SEARCH_FIELDS if field in fields]
+    contains = [reduce(operator.or_, [Q(**{f'{name}__icontains': token}) for name in names])
+                for token in normalize(keyword).split()]
+    return (SearchGram.objects.filter(gram__in=grams, field__in=fields)
+            .filter(Exists(Music.objects.filter(*contains, pk=OuterRef('music_id'))))
+            .values('music_id')
+            # music_pk与music_id相同，写成聚合值才能和score一起用于键集分页的条件
+            .annotate(matched=Count('gram', distinct=True), score=Sum(weight), music_pk=Max('music_id'))
+            .filter(matched=len(grams))
+            .order_by('-score', 'music_pk')
+            .values('music_id', 'music_pk', 'score'))
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from music.catalog import catalog_changed, sync_music_labels
+from music.models import Music
+from music.search import index_musics
+
+
+# 歌曲保存后同步流派、语种和搜索索引
+@receiver(post_save, sender=Music)
+def music_saved(sender, instance: Music, raw=False, **kwargs):
+    if raw:  # 导入fixture时不处理
+        return
+    sync_music_labels([instance])
+    index_musics([instance])
+    catalog_changed()
+
+
+# 歌曲删除后流派和语种的歌曲数发生变化，曲库版本号更新
+@receiver(post_delete, sender=Music)
+def music_deleted(sender, instance: Music, **kwargs):
+    catalog_changed()
@@ -0,0 +1,131 @@
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from music.factor_model import FactorModel
+from music.interactions import Interactions
+from music.models import PendingSimilar, SimilarMusic, UserProfile
+from music.scoring import top_k
+
+'''
+相似歌曲（"听了这首歌的人也喜欢"）
+两种计算方式，由 settings.SIMILAR_METHOD 选择：
+colike   共同喜欢：L 为 用户×歌曲 的喜欢矩阵（0/1），L^T L 的第(i, j)项是同时喜欢两首歌的人数，
+         除以 sqrt(n_i * n_j)（各自被喜欢的人数）得到余弦相似度；
+factors  隐向量：推荐模型中歌曲隐向量的余弦相似度，训练新模型后需要重新计算。
+每首歌只保存最相似的前N首，播放页按 (music, rank) 索引一次查询即可取出。
+全量计算按歌曲分块进行，每块只生成 块大小×歌曲数 的相似度，多进程并行（build_similar_musics命令）；
+用户喜欢/取消喜欢一首歌后，只把这首歌记为待更新（mark_similar_stale），不在请求中计算；
+build_similar_musics --pending 定期取出待更新的歌曲，逐首重新计算（refresh_similar）。
+'''
+
+
+# 喜欢矩阵：用户×歌曲的CSR稀疏矩阵，返回（矩阵，歌曲id数组）
+def like_matrix(interactions: Interactions):
+    liked = interactions.ratings == 1
+    user_ids, rows = np.unique(interactions.user_ids[liked], return_inverse=True)
+    item_ids, cols = np.unique(interactions.item_ids[liked], return_inverse=True)
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                           shape=(len(user_ids), len(item_ids)))
+    # 重复的喜欢记录只算一次
+    matrix.data[:] = 1
+    return matrix, item_ids.astype(np.int64)
+
+
+# 按共同喜欢计算start到end之间歌曲的相似歌曲，返回 [(歌曲下标, [(相似歌曲下标, 相似度)])]
+# item_users为喜欢矩阵的转置（歌曲×用户），counts为每首歌被喜欢的人数
+# 共同喜欢矩阵很稀疏，只对非零项计算相似度，不生成稠密矩阵
+def colike_neighbours(item_users: sp.csr_matrix, user_items: sp.csr_matrix, counts, start, end, top_n):
+    colikes = (item_users[start:end] @ user_items).tocsr()
+    results = []
+    for offset, index in enumerate(range(start, end)):
+        lo, hi = colikes.indptr[offset], colikes.indptr[offset + 1]
+        columns = colikes.indices[lo:hi]
+        scores = colikes.data[lo:hi] / np.sqrt(counts[index] * counts[columns])
+        ranked = top_k(scores, top_n, columns == index)
+        results.append((index, [(int(columns[j]), float(scores[j])) for j in ranked]))
+    return results
+
+
+# 按隐向量的余弦相似度计算start到end之间歌曲的相似歌曲，normalized为单位长度的歌曲隐向量
+def factor_neighbours(normalized, start, end, top_n):
+    similarity = normalized[start:end] @ normalized.T
+    results = []
+    for index, scores in zip(range(start, end), similarity):
+        exclude = scores <= 0
+        exclude[index] = True
+        ranked = top_k(scores, top_n, exclude)
+        results.append((index, [(int(j), float(scores[j])) for j in ranked]))
+    return results
+
+
+# 单位长度的歌曲隐向量
+def normalize_factors(model: FactorModel):
+    norms = np.linalg.norm(model.item_factors, axis=1)
+    return (model.item_factors / np.where(norms > 0, norms, 1)[:, None]).astype(np.float32)
+
+
+# 替换一批歌曲的相似歌曲，neighbours为 [(歌曲id, [(相似歌曲id, 相似度)])]
+@transaction.atomic
+def save_neighbours(neighbours):
+    SimilarMusic.objects.filter(music_id__in=[music_id for music_id, _ in neighbours]).delete()
+    SimilarMusic.objects.bulk_create([
+        SimilarMusic(music_id=music_id, similar_id=similar_id, rank=rank, score=score)
+        for music_id, similar in neighbours
+        for rank, (similar_id, score) in enumerate(similar)
+    ], batch_size=1000)
+
+
+# 用户喜欢或取消喜欢一首歌后，重新计算这首歌的共同喜欢相似歌曲
+# 只读取最近喜欢这首歌的SIMILAR_MAX_LIKERS个用户，其他歌曲的相似歌曲在下次全量计算时更新
+def refresh_similar(music_id, top_n=None):
+    if settings.SIMILAR_METHOD != 'colike':
+        return
+    top_n = top_n or settings.SIMILAR_TOP_N
+    likes = UserProfile.likes.through.objects
+    total = likes.filter(music_id=music_id).count()
+    likers = list(likes.filter(music_id=music_id).order_by('-pk')
+                  .values_list('userprofile_id', flat=True)[:settings.SIMILAR_MAX_LIKERS])
+    if not likers:
+        save_neighbours([(music_id, [])])
+        return
+    colikes = dict(likes.filter(userprofile_id__in=likers).exclude(music_id=music_id)
+                   .values('music_id').annotate(count=Count('pk')).values_list('music_id', 'count'))
+    # 只对共同喜欢人数最多的一部分歌曲计算相似度
+    candidates = sorted(colikes, key=colikes.get, reverse=True)[:top_n * 5]
+    counts = dict(likes.filter(music_id__in=candidates).values('music_id').annotate(count=Count('pk'))
+                  .values_list('music_id', 'count'))
+    # 只读取了部分用户时，按比例估计全部用户中的共同喜欢人数
+    scale = total / len(likers)
+    scores = {j: colikes[j] * scale / np.sqrt(total * counts[j]) for j in candidates if counts.get(j)}
+    similar = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+    save_neighbours([(music_id, [(j, float(score)) for j, score in similar])])
+
+
+# 喜欢关系变化后把歌曲记为待更新，一条 INSERT，已经在队列中时忽略
+def mark_similar_stale(music_id):
+    if settings.SIMILAR_METHOD != 'colike':
+        return
+    PendingSimilar.objects.bulk_create([PendingSimilar(music_id=music_id)], ignore_conflicts=True)
+
+
+# 重新计算待更新歌曲的相似歌曲，每批先从队列中删除再计算，计算期间又有变化的歌曲会重新入队，返回处理的歌曲数
+def refresh_pending(batch_size=1000):
+    done = 0
+    while True:
+        pending = list(PendingSimilar.objects.order_by('pk').values_list('pk', 'music_id')[:batch_size])
+        if not pending:
+            return done
+        PendingSimilar.objects.filter(pk__in=[pk for pk, _ in pending]).delete()
+        for _, music_id in pending:
+            refresh_similar(music_id)
+        done += len(pending)
+
+
+# 播放页显示的相似歌曲，按 (music, rank) 索引一次查询
+def related_musics(music_id, limit=None):
+    limit = limit or settings.SIMILAR_TOP_N
+    return [row.similar for row in SimilarMusic.objects.filter(music_id=music_id).order_by('rank')
+            .select_related('similar')[:limit]]
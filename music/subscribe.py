@@ -5,7 +5,7 @@ import django
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MusicRecommendSystem.settings")
 django.setup()
 
-from music.models import Music
+from music.catalog import build_facets
 
 # 语言字典
 language_labels = {
@@ -52,47 +52,41 @@ genre_labels = {"465": "朋克", "444": "蓝调", "458": "拉丁", "726": "蓝
                 "516": "后摇", "907": "后摇", "102": "后摇", "1598": "后摇", "191": "后摇", "1124": "R&B/Soul"}
 
 
-# 构建流派id字典
+# 流派编号转换为中文，多个流派用 '|' 连接，例如 '465|1609' -> '朋克'，转换后重复的流派只保留一个
+def translate_genres(genre_ids):
+    genre_ids = (genre_ids or '').strip()
+    if genre_ids in genre_labels:
+        return genre_labels[genre_ids]
+    names = []
+    for genre_id in genre_ids.split('|'):
+        genre_id = genre_id.strip()
+        name = genre_labels.get(genre_id, genre_id)
+        if name and name not in names:
+            names.append(name)
+    return '|'.join(names)
+
+
+# 语言编号转换为中文，同时去除数据中多余的换行符和空白字符
+def translate_language(language):
+    language = (language or '').replace('\n', '').strip()
+    return language_labels.get(language, language)
+
+
+# 构建流派列表，返回 [(流派, 歌曲数)]
+# 从缓存的流派统计中读取，不再扫描整张歌曲表
 def build_genre_ids():
-    data = {}
-    genre_ids = Music.objects.values_list('genre_ids')
-    # print('genre_ids', genre_ids)
-    # 有些歌曲存在多个流派，所以要给他分开
-    for genre_id in genre_ids:
-        if '|' not in genre_id[0]:
-            genre = genre_id[0]
-            data[genre] = True
-        else:
-            for genre in genre_id[0].split('|'):
-                data[genre] = True
-    # 去除空值
-    if '' in data:
-        del data['']
-    return list(data.keys())
+    return build_facets()['genres']
 
 
-# 构建语言id字典
+# 构建语言列表，返回 [(语种, 歌曲数)]
 def build_languages():
-    data = {}
-    languages = Music.objects.values_list('language')
-    # print('languages', languages)
-    for language in languages:
-        if '|' not in language[0]:
-            lang = language[0].strip()
-            data[lang] = True
-        else:
-            for lang in language[0].split('|'):
-                lang = lang.strip()
-                data[lang] = True
-    if '' in data:
-        del data['']
-    return list(data.keys())
+    return build_facets()['languages']
 
 
 if __name__ == '__main__':
     print(build_genre_ids())
     print(build_languages())
     '''
-    ['流行', '摇滚', '电子', '舞曲', '民谣', 'R&B/Soul', '民族', '英伦', '金属', '朋克', '古风', '后摇', '爵士', '拉丁', '蓝调', '雷鬼', '世界音乐', '说唱', '乡村', '古典']
-    ['华语', '韩语', '英语', '日语', '台语', '纯音乐', '粤语']
+    [('流行', 1024), ('摇滚', 512), ('电子', 256), ...]
+    [('华语', 2048), ('韩语', 128), ('英语', 1024), ...]
     '''
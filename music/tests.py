@@ -1,3 +1,800 @@
-from django.test import TestCase
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from music import async_views, factor_model, hybrid, metrics
+from music.als import train_als
+from music.ann import build_index, evaluate_recall, load_index
+from music.catalog import sync_music_labels
+from music.factor_model import FactorModel, latest_version, load_model, new_version, save_model, train_svd
+from music.evaluation import evaluate, holdout_split, pareto_front
+from music.fold_in import _cache_key as fold_in_cache_key
+from music.fold_in import fold_in, sgd_update, user_ratings
+from music.interactions import Interactions
+from music.maintenance import save_checkpoint
+from music.models import Music, PendingSimilar, Recommendation, SimilarMusic, UserProfile
+from music.pagination import KeysetPaginator
+from music.recommend import _recommend_cache_key as recommend_cache_key
+from music.recommend import build_df, build_recommend_ids
+from music.scoring import score_items
+from music.search import index_musics, ngrams, search_musics
+from music.similarity import related_musics
+from music.subscribe import build_genre_ids, build_languages
+
+
+# 每个页面请求允许的最大查询数，不应随用户喜欢的歌曲数或推荐数量增长
+# 使用settings中配置的数据库缓存，与线上一致：缓存的每次读取都是一次查询，第一次请求还要写入缓存
+# （每次写入包括统计缓存条数、查询和写入等几条查询），所以分别检查第一次请求和缓存写入后再次请求的查询数
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Music.objects.bulk_create([
+            Music(song_name=f'歌曲{i}', song_length=200000, genre_ids='流行|摇滚',
+                  artist_name=f'歌手{i % 7}', composer='', lyricist='', language='国语')
+            for i in range(60)
+        ])
+        musics = list(Music.objects.order_by('pk'))
+        # bulk_create不触发信号，手动同步流派语种和搜索索引
+        sync_music_labels(musics)
+        index_musics(musics)
+        cls.profiles = []
+        for i in range(8):
+            user = User.objects.create_user(username=f'user{i}', password='pw')
+            profile = UserProfile.objects.create(user=user, first_run=False, genre_subscribe='流行',
+                                                 language_subscribe='国语')
+            profile.likes.add(*musics[i:i + 10 + i * 3])
+            profile.dislikes.add(*musics[40 + i:45 + i])
+            cls.profiles.append(profile)
+
+    def setUp(self):
+        cache.clear()
+        self.model_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_root)
+        settings_override = override_settings(MODEL_ROOT=self.model_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        factor_model._loaded_models.clear()
+        self.addCleanup(factor_model._loaded_models.clear)
+        save_model(train_svd(build_df(), n_factors=8, n_epochs=5))
+        # 混合推荐的歌曲特征在每个进程中只读取一次（曲库变化后重新读取），预先加载后只统计每个请求的查询
+        hybrid.clear_features()
+        self.addCleanup(hybrid.clear_features)
+        hybrid.load_features()
+
+    def assertMaxQueries(self, budget, url, warm_budget=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), budget, '\n'.join(query['sql'] for query in queries.captured_queries))
+        if warm_budget is not None:
+            with CaptureQueriesContext(connection) as warm_queries:
+                self.client.get(url)
+            self.assertLessEqual(len(warm_queries), warm_budget,
+                                 '\n'.join(query['sql'] for query in warm_queries.captured_queries))
+        return len(queries)
+
+    def test_recommend(self):
+        self.client.login(username='user0', password='pw')
+        self.assertMaxQueries(15, '/recommend', warm_budget=7)
+        # 翻页时推荐结果从缓存读取，不再计算推荐
+        self.assertMaxQueries(7, '/recommend?page=2')
+
+    def test_recommend_does_not_grow_with_likes(self):
+        counts = []
+        for profile in (self.profiles[0], self.profiles[-1]):
+            self.client.login(username=profile.user.username, password='pw')
+            counts.append(self.assertMaxQueries(15, '/recommend'))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_list_pages(self):
+        self.client.login(username='user1', password='pw')
+        self.assertMaxQueries(14, '/', warm_budget=8)
+        self.assertMaxQueries(15, '/search?keyword=歌曲&action=song_name', warm_budget=9)
+        self.assertMaxQueries(14, '/user', warm_budget=7)
+
+    def test_api_recommend(self):
+        self.client.login(username='user2', password='pw')
+        self.assertMaxQueries(15, '/api/recommend', warm_budget=7)
+
+
+# 多线程同时处理多个用户的请求时，推荐结果、提示信息和正在播放的歌曲不会串到其他用户
+# 会话保存在签名cookie中，避免多个线程同时写会话表
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class ConcurrencyTests(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        cache.clear()
+        Music.objects.bulk_create([
+            Music(song_name=f'歌曲-{i:03d}-', song_length=200000, genre_ids='流行' if i % 2 else '摇滚',
+                  artist_name=f'歌手{i % 7}', composer='', lyricist='', language='国语')
+            for i in range(60)
+        ])
+        self.musics = list(Music.objects.order_by('pk'))
+        sync_music_labels(self.musics)
+        self.users = []
+        for i in range(self.threads):
+            user = User.objects.create_user(username=f'user{i}', password='pw')
+            profile = UserProfile.objects.create(user=user, first_run=False, genre_subscribe='流行',
+                                                 language_subscribe='国语')
+            profile.likes.add(*self.musics[i:i + 10])
+            profile.dislikes.add(*self.musics[40 + i % 15:45 + i % 15])
+            self.users.append((user, set(profile.likes.values_list('pk', flat=True))
+                               | set(profile.dislikes.values_list('pk', flat=True))))
+        self.model_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_root)
+        settings_override = override_settings(MODEL_ROOT=self.model_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        factor_model._loaded_models.clear()
+        self.addCleanup(factor_model._loaded_models.clear)
+        hybrid.clear_features()
+        self.addCleanup(hybrid.clear_features)
+
+    # 每个线程使用一个用户的客户端，同时执行requests(i, client)，返回所有线程的结果
+    def run_threads(self, requests):
+        # 登录时会更新last_login，先在主线程中依次登录
+        clients = []
+        for user, _ in self.users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return list(executor.map(requests, range(self.threads), clients))
+
+    def test_recommend_and_play(self):
+        save_model(train_svd(build_df(), n_factors=8, n_epochs=5))
+
+        def requests(i, client):
+            for round_number in range(5):
+                response = client.get('/recommend')
+                self.assertEqual(response.status_code, 200)
+                recommended = {int(pk) for pk in re.findall(r'/play/(\d+)', response.content.decode())}
+                self.assertTrue(recommended)
+                self.assertFalse(recommended & self.users[i][1], '推荐了用户已经评分的歌曲')
+                # 清除缓存，下一轮重新计算推荐
+                cache.delete(f'recommend:{self.users[i][0].pk}:{factor_model.latest_version()}')
+
+                music = self.musics[(i * 7 + round_number) % len(self.musics)]
+                self.assertContains(client.get(f'/play/{music.pk}'), f'正在播放 - {music.song_name}')
+                # 不带id时播放的是自己刚才播放的歌曲，而不是其他用户的
+                self.assertContains(client.get('/play'), f'正在播放 - {music.song_name}')
+            return True
+
+        self.assertEqual(self.run_threads(requests), [True] * self.threads)
+
+    def test_messages_go_to_own_request(self):
+        # 没有训练模型时每个推荐请求都提示一次，提示只出现在发起推荐的请求中
+        def requests(i, client):
+            response = client.get('/recommend')
+            self.assertEqual(response.status_code, 200)
+            return response.content.decode().count('推荐模型尚未训练')
+
+        self.assertEqual(self.run_threads(requests), [1] * self.threads)
+
+
+# 随机生成的模型，用于不需要数据库的打分、索引和fold-in测试
+def random_model(n_items=400, n_factors=8, reg=0.02, seed=0):
+    rng = np.random.default_rng(seed)
+    return FactorModel(version='test', global_mean=0.5, user_bias=rng.normal(0, 0.1, 20),
+                       item_bias=rng.normal(0, 0.1, n_items), user_factors=rng.normal(0, 1, (20, n_factors)),
+                       item_factors=rng.normal(0, 1, (n_items, n_factors)), user_ids=np.arange(1, 21),
+                       item_ids=np.arange(1, n_items + 1), reg=reg)
+
+
+# 测试期间把模型保存到临时目录
+def use_temp_model_root(test):
+    model_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, model_root)
+    settings_override = override_settings(MODEL_ROOT=model_root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    factor_model._loaded_models.clear()
+    test.addCleanup(factor_model._loaded_models.clear)
+
+
+# 歌曲保存时由信号同步流派语种和搜索索引
+def create_music(song_name, artist_name='', language='国语', genre_ids='流行'):
+    return Music.objects.create(song_name=song_name, song_length=200000, genre_ids=genre_ids,
+                                artist_name=artist_name, composer='', lyricist='', language=language)
+
+
+class FoldInTests(SimpleTestCase):
+    def test_fold_in_recovers_user_vector(self):
+        model = random_model(n_items=30, reg=1e-9)
+        rng = np.random.default_rng(1)
+        user_factor, user_bias = rng.normal(0, 1, model.n_factors), 0.3
+        ratings = score_items(model, user_factor, user_bias)
+        # 模型中不存在的歌曲被忽略
+        factor, bias = fold_in(model, np.append(model.item_ids, 999), np.append(ratings, 1.0))
+        np.testing.assert_allclose(factor, user_factor, atol=1e-5)
+        self.assertAlmostEqual(bias, user_bias, places=5)
+        # 没有模型中的歌曲时返回零向量
+        factor, bias = fold_in(model, [999], [1.0])
+        self.assertFalse(factor.any())
+        self.assertEqual(bias, 0.0)
+
+    def test_sgd_update_moves_towards_rating(self):
+        model = random_model(n_items=30)
+        factor, bias = np.zeros(model.n_factors), 0.0
+        before = score_items(model, factor, bias)[5]
+        factor, bias = sgd_update(model, factor, bias, [model.item_ids[5]], [1.0], lr=0.05)
+        self.assertLess(abs(1.0 - score_items(model, factor, bias)[5]), abs(1.0 - before))
+
+
+# 异步视图中键相同的并发计算只执行一次，所有等待的请求得到同一个结果
+class CoalesceTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        calls = []
+        release = threading.Event()
+
+        def compute(user_id):
+            calls.append(user_id)
+            release.wait(5)
+            return [user_id]
+
+        async def run():
+            waiters = [asyncio.ensure_future(async_views.coalesce(('recommend', 1), compute, 1)) for _ in range(5)]
+            other = asyncio.ensure_future(async_views.coalesce(('recommend', 2), compute, 2))
+            await asyncio.sleep(0.05)
+            # 一个请求断开不影响其他请求共享的计算
+            waiters[0].cancel()
+            release.set()
+            results = await asyncio.gather(*waiters[1:], other)
+            self.assertEqual(sorted(calls), [1, 2])
+            # 计算完成后再次请求时重新计算
+            again = await async_views.coalesce(('recommend', 1), compute, 1)
+            return results, again
+
+        results, again = asyncio.run(run())
+        self.assertEqual(sorted(calls), [1, 1, 2])
+        self.assertTrue(all(result is results[0] for result in results[:4]))
+        self.assertEqual(results[4], [2])
+        self.assertEqual(again, [1])
+        self.assertIsNot(again, results[0])
+
+
+# 新注册的用户喜欢几首歌后，在线更新的用户向量与用全部评分重新求解的结果一致
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OnlineUpdateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.musics = [create_music(f'歌曲{i}') for i in range(40)]
+        for i in range(10):
+            profile = UserProfile.objects.create(user=User.objects.create_user(username=f'user{i}', password='pw'))
+            profile.likes.add(*self.musics[i:i + 10])
+        use_temp_model_root(self)
+        save_model(train_svd(build_df(), n_factors=8, n_epochs=5))
+
+    def test_new_user_vector_matches_fold_in(self):
+        self.client.post('/sign_up', {'username': 'new', 'password': 'pw'})
+        profile = UserProfile.objects.get(user__username='new')
+        model = load_model()
+        # 没有评分时不缓存零向量
+        self.assertIsNone(cache.get(fold_in_cache_key(model, profile.user_id)))
+        self.client.login(username='new', password='pw')
+        for music in self.musics[5:13]:
+            self.client.get(f'/like/{music.pk}')
+        factor, bias = cache.get(fold_in_cache_key(model, profile.user_id))
+        expected_factor, expected_bias = fold_in(model, *user_ratings(UserProfile.objects.get(pk=profile.pk)))
+        np.testing.assert_allclose(factor, expected_factor)
+        self.assertAlmostEqual(bias, expected_bias)
+        self.assertGreater(np.linalg.norm(factor), 0)
+
+
+# 离线计算的推荐结果（precompute_recommendations）；喜欢、不喜欢或修改订阅后，缓存的推荐结果和离线计算的推荐结果都被清除
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RecommendResultTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.musics = [create_music(f'歌曲{i}') for i in range(30)]
+        self.profiles = []
+        for i in range(6):
+            profile = UserProfile.objects.create(user=User.objects.create_user(username=f'user{i}', password='pw'),
+                                                 first_run=False, genre_subscribe='流行', language_subscribe='国语')
+            profile.likes.add(*self.musics[i:i + 8])
+            self.profiles.append(profile)
+        use_temp_model_root(self)
+        save_model(train_svd(build_df(), n_factors=8, n_epochs=5))
+
+    def test_rating_and_subscribing_invalidate(self):
+        profile = self.profiles[0]
+        key = recommend_cache_key(profile.user_id)
+        self.client.login(username='user0', password='pw')
+        for url, data in ((f'/like/{self.musics[20].pk}', None), (f'/dislike/{self.musics[21].pk}', None),
+                          ('/user', {'genres': ['摇滚'], 'languages': ['国语']})):
+            build_recommend_ids(None, profile)
+            Recommendation.objects.create(user=profile.user, music=self.musics[25], rank=0, score=1.0,
+                                          model_version=latest_version())
+            self.assertIsNotNone(cache.get(key))
+            if data is None:
+                self.client.get(url)
+            else:
+                self.client.post(url, data)
+            self.assertIsNone(cache.get(key), url)
+            self.assertFalse(Recommendation.objects.filter(user=profile.user).exists(), url)
+        # 其他用户的推荐结果不受影响
+        other = self.profiles[1]
+        build_recommend_ids(None, other)
+        self.client.get(f'/like/{self.musics[22].pk}')
+        self.assertIsNotNone(cache.get(recommend_cache_key(other.user_id)))
+
+    def test_precomputed_rows_are_served(self):
+        call_command('precompute_recommendations', workers=1, shard_size=4, top_n=10, stdout=StringIO())
+        version = latest_version()
+        for profile in self.profiles:
+            rows = list(Recommendation.objects.filter(user=profile.user).order_by('rank'))
+            self.assertEqual([row.rank for row in rows], list(range(10)))
+            self.assertTrue(all(row.model_version == version for row in rows))
+            # 分数从高到低排列，不包含已评分的歌曲
+            self.assertEqual([row.score for row in rows], sorted((row.score for row in rows), reverse=True))
+            self.assertFalse({row.music_id for row in rows} & profile.rated_ids)
+        # 推荐时直接读取离线计算的结果，不再在线计算
+        profile = self.profiles[2]
+        expected = list(Recommendation.objects.filter(user=profile.user).order_by('rank')
+                        .values_list('music_id', flat=True))
+        with mock.patch('music.recommend.build_predictions') as build_predictions:
+            self.assertEqual(build_recommend_ids(None, profile), expected)
+        build_predictions.assert_not_called()
+        # 模型版本变化后不再使用旧版本的结果
+        cache.clear()
+        Recommendation.objects.update(model_version='old')
+        with mock.patch('music.recommend.build_predictions', return_value=[self.musics[29].pk]) as build_predictions:
+            self.assertEqual(build_recommend_ids(None, profile), [self.musics[29].pk])
+        build_predictions.assert_called_once()
+
+
+class AnnIndexTests(SimpleTestCase):
+    def test_recall_against_exact_top_k(self):
+        model = random_model()
+        index = build_index(model, n_lists=16)
+        # 每首歌只属于一个簇
+        self.assertEqual(sorted(index.list_items.tolist()), list(range(len(model.item_ids))))
+        recalls = [evaluate_recall(model, index, k=10, nprobe=nprobe) for nprobe in (1, 4, 8, 16)]
+        # 检索的簇越多召回率越高，检索全部簇时与精确打分的前k个完全一致
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertEqual(recalls[-1], 1.0)
+
+
+class ModelStorageTests(SimpleTestCase):
+    def setUp(self):
+        use_temp_model_root(self)
+
+    def test_save_load_and_prune(self):
+        self.assertIsNone(load_model('svd'))
+        model = random_model()
+        model.version = new_version()
+        save_model(model, build_index(model, n_lists=4))
+        loaded = load_model('svd')
+        # 以只读的内存映射打开，内容与保存前相同
+        self.assertIsInstance(loaded.item_factors, np.memmap)
+        self.assertFalse(loaded.item_factors.flags.writeable)
+        np.testing.assert_array_equal(loaded.item_factors, model.item_factors)
+        self.assertEqual(loaded.item_index[model.item_ids[7]], 7)
+        self.assertEqual(load_index(loaded).n_lists, 4)
+        # 同一秒内训练的模型版本号不同，当前版本号通过os.replace整体替换
+        versions = [model.version]
+        for seed in range(1, 5):
+            model = random_model(seed=seed)
+            model.version = new_version()
+            with mock.patch('music.factor_model.os.replace', wraps=os.replace) as replace:
+                save_model(model)
+            replace.assert_called_once()
+            versions.append(model.version)
+            self.assertEqual(load_model('svd').version, model.version)
+        self.assertEqual(len(set(versions)), 5)
+        self.assertTrue(all(len(version) <= 20 for version in versions))
+        # 只保留最近的版本目录
+        self.assertEqual(sorted(name for name in os.listdir(settings.MODEL_ROOT) if name != 'svd-latest'),
+                         sorted(f'svd-{version}' for version in versions[-settings.MODEL_KEEP_VERSIONS:]))
+        self.assertEqual(factor_model.latest_version('svd'), versions[-1])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_ngram_search(self):
+        self.assertEqual(ngrams('晴天 Ｊａｙ'), {'晴', '天', '晴天', 'j', 'a', 'y', 'ja', 'ay'})
+        by_name = create_music('晴天', artist_name='周杰伦')
+        by_artist = create_music('七里香', artist_name='晴天乐队')
+        create_music('晴朗的天空')  # 包含两个字但不相邻
+        self.assertEqual([row['music_pk'] for row in search_musics('晴天')], [by_name.pk, by_artist.pk])
+        self.assertEqual([row['music_pk'] for row in search_musics('晴天', 'artist_name')], [by_artist.pk])
+        # 保存歌曲时重建索引
+        by_name.song_name = '稻香'
+        by_name.save()
+        self.assertEqual([row['music_pk'] for row in search_musics('晴天', 'song_name')], [])
+
+    def test_grams_must_be_adjacent_in_one_field(self):
+        create_music('爱情与情歌')  # 包含 '爱情' 和 '情歌'，但不包含 '爱情歌'
+        create_music('晴天', artist_name='天娃')  # '晴天' 和 '天娃' 来自不同字段
+        self.assertEqual(list(search_musics('爱情歌')), [])
+        self.assertEqual(list(search_musics('晴天娃')), [])
+        love_song = create_music('爱情歌')
+        self.assertEqual([row['music_pk'] for row in search_musics('爱情歌')], [love_song.pk])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_etag(self):
+        create_music('歌曲')
+        response = self.client.get('/api/musics')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get('/api/musics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # 返回的字段或曲库变化后ETag改变
+        self.assertNotEqual(self.client.get('/api/musics?fields=song_name', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        create_music('新歌')
+        response = self.client.get('/api/musics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+# 流派和语种的歌曲数从缓存读取，歌曲保存或删除后立即重新统计
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FacetCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_music_save_invalidates_facets(self):
+        first = create_music('歌曲1', genre_ids='流行|摇滚')
+        second = create_music('歌曲2', language='英语')
+        self.assertEqual(build_genre_ids(), [('流行', 2), ('摇滚', 1)])
+        self.assertEqual(build_languages(), [('国语', 1), ('英语', 1)])
+        with self.assertNumQueries(0):
+            build_genre_ids()
+            build_languages()
+        second.genre_ids = '摇滚'
+        second.language = '国语'
+        second.save()
+        self.assertEqual(build_genre_ids(), [('流行', 1), ('摇滚', 2)])
+        self.assertEqual(build_languages(), [('国语', 2)])
+        first.delete()
+        self.assertEqual(build_genre_ids(), [('摇滚', 1)])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class KeysetPaginationTests(TestCase):
+    def test_before_cursor(self):
+        pks = [create_music(f'歌曲{i}').pk for i in range(10)]
+        paginator = KeysetPaginator(Music.objects.all(), 3)
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        third = paginator.page(after=second.next_cursor)
+        self.assertEqual([music.pk for music in third], pks[6:9])
+        back = paginator.page(before=third.previous_cursor)
+        self.assertEqual([music.pk for music in back], pks[3:6])
+        self.assertTrue(back.has_previous())
+        self.assertEqual(back.next_cursor, second.next_cursor)
+        # 回到第一页时没有上一页
+        back = paginator.page(before=back.previous_cursor)
+        self.assertEqual([music.pk for music in back], pks[:3])
+        self.assertFalse(back.has_previous())
+        with self.assertRaises(ValueError):
+            paginator.page(before='not-a-cursor')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MaintenanceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_resume_from_checkpoint(self):
+        musics = [create_music(f'歌曲{i}', language='国\n语') for i in range(6)]
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(checkpoint))
+        call_command('clean_music_languages', dry_run=True, stdout=StringIO())
+        self.assertEqual(Music.objects.filter(language__contains='\n').count(), 6)
+        # 模拟前两批（4首）完成后中断，重新运行时从检查点之后继续
+        save_checkpoint(checkpoint, musics[3].pk)
+        call_command('clean_music_languages', checkpoint=checkpoint, batch_size=1, stdout=StringIO())
+        languages = list(Music.objects.order_by('pk').values_list('language', flat=True))
+        self.assertEqual(languages, ['国\n语'] * 4 + ['国语'] * 2)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_clean_languages_resyncs_labels(self):
+        music = create_music('歌曲', language='国\n语')
+        self.assertEqual(build_languages(), [('国\n语', 1)])
+        call_command('clean_music_languages', stdout=StringIO())
+        self.assertEqual(list(music.languages.values_list('name', flat=True)), ['国语'])
+        self.assertEqual(build_languages(), [('国语', 1)])
+
+    def test_translate_normalizes_language_codes(self):
+        music = create_music('歌曲', language='52.0\n', genre_ids='465|444')
+        call_command('translate_music_labels', stdout=StringIO())
+        music.refresh_from_db()
+        self.assertEqual((music.language, music.genre_ids), ('英语', '朋克|蓝调'))
+        self.assertEqual(list(music.languages.values_list('name', flat=True)), ['英语'])
+        self.assertEqual(build_languages(), [('英语', 1)])
+
+
+# 从CSV批量导入歌曲，流派和语言编号转换为中文，并同步流派语种、搜索索引和流派统计
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ImportMusicsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'songs.csv')
+
+    def import_csv(self, text, **options):
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        call_command('import_musics', self.path, stdout=StringIO(), **options)
+
+    def test_import(self):
+        self.import_csv('song_id,song_name,song_length,genre_ids,artist_name,composer,lyricist,language\n'
+                        's1,晴天,269000,465|1609,周杰伦,周杰伦,周杰伦,3.0\n'
+                        's2,七里香,299000.0,465|444,周杰伦,周杰伦,方文山,"52.0\n"\n'
+                        's3,稻香,223000,444,周杰伦,周杰伦,周杰伦,-1.0\n'
+                        's1,晴天（重录）,269000,465,周杰伦,周杰伦,周杰伦,3.0\n', batch_size=2)
+        musics = {music.song_id: music for music in Music.objects.all()}
+        self.assertEqual(len(musics), 3)
+        # 同一首歌的多行以最后一行为准，转换后重复的流派只保留一个
+        self.assertEqual(musics['s1'].song_name, '晴天（重录）')
+        self.assertEqual(musics['s2'].song_length, 299000)
+        self.assertEqual(musics['s2'].genre_ids, '朋克|蓝调')
+        self.assertEqual(musics['s2'].language, '英语')
+        self.assertEqual(sorted(musics['s2'].genres.values_list('name', flat=True)), ['朋克', '蓝调'])
+        self.assertEqual(list(musics['s2'].languages.values_list('name', flat=True)), ['英语'])
+        self.assertEqual(sorted(build_genre_ids()), [('朋克', 2), ('蓝调', 2)])
+        self.assertEqual(sorted(build_languages()), [('华语', 1), ('纯音乐', 1), ('英语', 1)])
+        self.assertEqual([row['music_pk'] for row in search_musics('七里', 'song_name')], [musics['s2'].pk])
+        # 再次导入时按song_id更新已有歌曲，没有url列时保留原来的链接
+        url = musics['s3'].url
+        self.import_csv('song_id,name,genre_ids,language\ns3,稻香,1609,24.0\ns4,新歌,444,3.0\n')
+        self.assertEqual(Music.objects.count(), 4)
+        music = Music.objects.get(song_id='s3')
+        self.assertEqual((music.genre_ids, music.language, music.url), ('朋克', '粤语', url))
+        self.assertEqual(sorted(build_genre_ids()), [('朋克', 3), ('蓝调', 2)])
+
+
+class AlsTests(SimpleTestCase):
+    def test_train(self):
+        # 两组用户分别喜欢1-10号和11-20号歌曲中的7首
+        rng = np.random.default_rng(0)
+        user_ids, item_ids = [], []
+        for user_id in range(1, 21):
+            group = np.arange(1, 11) if user_id <= 10 else np.arange(11, 21)
+            liked = rng.choice(group, 7, replace=False)
+            user_ids.extend([user_id] * len(liked))
+            item_ids.extend(liked)
+        interactions = Interactions(np.array(user_ids), np.array(item_ids), np.ones(len(user_ids)))
+        model = train_als(interactions, n_factors=4, n_iterations=10, threads=1)
+        self.assertEqual(model.engine, 'als')
+        self.assertEqual(model.item_factors.shape, (20, 4))
+        # 用户对同组中没有喜欢过的歌曲的评分高于另一组的歌曲
+        for user_id in (1, 15):
+            scores = score_items(model, model.user_factors[model.user_index[user_id]], 0.0)
+            own = model.item_ids <= 10 if user_id <= 10 else model.item_ids > 10
+            liked = np.isin(model.item_ids, interactions.item_ids[interactions.user_ids == user_id])
+            self.assertGreater(scores[own & ~liked].min(), scores[~own].max())
+        # 每个用户（歌曲）单独求解，多线程分块不影响结果
+        threaded = train_als(interactions, n_factors=4, n_iterations=10, threads=3)
+        np.testing.assert_allclose(threaded.item_factors, model.item_factors)
+
+
+# 离线评估指标，按手工计算的小例子检查
+class EvaluationTests(SimpleTestCase):
+    def test_metrics(self):
+        # 隐向量为0，所有用户的排序都是歌曲偏差从高到低：1, 2, 3, 4, 5, 6
+        model = FactorModel(version='test', global_mean=0.0, user_bias=np.zeros(2),
+                            item_bias=np.array([0.6, 0.5, 0.4, 0.3, 0.2, 0.1]), user_factors=np.zeros((2, 2)),
+                            item_factors=np.zeros((6, 2)), user_ids=np.array([1, 2]), item_ids=np.arange(1, 7))
+        train = Interactions(np.array([1, 2]), np.array([1, 2]), np.ones(2))
+        # 用户3不在模型中，不参与评估
+        test = {1: np.array([3, 6]), 2: np.array([1]), 3: np.array([1])}
+        result = evaluate(model, train, test, k=2)
+        # 用户1推荐2、3，命中第2位的3；用户2推荐1、3，命中第1位的1
+        self.assertEqual(result['users'], 2)
+        self.assertAlmostEqual(result['precision@2'], (1 / 2 + 1 / 2) / 2)
+        self.assertAlmostEqual(result['recall@2'], (1 / 2 + 1) / 2)
+        self.assertAlmostEqual(result['ndcg@2'], ((1 / np.log2(3)) / (1 + 1 / np.log2(3)) + 1) / 2)
+        self.assertAlmostEqual(result['coverage'], 3 / 6)
+
+    def test_holdout_split(self):
+        # 用户1喜欢5首、不喜欢1首，用户2只喜欢1首（少于min_likes），用户3喜欢2首
+        interactions = Interactions(np.array([1, 1, 1, 1, 1, 1, 2, 3, 3]), np.array([1, 2, 3, 4, 5, 6, 1, 2, 3]),
+                                    np.array([1, 1, 1, 1, 1, 0, 1, 1, 1]))
+        train, test = holdout_split(interactions, test_fraction=0.4, min_likes=2)
+        self.assertEqual(sorted(test), [1, 3])
+        self.assertEqual((len(test[1]), len(test[3])), (2, 1))
+        self.assertEqual(len(train.ratings), len(interactions.ratings) - 3)
+        # 只留出喜欢的歌曲，训练集中至少保留1首喜欢
+        for user_id, likes in ((1, {1, 2, 3, 4, 5}), (3, {2, 3})):
+            train_likes = set(train.item_ids[(train.user_ids == user_id) & (train.ratings == 1)].tolist())
+            self.assertTrue(train_likes)
+            self.assertEqual(set(test[user_id].tolist()) | train_likes, likes)
+            self.assertFalse(set(test[user_id].tolist()) & train_likes)
+        self.assertIn(6, train.item_ids[train.user_ids == 1])
+        # 同一个随机种子留出的歌曲相同
+        _, again = holdout_split(interactions, test_fraction=0.4, min_likes=2)
+        self.assertEqual({user_id: held.tolist() for user_id, held in again.items()},
+                         {user_id: held.tolist() for user_id, held in test.items()})
+
+    def test_pareto_front(self):
+        results = [('a', {'ndcg': 0.5, 'latency_ms': 1}), ('b', {'ndcg': 0.6, 'latency_ms': 2}),
+                   ('c', {'ndcg': 0.4, 'latency_ms': 3}), ('d', {'ndcg': 0.6, 'latency_ms': 2})]
+        # c 的质量更低、耗时更长，被 a 支配；b 和 d 相同，互不支配
+        self.assertEqual(pareto_front(results, 'ndcg'), [0, 1, 3])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HybridRankingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.musics = [create_music(f'歌曲{i}', genre_ids='流行' if i % 3 else '摇滚', language='国语' if i % 2 else '英语')
+                       for i in range(40)]
+        rng = np.random.default_rng(0)
+        for i in range(12):
+            profile = UserProfile.objects.create(user=User.objects.create_user(username=f'user{i}', password='pw'),
+                                                 genre_subscribe='流行', language_subscribe='国语')
+            profile.likes.add(*rng.choice(self.musics, 8, replace=False))
+        self.profile = profile
+        hybrid.clear_features()
+        self.addCleanup(hybrid.clear_features)
+
+    # 候选歌曲包含模型中的全部歌曲时，只在候选集合中排序与为所有歌曲打分的结果一致
+    def test_candidate_pool_matches_full_ranking(self):
+        model = train_svd(build_df(), n_factors=4, n_epochs=5)
+        inner_uid = model.user_index[self.profile.user_id]
+        vector = model.user_factors[inner_uid], model.user_bias[inner_uid]
+        full_ids, full_scores = hybrid.rank_musics(self.profile, 10, model, vector)
+        ids, scores = hybrid.rank_musics(self.profile, 10, model, vector, candidates=np.arange(len(model.item_ids)))
+        np.testing.assert_allclose(scores, full_scores)
+        self.assertEqual(ids.tolist(), full_ids.tolist())
+        # 冷启动只在订阅的歌曲和最热门的歌曲中排序
+        features = hybrid.load_features()
+        expected = hybrid.label_scores(features, self.profile.genre_subscribe, self.profile.language_subscribe)
+        _, expected = hybrid.top_musics(features, expected, self.profile.rated_ids, 10)
+        np.testing.assert_allclose(hybrid.rank_musics(self.profile, 10)[1], expected)
+
+    # 曲库变化后先返回旧的歌曲特征，在后台线程中重新读取
+    def test_features_refresh_in_background(self):
+        features = hybrid.load_features()
+        create_music('新歌')
+        with mock.patch.object(hybrid, '_refresh_in_background') as refresh:
+            self.assertIs(hybrid.load_features(), features)
+        refresh.assert_called_once_with()
+        self.assertEqual(len(hybrid.refresh_features().music_ids), len(features.music_ids) + 1)
+
+
+# 混合排序的总分：模型分 + 0.3 * 属于订阅的流派 + 0.2 * 属于订阅的语种 + 0.1 * 热度，按手工计算的结果排序
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   HYBRID_WEIGHTS={'model': 1.0, 'genre': 0.3, 'language': 0.2, 'popularity': 0.1})
+class HybridScoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.musics = [create_music('歌曲0', genre_ids='摇滚', language='英语'),
+                       create_music('歌曲1', genre_ids='流行', language='国语'),
+                       create_music('歌曲2', genre_ids='流行', language='英语'),
+                       create_music('歌曲3', genre_ids='摇滚', language='国语'),
+                       create_music('歌曲4', genre_ids='流行', language='国语')]
+        self.profile = UserProfile.objects.create(user=User.objects.create_user(username='user', password='pw'),
+                                                  genre_subscribe='摇滚', language_subscribe='英语')
+        self.profile.likes.add(self.musics[4])
+        # 喜欢人数：1号3人，2号和4号各1人；热度 = log(1 + 人数) / log(4)
+        for i, liked in enumerate(([1, 2], [1], [1])):
+            profile = UserProfile.objects.create(user=User.objects.create_user(username=f'other{i}', password='pw'))
+            profile.likes.add(*[self.musics[j] for j in liked])
+        hybrid.clear_features()
+        self.addCleanup(hybrid.clear_features)
+
+    def test_order(self):
+        pks = [music.pk for music in self.musics]
+        # 隐向量为0，模型分就是歌曲偏差：0号0.0，1号0.6，2号0.1，3号0.0
+        model = FactorModel(version='test', global_mean=0.0, user_bias=np.zeros(1),
+                            item_bias=np.array([0.0, 0.6, 0.1, 0.0]), user_factors=np.zeros((1, 2)),
+                            item_factors=np.zeros((4, 2)), user_ids=np.array([self.profile.user_id]),
+                            item_ids=np.array(pks[:4]))
+        vector = np.zeros(2), 0.0
+        # 1号 0.6 + 0.1；0号 0.3 + 0.2；2号 0.1 + 0.2 + 0.05；3号 0.3；4号已评分
+        expected = [(pks[1], 0.7), (pks[0], 0.5), (pks[2], 0.35), (pks[3], 0.3)]
+        for candidates in (None, np.arange(4), np.array([1])):
+            ids, scores = hybrid.rank_musics(self.profile, 10, model, vector, candidates=candidates)
+            self.assertEqual(ids.tolist(), [pk for pk, _ in expected])
+            np.testing.assert_allclose(scores, [score for _, score in expected])
+        # 没有模型分时只按订阅和热度排序：0号 0.5；3号 0.3；2号 0.2 + 0.05；1号 0.1
+        ids, scores = hybrid.rank_musics(self.profile, 3)
+        self.assertEqual(ids.tolist(), [pks[0], pks[3], pks[2]])
+        np.testing.assert_allclose(scores, [0.5, 0.3, 0.25])
+        # 只看热度
+        ids, _ = hybrid.rank_musics(self.profile, 10, model, vector,
+                                    weights={'model': 0.0, 'genre': 0.0, 'language': 0.0, 'popularity': 1.0})
+        self.assertEqual(ids.tolist()[:2], [pks[1], pks[2]])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SimilarityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.musics = [create_music(f'歌曲{i}') for i in range(6)]
+        # 前4个用户都喜欢0号和1号歌曲，后2个用户喜欢0号和2号歌曲
+        for i in range(6):
+            profile = UserProfile.objects.create(user=User.objects.create_user(username=f'user{i}', password='pw'))
+            profile.likes.add(self.musics[0], self.musics[1] if i < 4 else self.musics[2])
+
+    # 喜欢歌曲时只把歌曲加入待更新队列，由 build_similar_musics --pending 批量计算
+    def test_like_defers_similar_refresh(self):
+        self.client.login(username='user0', password='pw')
+        self.client.get(f'/like/{self.musics[3].pk}')
+        self.client.get(f'/dislike/{self.musics[3].pk}')
+        self.assertEqual(list(PendingSimilar.objects.values_list('music_id', flat=True)), [self.musics[3].pk])
+        self.assertFalse(SimilarMusic.objects.exists())
+        PendingSimilar.objects.create(music=self.musics[0])
+        call_command('build_similar_musics', pending=True, stdout=StringIO())
+        self.assertFalse(PendingSimilar.objects.exists())
+        self.assertEqual(related_musics(self.musics[0].pk), [self.musics[1], self.musics[2]])
+
+    def similar_scores(self, music):
+        return [(row.similar_id, round(row.score, 4))
+                for row in SimilarMusic.objects.filter(music=music).order_by('rank')]
+
+    # 共同喜欢的余弦相似度：同时喜欢的人数 / sqrt(两首歌各自被喜欢的人数之积)
+    def test_build_colike(self):
+        musics = self.musics
+        SimilarMusic.objects.create(music=musics[5], similar=musics[0], rank=0, score=1.0)  # 已经没有人喜欢的歌曲
+        PendingSimilar.objects.create(music=musics[1])
+        call_command('build_similar_musics', method='colike', workers=1, chunk_size=2, stdout=StringIO())
+        self.assertEqual(self.similar_scores(musics[0]),
+                         [(musics[1].pk, round(4 / np.sqrt(6 * 4), 4)), (musics[2].pk, round(2 / np.sqrt(6 * 2), 4))])
+        self.assertEqual(self.similar_scores(musics[1]), [(musics[0].pk, round(4 / np.sqrt(4 * 6), 4))])
+        self.assertEqual(self.similar_scores(musics[2]), [(musics[0].pk, round(2 / np.sqrt(2 * 6), 4))])
+        self.assertFalse(SimilarMusic.objects.filter(music=musics[5]).exists())
+        self.assertFalse(PendingSimilar.objects.exists())
+        self.assertEqual(related_musics(musics[0].pk, limit=1), [musics[1]])
+
+    # 隐向量的余弦相似度，不相似（相似度不大于0）的歌曲不保存
+    def test_build_factors(self):
+        use_temp_model_root(self)
+        item_factors = np.array([[1, 0], [2, 0.2], [1, 1], [-1, 0], [0, 1]])
+        save_model(FactorModel(version='test', global_mean=0.5, user_bias=np.zeros(1), item_bias=np.zeros(5),
+                               user_factors=np.ones((1, 2)), item_factors=item_factors, user_ids=np.array([1]),
+                               item_ids=np.array([music.pk for music in self.musics[:5]])))
+        call_command('build_similar_musics', method='factors', workers=1, top_n=2, stdout=StringIO())
+        pks = [music.pk for music in self.musics]
+        self.assertEqual(self.similar_scores(self.musics[0]), [(pks[1], 0.995), (pks[2], 0.7071)])
+        self.assertEqual(self.similar_scores(self.musics[3]), [])
+        self.assertEqual(self.similar_scores(self.musics[4]), [(pks[2], 0.7071), (pks[1], 0.0995)])
+        self.assertEqual(related_musics(self.musics[4].pk), [self.musics[2], self.musics[1]])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MetricsTests(TestCase):
+    def request_queries(self, route):
+        return sum(value for (name, labels), value in metrics._counters.items()
+                   if name == 'mrs_request_queries_total' and ('route', route) in labels)
+
+    # 流式响应的内容在视图返回后才查询数据库，这些查询也计入请求
+    def test_streaming_body_is_counted(self):
+        create_music('歌曲')
+        before = self.request_queries('api/musics')
+        response = self.client.get('/api/musics')
+        self.assertEqual(self.request_queries('api/musics'), before)
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(response.streaming_content)
+        self.assertGreater(len(queries), 0)
+        self.assertGreaterEqual(self.request_queries('api/musics') - before, len(queries))
@@ -5,16 +5,21 @@ from django.contrib.auth.models import User
 from django.core.paginator import Paginator
 from django.http import HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
+from django.utils.http import urlencode
 
 from .decorators import cold_boot
+from .fold_in import update_user
+from .metrics import span
 from .models import Music, UserProfile
-from .recommend import build_recommend
+from .pagination import KeysetPaginator
+from .profiles import get_profile
+from .recommend import build_recommend_ids, invalidate_recommend, load_musics
+from .search import search_musics
+from .similarity import mark_similar_stale, related_musics
 from .subscribe import build_genre_ids, build_languages
 
-# 当前播放
-current_play = None
-# 当前推荐
-current_recommend = []
+# 当前播放的歌曲id保存在用户的会话中，每个用户互不影响
+CURRENT_PLAY_SESSION_KEY = 'current_play'
 
 
 # 首页
@@ -24,22 +29,22 @@ def home(request):
 
 @cold_boot
 def all(request):
-    page_number = request.GET.get('page', 1)
-    queryset = Music.objects.all()
-    paginator = Paginator(queryset, 10)  # 分页
-    musics = paginator.page(page_number)
+    # 按id键集分页，翻到多深都和第一页一样快；总数从缓存读取
+    paginator = KeysetPaginator(Music.objects.all(), 10, count_key='musics')
+    try:
+        musics = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except ValueError:
+        musics = paginator.page()
     context = {
         'musics': musics,
         'user_likes': [],
         'user_dislikes': []
     }
     # 如果登录的首页
-    if request.user.is_authenticated:
-        user_profile = UserProfile.objects.filter(user=request.user)
-        if user_profile.exists():
-            user_profile = user_profile.first()  # 用户信息
-            context['user_likes'] = user_profile.likes.all()  # 获取用户喜欢或不喜欢的数据
-            context['user_dislikes'] = user_profile.dislikes.all()
+    user_profile = get_profile(request)  # 用户信息，同一个请求只查询一次
+    if user_profile is not None:
+        context['user_likes'] = user_profile.like_ids  # 获取用户喜欢或不喜欢的歌曲id
+        context['user_dislikes'] = user_profile.dislike_ids
     return render(request, 'list.html', context)
 
 
@@ -52,6 +57,7 @@ def sign_up(request):
             messages.add_message(request, messages.ERROR, '该用户已存在！')
         else:
             user_obj = User.objects.create_user(username=username, password=password)
+            # 新用户还没有评分，不需要求解用户向量，第一次喜欢或不喜欢时再求解
             UserProfile.objects.create(user=user_obj)
             messages.add_message(request, messages.SUCCESS, '注册成功！')
             return HttpResponseRedirect('/sign_in')
@@ -82,37 +88,44 @@ def user_logout(request):
     return HttpResponseRedirect('/')
 
 
+# 推荐列表的一页，同步和异步视图共用
+def recommend_page(recommend_ids, page_number):
+    paginator = Paginator(recommend_ids, 10)  # 分页
+    musics = paginator.page(page_number)  # 推荐的音乐
+    musics.object_list = load_musics(musics.object_list)  # 只查询当前页的10首歌曲
+    return musics
+
+
 @login_required(login_url='/sign_in')
 @cold_boot
 def recommend(request):
     page_number = request.GET.get('page', 1)
 
     # -------------------- 推荐 --------------------------
-    recommend_set = build_recommend(request, request.user)  # 获取推荐的数据
+    user_profile = get_profile(request)  # 装饰器中已经加载过，不会重复查询
+    recommend_ids = build_recommend_ids(request, user_profile)  # 获取推荐的歌曲id，翻页时从缓存读取
     # -------------------- 推荐 --------------------------
 
-    paginator = Paginator(recommend_set, 10)  # 分页
-    musics = paginator.page(page_number)  # 推荐的音乐
+    musics = recommend_page(recommend_ids, page_number)
     context = {
         'musics': musics,
-        'user_likes': [],
-        'user_dislikes': []
+        'user_likes': user_profile.like_ids,
+        'user_dislikes': user_profile.dislike_ids
     }
-    user_profile = UserProfile.objects.filter(user=request.user)
-    if user_profile.exists():
-        user_profile = user_profile.first()
-        context['user_likes'] = user_profile.likes.all()
-        context['user_dislikes'] = user_profile.dislikes.all()
-    return render(request, 'list.html', context)
+    with span('render'):
+        return render(request, 'list.html', context)
 
 
 # 用户添加喜欢
 @login_required(login_url='/sign_in')
 def like(request, pk: int):
-    user_obj = UserProfile.objects.get(user=request.user)
+    user_obj = get_object_or_404(UserProfile.objects.select_related('user'), user=request.user)
     music_obj = get_object_or_404(Music.objects.all(), pk=pk)  # 通过id查找歌曲信息
     user_obj.likes.add(music_obj)  # 添加喜欢
     user_obj.dislikes.remove(music_obj)  # 删除不喜欢
+    update_user(user_obj, music_obj.pk, 1)  # 在线更新用户向量，无需重新训练模型
+    mark_similar_stale(music_obj.pk)  # 喜欢这首歌的人变了，相似歌曲稍后由 build_similar_musics --pending 更新
+    invalidate_recommend(request.user)  # 推荐结果需要重新计算
     messages.add_message(request, messages.INFO, '已经添加到我喜欢')
     redirect_url = request.GET.get('from', '/')
     if 'action' in request.GET:
@@ -123,10 +136,13 @@ def like(request, pk: int):
 # 用户添加不喜欢
 @login_required(login_url='/sign_in')
 def dislike(request, pk: int):
-    user_obj = UserProfile.objects.get(user=request.user)
+    user_obj = get_object_or_404(UserProfile.objects.select_related('user'), user=request.user)
     music_obj = get_object_or_404(Music.objects.all(), pk=pk)  # 通过id查找歌曲信息
     user_obj.dislikes.add(music_obj)  # 添加到不喜欢
     user_obj.likes.remove(music_obj)  # 删除喜欢
+    update_user(user_obj, music_obj.pk, 0)  # 在线更新用户向量，无需重新训练模型
+    mark_similar_stale(music_obj.pk)  # 喜欢这首歌的人可能变了，相似歌曲稍后由 build_similar_musics --pending 更新
+    invalidate_recommend(request.user)  # 推荐结果需要重新计算
     messages.add_message(request, messages.INFO, '已经添加到我不喜欢')
     redirect_url = request.GET.get('from', '/')
     if 'action' in request.GET:
@@ -134,28 +150,37 @@ def dislike(request, pk: int):
     return HttpResponseRedirect(redirect_url)
 
 
+# 查找要播放的歌曲，pk为0或歌曲不存在时返回当前用户正在播放的歌曲，同步和异步视图共用
+def play_music(request, pk: int = 0):
+    current_pk = request.session.get(CURRENT_PLAY_SESSION_KEY)
+    if pk > 0:  # 存在id
+        music_obj = Music.objects.filter(pk=pk).first()
+        if music_obj is not None:
+            if music_obj.pk != current_pk:  # 换歌时才写会话
+                request.session[CURRENT_PLAY_SESSION_KEY] = music_obj.pk
+            return music_obj
+    if current_pk is None:
+        return None
+    return Music.objects.filter(pk=current_pk).first()
+
+
 # 播放歌曲
 def play(request, pk: int = 0):
-    global current_play
-    if pk > 0:  # 存在id
-        music_obj = Music.objects.filter(pk=pk)
-        if music_obj.exists():
-            current_play = music_obj.first()
-    if current_play is None:
+    music_obj = play_music(request, pk)
+    if music_obj is None:
         messages.error(request, '当前没有正在播放的音乐')
         return HttpResponseRedirect('/')
     return render(request, 'play.html', context={
-        'music': current_play
+        'music': music_obj,
+        'related_musics': related_musics(music_obj.pk)  # 相似歌曲，一次索引查询
     })
 
 
 # 用户信息
 @login_required(login_url='/sign_in')
 def user_center(request):
-    user_profile = UserProfile.objects.filter(user=request.user)
-    if user_profile.exists():
-        profile_obj: UserProfile = user_profile.first()
-    else:
+    profile_obj = get_profile(request)
+    if profile_obj is None:
         messages.error(request, '找不到用户资料，请重新登录')
         logout(request)
         return HttpResponseRedirect('/')
@@ -180,6 +205,7 @@ def user_center(request):
             profile_obj.language_subscribe = ''
             profile_obj.save()
             messages.success(request, '修改语言订阅成功！')
+        invalidate_recommend(request.user)  # 订阅变化后推荐结果需要重新计算
     context = {
         'user_likes': profile_obj.likes.all(),
         'user_dislikes': profile_obj.dislikes.all(),
@@ -195,6 +221,19 @@ def user_center(request):
     return render(request, 'user.html', context=context)
 
 
+# 搜索结果的一页，返回（结果总数，当前页），同步和异步视图共用
+def search_page(keyword, action, after=None, before=None):
+    # 两种方式搜索：按歌曲名或歌手，通过n-gram索引查询并按相关度排序
+    paginator = KeysetPaginator(search_musics(keyword, action), 10, keys=('-score', 'music_pk'),
+                                count_key=f'search:{action}:{keyword}')  # 按（得分，id）键集分页
+    try:
+        musics = paginator.page(after=after, before=before)
+    except ValueError:
+        musics = paginator.page()
+    musics.object_list = load_musics([row['music_pk'] for row in musics.object_list])  # 只查询当前页的歌曲
+    return paginator.count, musics
+
+
 # 搜索歌曲
 def search(request):
     if 'keyword' not in request.GET:
@@ -202,22 +241,17 @@ def search(request):
         return HttpResponseRedirect('/')
     keyword = request.GET.get('keyword')
     action = request.GET.get('action')
-    # 两种方式搜索
-    musics = []
-    if action == 'song_name':
-        musics = Music.objects.filter(song_name__contains=keyword)
-    if action == 'artist_name':
-        musics = Music.objects.filter(artist_name__contains=keyword)
-    messages.info(request, f'搜索关键词：{keyword}，找到 {len(musics)} 首音乐')
+    count, musics = search_page(keyword, action, request.GET.get('after'), request.GET.get('before'))
+    messages.info(request, f'搜索关键词：{keyword}，找到 {count} 首音乐')
     context = {
         'musics': musics,
+        'page_params': urlencode({'keyword': keyword, 'action': action or ''}) + '&',  # 翻页时保留搜索条件
         'user_likes': [],
         'user_dislikes': []
     }
-    if request.user.is_authenticated:
-        user_profile = UserProfile.objects.filter(user=request.user)
-        if user_profile.exists():
-            user_profile = user_profile.first()
-            context['user_likes'] = user_profile.likes.all()
-            context['user_dislikes'] = user_profile.dislikes.all()
-    return render(request, 'list.html', context)
+    user_profile = get_profile(request)
+    if user_profile is not None:
+        context['user_likes'] = user_profile.like_ids
+        context['user_dislikes'] = user_profile.dislike_ids
+    with span('render'):
+        return render(request, 'list.html', context)